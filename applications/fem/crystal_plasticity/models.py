@@ -7,6 +7,7 @@ import sys
 from functools import partial
 
 from jax_am.fem.models import Mechanics
+from jax_am.fem.internal_vars import GrainConstant, vmap_cells_quads
 
 
 from jax.config import config
@@ -68,12 +69,13 @@ class CrystalPlasticity(Mechanics):
             for j in range(num_directions_per_normal):
                 self.q[i, i//num_directions_per_normal*num_directions_per_normal + j] = 1.
 
-        rot_mats = onp.array(get_rot_mat_vmap(quat)[cell_ori_inds])
+        # Orientations are stored once per grain, (num_grains, dim, dim)
+        rot_mats = onp.array(get_rot_mat_vmap(quat))
 
         Fp_inv_gp = onp.repeat(onp.repeat(onp.eye(self.dim)[None, None, :, :], len(self.cells), axis=0), self.num_quads, axis=1)
         slip_resistance_gp = self.gss_initial*onp.ones((len(self.cells), self.num_quads, num_slip_sys))
         slip_gp = onp.zeros_like(slip_resistance_gp)
-        rot_mats_gp = onp.repeat(rot_mats[:, None, :, :], self.num_quads, axis=1)
+        rot_mats_grain = GrainConstant(rot_mats, cell_ori_inds)
         self.C = onp.zeros((self.dim, self.dim, self.dim, self.dim))
 
         C11 = 1.684e5
@@ -114,7 +116,11 @@ class CrystalPlasticity(Mechanics):
         self.C[1, 0, 0, 1] = C44
         self.C[1, 0, 1, 0] = C44
 
-        self.internal_vars = {'laplace': [Fp_inv_gp, slip_resistance_gp, slip_gp, rot_mats_gp]}
+        self.internal_vars = {'laplace': [Fp_inv_gp, slip_resistance_gp, slip_gp, rot_mats_grain]}
+
+    def get_kernel_params(self):
+        # The drivers set the time step size dt before each solve
+        return ('dt',)
 
     def get_tensor_map(self):
         tensor_map, _ = self.get_maps()
@@ -145,7 +151,7 @@ class CrystalPlasticity(Mechanics):
                 y = newton_solver(x)
                 S = unflatten_fn(y)
                 Fp_inv_new, slip_resistance_new, slip_new, Fe, F = helper(u_grad, Fp_inv_old, slip_resistance_old, slip_old, rot_mat, S)
-                return Fp_inv_new, slip_resistance_new, slip_new, rot_mat
+                return Fp_inv_new, slip_resistance_new, slip_new
 
             def helper(u_grad, Fp_inv_old, slip_resistance_old, slip_old, rot_mat, S):
                 tau = np.sum(S[None, :, :] * rotate_tensor_rank_2_vmap(rot_mat, self.Schmid_tensors), axis=(1, 2))
@@ -244,14 +250,14 @@ class CrystalPlasticity(Mechanics):
 
     def update_int_vars_gp(self, sol, params):
         _, update_int_vars_map = self.get_maps()
-        vmap_update_int_vars_map = jax.jit(jax.vmap(jax.vmap(update_int_vars_map)))
+        vmap_update_int_vars_map = jax.jit(vmap_cells_quads(update_int_vars_map))
         # (num_cells, 1, num_nodes, vec, 1) * (num_cells, num_quads, num_nodes, 1, dim) -> (num_cells, num_quads, num_nodes, vec, dim) 
         u_grads = np.take(sol, self.cells, axis=0)[:, None, :, :, None] * self.shape_grads[:, :, :, None, :] 
         u_grads = np.sum(u_grads, axis=2) # (num_cells, num_quads, vec, dim)
-        Fp_inv_gp, slip_resistance_gp, slip_gp, rot_mats_gp = \
-            vmap_update_int_vars_map(u_grads, *params)
-        # TODO
-        return [Fp_inv_gp, slip_resistance_gp, slip_gp, rot_mats_gp]
+        Fp_inv_gp, slip_resistance_gp, slip_gp = vmap_update_int_vars_map(u_grads, *params)
+        # Orientations do not evolve
+        rot_mats_grain = params[-1]
+        return [Fp_inv_gp, slip_resistance_gp, slip_gp, rot_mats_grain]
 
     def set_params(self, params):
         self.internal_vars['laplace'] = params
@@ -259,7 +265,7 @@ class CrystalPlasticity(Mechanics):
     def inspect_interval_vars(self, params):
         """For post-processing only
         """
-        Fp_inv_gp, slip_resistance_gp, slip_gp, rot_mats_gp = params
+        Fp_inv_gp, slip_resistance_gp, slip_gp, rot_mats_grain = params
         F_p = np.linalg.inv(Fp_inv_gp[0, 0])
         print(f"Fp = \n{F_p}")
         slip_resistance_0 = slip_resistance_gp[0, 0, 0]
@@ -274,7 +280,7 @@ class CrystalPlasticity(Mechanics):
         u_grads = np.sum(u_grads, axis=2) # (num_cells, num_quads, vec, dim)
 
         partial_tensor_map, _ = self.get_maps()
-        vmap_partial_tensor_map = jax.jit(jax.vmap(jax.vmap(partial_tensor_map)))
+        vmap_partial_tensor_map = jax.jit(vmap_cells_quads(partial_tensor_map))
         P = vmap_partial_tensor_map(u_grads, *params)
 
         def P_to_sigma(P, F):
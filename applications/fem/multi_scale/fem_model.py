@@ -32,6 +32,15 @@ class HyperElasticity(Mechanics):
         else:
             raise NotImplementedError(f"mode = {self.mode} is not defined.")
 
+    def get_kernel_params(self):
+        # The macroscopic displacement gradient H_bar is set for each RVE sample, see rve.py
+        return ('H_bar',) if self.mode == 'rve' else ()
+
+    def set_params(self, params):
+        """The macroscopic displacement gradient H_bar of an RVE sample, batched by ensemble_solver, see rve.py
+        """
+        self.H_bar = params
+
     def get_tensor_map(self):
         stress_map, _ = self.get_maps()
         return stress_map
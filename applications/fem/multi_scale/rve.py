@@ -8,7 +8,7 @@ from functools import partial
 from scipy.stats import qmc
 
 from jax_am.fem.generate_mesh import Mesh, box_mesh
-from jax_am.fem.solver import solver, assign_bc, get_A_fn_linear_fn
+from jax_am.fem.solver import solver, ensemble_solver, assign_bc, get_A_fn_linear_fn
 from jax_am.fem.utils import save_sol
 
 from applications.fem.multi_scale.arguments import args
@@ -134,21 +134,25 @@ def check_one_rve():
     print(onp.load(file_path))
 
 
-def solve_rve_problem(problem, sample_H_bar):
-    base_H_bar = flat_to_tensor(sample_H_bar)
-    problem.H_bar = base_H_bar
-    sol_fluc = solver(problem)
-    energy = problem.compute_energy(sol_fluc)
+def solve_rve_problems(problem, samples_H_bar):
+    """All samples are solved at once by ensemble_solver, with quasi-static steps if that fails
+    """
+    base_H_bars = np.stack([flat_to_tensor(sample_H_bar) for sample_H_bar in samples_H_bar])
     ratios = [0.25, 0.5, 0.75, 0.9, 1.]
-    if np.any(np.isnan(energy)):
+    try:
+        sols_fluc = ensemble_solver(problem, params=base_H_bars)
+    except AssertionError:
         print(f"Solve with quasi-static steps...")
-        sol_fluc = np.zeros((problem.num_total_nodes, problem.vec))
+        sols_fluc = np.zeros((len(base_H_bars), problem.num_total_nodes, problem.vec))
         for ratio in ratios:
-            problem.H_bar = ratio * base_H_bar
-            sol_fluc = solver(problem)
-        energy = problem.compute_energy(sol_fluc)
+            sols_fluc = ensemble_solver(problem, params=ratio * base_H_bars, initial_guess=sols_fluc)
+
+    energies = []
+    for sol_fluc, base_H_bar in zip(sols_fluc, base_H_bars):
+        problem.H_bar = base_H_bar
+        energies.append(problem.compute_energy(sol_fluc))
 
-    return sol_fluc, np.hstack((sample_H_bar, energy))
+    return sols_fluc, np.hstack((samples_H_bar, np.array(energies)[:, None]))
 
 
 def generate_samples():
@@ -179,6 +183,8 @@ def collect_data():
     samples = generate_samples()
     complete = [i for i in range(len(samples))]
 
+    # Samples solved at once by ensemble_solver
+    batch_size = 16
     onp.random.seed(args.device)
     while True:
         files = glob.glob(root_numpy + f"/*.npy")
@@ -186,20 +192,29 @@ def collect_data():
         todo = list(set(complete) - set(done))
         if len(todo) == 0:
             break
-        chosen_ind = onp.random.choice(todo)
-        print(f"\nSolving problem # {chosen_ind} on device = {args.device}, done = {len(done)}, todo = {len(todo)}, total = {len(complete)} ")
-        sample_H_bar = samples[chosen_ind]
-        sol_fluc, data = solve_rve_problem(problem, sample_H_bar)
-        if np.any(np.isnan(data)):
+        chosen_inds = onp.random.choice(todo, size=min(batch_size, len(todo)), replace=False)
+        print(f"\nSolving problems # {chosen_inds} on device = {args.device}, done = {len(done)}, todo = {len(todo)}, total = {len(complete)} ")
+        samples_H_bar = samples[chosen_inds]
+        try:
+            sols_fluc, data = solve_rve_problems(problem, samples_H_bar)
+        except AssertionError:
             print(f"######################################### Failed solve, check why!")
-            onp.savetxt(os.path.join(root_numpy, f"{chosen_ind:05d}.txt"), sample_H_bar)
-        else:
-            print(f"Saving data = {data}")
-            onp.save(os.path.join(root_numpy, f"{chosen_ind:05d}.npy"), data)
-
-        sol_disp = problem.fluc_to_disp(sol_fluc)
-        jax_vtu_path = os.path.join(root_vtk, f"sol_disp_{chosen_ind:05d}.vtu")
-        save_sol(problem, sol_disp, jax_vtu_path)
+            for chosen_ind, sample_H_bar in zip(chosen_inds, samples_H_bar):
+                onp.savetxt(os.path.join(root_numpy, f"{chosen_ind:05d}.txt"), sample_H_bar)
+            continue
+
+        for chosen_ind, sol_fluc, sample_data in zip(chosen_inds, sols_fluc, data):
+            if np.any(np.isnan(sample_data)):
+                print(f"######################################### Failed solve of # {chosen_ind}, check why!")
+                onp.savetxt(os.path.join(root_numpy, f"{chosen_ind:05d}.txt"), sample_data[:-1])
+            else:
+                print(f"Saving data = {sample_data}")
+                onp.save(os.path.join(root_numpy, f"{chosen_ind:05d}.npy"), sample_data)
+
+            problem.H_bar = flat_to_tensor(sample_data[:-1])
+            sol_disp = problem.fluc_to_disp(sol_fluc)
+            jax_vtu_path = os.path.join(root_vtk, f"sol_disp_{chosen_ind:05d}.vtu")
+            save_sol(problem, sol_disp, jax_vtu_path)
 
 
 if __name__=="__main__":
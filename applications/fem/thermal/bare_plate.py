@@ -7,15 +7,18 @@ import meshio
 
 from jax_am.fem.generate_mesh import box_mesh, Mesh
 from jax_am.fem.solver import solver
+from jax_am.fem.cache import geometry_cache
 from jax_am.fem.utils import save_sol
 
-from applications.fem.thermal.models import Thermal, initialize_hash_map, update_hash_map, get_active_mesh
+from applications.fem.thermal.models import Thermal, initialize_external_faces, update_external_faces, get_active_mesh
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "3"
 data_dir = os.path.join(os.path.dirname(__file__), 'data') 
 
 
 def bare_plate_single_track():
+    # Problems on the growing active mesh only compute the geometric factors of newly born cells
+    geometry_cache.max_bytes = 2**30
     t_total = 5.
     vel = 0.01
     dt = 1e-2
@@ -65,8 +68,7 @@ def bare_plate_single_track():
 
     active_cell_truth_tab = onp.ones(len(full_mesh.cells), dtype=bool)
     active_mesh, points_map_active, cells_map_full = get_active_mesh(full_mesh, active_cell_truth_tab)
-    external_faces, cells_face, hash_map, inner_faces, all_faces = initialize_hash_map(full_mesh, 
-        active_cell_truth_tab, cells_map_full, ele_type)
+    external_faces, face_counts = initialize_external_faces(full_mesh, active_cell_truth_tab, cells_map_full, ele_type)
     sol = T0*np.ones((len(active_mesh.points), vec))
 
     problem = Thermal(active_mesh, vec=vec, dim=dim, neumann_bc_info=neumann_bc_info, 
@@ -5,7 +5,6 @@ import os
 
 from jax_am.fem.generate_mesh import Mesh
 from jax_am.fem.core import FEM
-from jax_am.fem.basis import get_face_shape_vals_and_grads
 
 
 class Thermal(FEM):
@@ -68,44 +67,28 @@ class Thermal(FEM):
         return boundary_inds_list
 
 
-def hash_map_for_faces(active_cell_truth_tab, cells_face, hash_map, inner_faces, all_faces, cell_inds):
-    """Use a hash table to store inner faces
+def initialize_external_faces(full_mesh, active_cell_truth_tab, cells_map_full, ele_type):
+    """External faces of the active cells, in the indexing of the active mesh.
+    face_counts is kept to update the external faces incrementally when cells are born.
     """
-    for i, cell_id in enumerate(cell_inds):
-        if active_cell_truth_tab[cell_id]:
-            for face_id in range(len(cells_face[cell_id])):
-                key = tuple(cells_face[cell_id, face_id].tolist())
-                if key in hash_map.keys():
-                    inner_faces.append(hash_map[key])
-                    inner_faces.append((cell_id, face_id))
-                else:
-                    hash_map[key] = (cell_id, face_id)
-                all_faces.append((cell_id, face_id))
-    external_faces = onp.array(list((set(all_faces) - set(inner_faces))))
-    return external_faces
-
-
-def initialize_hash_map(full_mesh, active_cell_truth_tab, cells_map_full, ele_type):
-    print(f"Initializing hash map for external faces...")
-     # (num_faces, num_face_vertices)
-    _, _, _, _, face_inds = get_face_shape_vals_and_grads(ele_type)
-    cells_face = full_mesh.cells[:, face_inds] # (num_cells, num_faces, num_face_vertices)
-    cells_face = onp.sort(cells_face)
-    hash_map = {}
-    inner_faces = []
-    all_faces = []
-    cell_inds = onp.arange(len(cells_face))
-    external_faces = hash_map_for_faces(active_cell_truth_tab, cells_face, hash_map, inner_faces, all_faces, cell_inds)
+    print(f"Initializing external faces...")
+    topology = full_mesh.get_topology(ele_type)
+    face_counts = topology.count_faces(onp.argwhere(active_cell_truth_tab).reshape(-1))
+    external_faces = topology.get_external_faces(active_cell_truth_tab, face_counts)
     external_faces[:, 0] = cells_map_full[external_faces[:, 0]]
-    return external_faces, cells_face, hash_map, inner_faces, all_faces
+    return external_faces, face_counts
 
 
-def update_hash_map(active_cell_truth_tab_old, active_cell_truth_tab_new, cells_map_full, cells_face, hash_map, inner_faces, all_faces):
-    print(f"Updating hash map for external faces...")
+def update_external_faces(full_mesh, active_cell_truth_tab_old, active_cell_truth_tab_new, cells_map_full, face_counts, ele_type):
+    """Only the faces of newly born cells are counted
+    """
+    print(f"Updating external faces...")
+    topology = full_mesh.get_topology(ele_type)
     new_born_cell_inds = onp.argwhere(active_cell_truth_tab_old != active_cell_truth_tab_new).reshape(-1)
-    external_faces = hash_map_for_faces(active_cell_truth_tab_new, cells_face, hash_map, inner_faces, all_faces, new_born_cell_inds)
+    face_counts = topology.count_faces(new_born_cell_inds, face_counts)
+    external_faces = topology.get_external_faces(active_cell_truth_tab_new, face_counts)
     external_faces[:, 0] = cells_map_full[external_faces[:, 0]]
-    return external_faces, hash_map, inner_faces, all_faces
+    return external_faces, face_counts
 
 
 def get_active_mesh(mesh, active_cell_truth_tab):
@@ -9,15 +9,18 @@ import time
 from jax_am.fem.generate_mesh import Mesh
 from jax_am.fem.core import FEM
 from jax_am.fem.solver import solver
+from jax_am.fem.cache import geometry_cache
 from jax_am.fem.utils import save_sol
 
-from applications.fem.thermal.models import Thermal, initialize_hash_map, update_hash_map, get_active_mesh
+from applications.fem.thermal.models import Thermal, initialize_external_faces, update_external_faces, get_active_mesh
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "1"
 data_dir = os.path.join(os.path.dirname(__file__), 'data') 
 
 
 def ded_thin_wall():
+    # Problems on the growing active mesh only compute the geometric factors of newly born cells
+    geometry_cache.max_bytes = 2**30
     T0 = 300.
     Cp = 500.
     L = 290e3
@@ -56,8 +59,7 @@ def ded_thin_wall():
     thinwall_mesh.write(os.path.join(vtk_dir, f"thinwall_mesh.vtu"))
     active_cell_truth_tab_old = active_cell_truth_tab
 
-    external_faces, cells_face, hash_map, inner_faces, all_faces = initialize_hash_map(full_mesh, 
-        active_cell_truth_tab, cells_map_full, ele_type)
+    external_faces, face_counts = initialize_external_faces(full_mesh, active_cell_truth_tab, cells_map_full, ele_type)
 
     toolpath = onp.loadtxt(os.path.join(data_dir, f'toolpath/thinwall_toolpath.crs'))
     toolpath[:, 1:4] = toolpath[:, 1:4]/1e3
@@ -88,8 +90,10 @@ def ded_thin_wall():
             t = onp.linspace(toolpath[i - 1, 0], toolpath[i, 0], num_laser_off + 1)
             dt = t[1] - t[0]
             sol = full_sol[points_map_active] 
+            # Conduction and heat capacity are linear with a fixed dt, the old temperature only enters the loads,
+            # so the Jacobian is assembled once per problem
             problem = Thermal(active_mesh, vec=vec, dim=dim, dirichlet_bc_info=[[],[],[]], neumann_bc_info=neumann_bc_info_laser_off, 
-                              additional_info=(sol, rho, Cp, dt, external_faces))
+                              additional_info=(sol, rho, Cp, dt, external_faces), linear_operator=True)
             for j in range(num_laser_off):
                 print(f"\n############################################################")
                 print(f"Laser off: i = {i} in {toolpath.shape[0]} , j = {j} in {num_laser_off}")
@@ -119,8 +123,8 @@ def ded_thin_wall():
                 active_mesh, points_map_active, cells_map_full = get_active_mesh(full_mesh, active_cell_truth_tab)
                 sol = full_sol[points_map_active]
                 dt = t[j + 1] - t[j]
-                external_faces, hash_map, inner_faces, all_faces = update_hash_map(active_cell_truth_tab_old, 
-                    active_cell_truth_tab, cells_map_full, cells_face, hash_map, inner_faces, all_faces)
+                external_faces, face_counts = update_external_faces(full_mesh, active_cell_truth_tab_old,
+                    active_cell_truth_tab, cells_map_full, face_counts, ele_type)
 
                 if onp.all(active_cell_truth_tab == active_cell_truth_tab_old):
                     print(f"No element born")
@@ -128,7 +132,7 @@ def ded_thin_wall():
                 else:
                     print(f"New elements born")
                     problem = Thermal(active_mesh, vec=vec, dim=dim, dirichlet_bc_info=[[],[],[]], neumann_bc_info=neumann_bc_info_laser_on, 
-                                      additional_info=(sol, rho, Cp, dt, external_faces))
+                                      additional_info=(sol, rho, Cp, dt, external_faces), linear_operator=True)
                 sol = solver(problem, linear=True)
                 problem.update_int_vars(sol)
                 full_sol = full_sol.at[points_map_active].set(sol)
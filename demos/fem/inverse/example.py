@@ -32,6 +32,9 @@ class HyperElasticity(FEM):
             return P
         return first_PK_stress
 
+    def get_kernel_params(self):
+        return ('E',)
+
     def set_params(self, params):
         E, rho, scale_d, scale_n, scale_s = params
         self.E = E
@@ -1,5 +1,6 @@
 import basix
 import numpy as onp
+import functools
 
 from jax_am import logger
 
@@ -40,14 +41,14 @@ def get_elements(ele_type):
                     17, 10, 12, 15, 14, 22, 23, 21, 24, 20, 25, 26]
         basix_ele = basix.CellType.hexahedron
         basix_face_ele = basix.CellType.quadrilateral
-        gauss_order = 10 # 6x6x6, full integration
+        gauss_order = 10 # 6x6x6, full integration is 3x3x3 (quadrature='full')
         degree = 2
     elif ele_type == 'HEX20':
         re_order = [0, 1, 3, 2, 4, 5, 7, 6, 8, 11, 13, 9, 16, 18, 19, 17, 10, 12, 15, 14]
         element_family = basix.ElementFamily.serendipity
         basix_ele = basix.CellType.hexahedron
         basix_face_ele = basix.CellType.quadrilateral
-        gauss_order = 2 # 6x6x6, full integration
+        gauss_order = 2 # 2x2x2, reduced integration, full integration is 3x3x3 (quadrature='full')
         degree = 2
     elif ele_type == 'TET4':
         re_order = [0, 1, 2, 3]
@@ -93,16 +94,58 @@ def get_elements(ele_type):
     return element_family, basix_ele, basix_face_ele, gauss_order, degree, re_order
 
 
+def get_gauss_order(ele_type, quadrature=None):
+    """Resolve a quadrature specification to a basix quadrature order,
+    i.e., the polynomial degree integrated exactly by the (minimal) rule basix provides.
+
+    Parameters
+    ----------
+    ele_type : str
+    quadrature : None, int or str
+        None : the element default in get_elements
+        int : exact for polynomials of this degree
+        'full' : exact (grad_u, grad_v) on affine cells, e.g., 2x2x2 for HEX8, 3x3x3 for HEX27 and HEX20
+        'reduced' : one point less per direction than full for tensor-product cells, e.g., 1 for HEX8
+        'selective' : full, the volumetric part is integrated with the reduced rule (see FEM)
+
+    Returns
+    -------
+    gauss_order : int
+    """
+    element_family, basix_ele, basix_face_ele, gauss_order, degree, re_order = get_elements(ele_type)
+    tensor_product = basix_ele in [basix.CellType.hexahedron, basix.CellType.quadrilateral]
+    if quadrature is None:
+        return gauss_order
+    if isinstance(quadrature, (int, onp.integer)) and not isinstance(quadrature, bool):
+        assert quadrature >= 0, f"Quadrature order must be non-negative, got {quadrature}"
+        return int(quadrature)
+    if quadrature in ['full', 'selective']:
+        # A Gauss rule with m points per direction is exact up to degree 2m - 1
+        return 2*degree if tensor_product else 2*(degree - 1)
+    if quadrature == 'reduced':
+        return 2*degree - 2 if tensor_product else max(2*(degree - 1) - 1, 0)
+    raise ValueError(f"Unknown quadrature specification {quadrature}, "
+                     f"expected None, an integer order, 'full', 'reduced' or 'selective'")
+
+
 def reorder_inds(inds, re_order):
-    new_inds = []
-    for ind in inds.reshape(-1):
-        new_inds.append(onp.argwhere(re_order == ind))
-    new_inds = onp.array(new_inds).reshape(inds.shape)
+    # Inverse permutation: new_inds[i] is the position of inds[i] in re_order
+    new_inds = onp.argsort(onp.array(re_order))[inds]
     return new_inds
 
 
-def get_shape_vals_and_grads(ele_type):
-    """TODO: Add comments
+def read_only(*arrays):
+    """Tables returned by the cached functions below are shared by all problems, so we protect them from in-place modification.
+    """
+    for array in arrays:
+        array.setflags(write=False)
+    return arrays
+
+
+@functools.lru_cache(maxsize=None)
+def get_shape_vals_and_grads(ele_type, gauss_order=None):
+    """Shape function values and reference gradients at quadrature points,
+    gauss_order defaults to the element default in get_elements.
 
     Returns
     -------
@@ -113,18 +156,21 @@ def get_shape_vals_and_grads(ele_type):
     weights: ndarray
         (8,) = (num_quads,)
     """
-    element_family, basix_ele, basix_face_ele, gauss_order, degree, re_order = get_elements(ele_type)
+    element_family, basix_ele, basix_face_ele, default_order, degree, re_order = get_elements(ele_type)
+    gauss_order = default_order if gauss_order is None else gauss_order
     quad_points, weights = basix.make_quadrature(basix_ele, gauss_order)
     element = basix.create_element(element_family, basix_ele, degree)
     vals_and_grads = element.tabulate(1, quad_points)[:, :, re_order, :]
     shape_values = vals_and_grads[0, :, :, 0]
     shape_grads_ref = onp.transpose(vals_and_grads[1:, :, :, 0], axes=(1, 2, 0))
     logger.debug(f"ele_type = {ele_type}, quad_points.shape = (num_quads, dim) = {quad_points.shape}")
-    return shape_values, shape_grads_ref, weights
+    return read_only(shape_values, shape_grads_ref, weights)
 
 
-def get_face_shape_vals_and_grads(ele_type):
-    """TODO: Add comments
+@functools.lru_cache(maxsize=None)
+def get_face_shape_vals_and_grads(ele_type, gauss_order=None):
+    """Shape function values and reference gradients at face quadrature points,
+    gauss_order defaults to the element default in get_elements.
 
     Returns
     -------
@@ -139,7 +185,8 @@ def get_face_shape_vals_and_grads(ele_type):
     face_inds: ndarray
         (6, 4) = (num_faces, num_face_vertices)
     """
-    element_family, basix_ele, basix_face_ele, gauss_order, degree, re_order = get_elements(ele_type)
+    element_family, basix_ele, basix_face_ele, default_order, degree, re_order = get_elements(ele_type)
+    gauss_order = default_order if gauss_order is None else gauss_order
 
     # TODO: Check if this is correct.
     points, weights = basix.make_quadrature(basix_face_ele, gauss_order)
@@ -182,4 +229,63 @@ def get_face_shape_vals_and_grads(ele_type):
     face_shape_grads_ref = vals_and_grads[1:, :, :, 0].reshape(dim, num_faces, num_face_quads, -1)
     face_shape_grads_ref = onp.transpose(face_shape_grads_ref, axes=(1, 2, 3, 0))
     logger.debug(f"face_quad_points.shape = (num_faces, num_face_quads, dim) = {face_quad_points.shape}")
-    return face_shape_vals, face_shape_grads_ref, face_weights, face_normals, face_inds
+    return read_only(face_shape_vals, face_shape_grads_ref, face_weights, face_normals, face_inds)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tensor_product_tables(ele_type, gauss_order=None):
+    """1D tables for sum factorization on hexahedral Lagrange elements with tensor-product Gauss quadrature.
+    A 3D basis function (or quadrature point) is identified by the lexicographic position
+    t = (i*n + j)*n + k of its 1D factors along x, y and z.
+
+    Returns
+    -------
+    None if the element is not a tensor product, otherwise
+    basis_vals_1d : ndarray
+        (num_quads_1d, num_nodes_1d)
+    basis_grads_1d : ndarray
+        (num_quads_1d, num_nodes_1d)
+    tensor_node_inds : ndarray
+        (num_nodes,) tensor_node_inds[t] is the node at lexicographic position t
+    tensor_quad_inds : ndarray
+        (num_quads,) tensor_quad_inds[t] is the quadrature point at lexicographic position t
+    """
+    element_family, basix_ele, basix_face_ele, default_order, degree, re_order = get_elements(ele_type)
+    gauss_order = default_order if gauss_order is None else gauss_order
+    if element_family != basix.ElementFamily.P or basix_ele != basix.CellType.hexahedron:
+        return None
+
+    def get_lexicographic_inds(points, points_1d):
+        # (num_points, dim) -> (num_points, dim), position of each coordinate in points_1d
+        inds_1d = onp.argmin(onp.abs(points[:, :, None] - points_1d[None, None, :]), axis=-1)
+        n = len(points_1d)
+        flat_inds = (inds_1d[:, 0]*n + inds_1d[:, 1])*n + inds_1d[:, 2]
+        if not onp.allclose(points_1d[inds_1d], points) or len(onp.unique(flat_inds)) != n**3 \
+           or len(points) != n**3:
+            return None
+        return onp.argsort(flat_inds)
+
+    quad_points, _ = basix.make_quadrature(basix_ele, gauss_order)
+    quad_points_1d, _ = basix.make_quadrature(basix.CellType.interval, gauss_order)
+    element = basix.create_element(element_family, basix_ele, degree)
+    element_1d = basix.create_element(element_family, basix.CellType.interval, degree)
+    tensor_node_inds = get_lexicographic_inds(element.points[re_order], element_1d.points[:, 0])
+    tensor_quad_inds = get_lexicographic_inds(quad_points, quad_points_1d[:, 0])
+    if tensor_node_inds is None or tensor_quad_inds is None:
+        return None
+
+    vals_and_grads_1d = element_1d.tabulate(1, quad_points_1d)
+    basis_vals_1d = vals_and_grads_1d[0, :, :, 0]
+    basis_grads_1d = vals_and_grads_1d[1, :, :, 0]
+
+    # Sanity check against the 3D tables
+    shape_values, _, _ = get_shape_vals_and_grads(ele_type, gauss_order)
+    num_quads, num_nodes = shape_values.shape
+    shape_values_tensor = onp.einsum('ai,bj,ck->abcijk', basis_vals_1d, basis_vals_1d,
+                                     basis_vals_1d).reshape(num_quads, num_nodes)
+    if not onp.allclose(shape_values[tensor_quad_inds][:, tensor_node_inds], shape_values_tensor):
+        return None
+
+    logger.debug(f"ele_type = {ele_type}, tensor-product tables with {len(quad_points_1d)} quads and "
+                 f"{len(element_1d.points)} nodes along each axis")
+    return read_only(basis_vals_1d, basis_grads_1d, tensor_node_inds, tensor_quad_inds)
@@ -0,0 +1,157 @@
+"""Process-wide caches shared by FEM problems.
+
+Reference-element tables (basix tabulation) are cached in jax_am.fem.basis with
+functools.lru_cache. Here we cache per-mesh geometric factors (physical shape
+function gradients, JxW, etc.), which are expensive to recompute when a problem
+is constructed many times on the same or a growing mesh, e.g., element birth in
+additive manufacturing simulations.
+
+The geometry cache is disabled by default, since its entries outlive the problems that created them.
+Enable it with a memory budget, and free its memory with clear():
+    from jax_am.fem.cache import geometry_cache
+    geometry_cache.max_bytes = 2**30
+    ...
+    geometry_cache.clear()
+"""
+import numpy as onp
+import hashlib
+from collections import OrderedDict
+
+from jax_am import logger
+
+
+def content_hash(*arrays):
+    """Hash of array contents (shape, dtype and data)
+
+    Returns
+    -------
+    digest : str
+    """
+    h = hashlib.sha1()
+    for array in arrays:
+        array = onp.ascontiguousarray(array)
+        h.update(str((array.shape, array.dtype.str)).encode())
+        h.update(array.data)
+    return h.hexdigest()
+
+
+def as_rows(array):
+    """View each row of a 2D array as a single opaque element, so that rows can be sorted and searched.
+    """
+    array = onp.ascontiguousarray(array)
+    return array.view(onp.dtype((onp.void, array.dtype.itemsize * array.shape[1]))).reshape(-1)
+
+
+class GeometryCache():
+    """LRU cache of per-cell geometric factors, keyed by the content hash of points and cells.
+
+    When a mesh is not found, the most recent entry computed with the same reference
+    element is reused for all cells whose nodal coordinates coincide (e.g., cells that
+    were already active before new cells are appended), so only new cells are computed.
+
+    Attributes
+    ----------
+    max_bytes : int
+        Maximum memory of the entries (geometric factors, and the points and cells they are computed on),
+        the least recently used entries are dropped first. 0 disables the cache.
+    nbytes : int
+        Memory of the entries
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """Drop all entries, and the memory they hold
+        """
+        self.entries.clear()
+        self.nbytes = 0
+
+    def evict(self):
+        """Drop the least recently used entries until their memory is at most max_bytes
+        """
+        while self.nbytes > max(self.max_bytes, 0):
+            _, entry = self.entries.popitem(last=False)
+            self.nbytes -= entry['nbytes']
+
+    def get(self, table_key, points, cells, compute_fn):
+        """
+        Parameters
+        ----------
+        table_key : Hashable
+            Identifies the reference element tables, e.g., (ele_type, quadrature)
+        points : onp.ndarray
+            (num_total_nodes, dim)
+        cells : onp.ndarray
+            (num_cells, num_nodes)
+        compute_fn : Callable
+            compute_fn(cell_inds) returns a tuple of arrays, each with leading axis len(cell_inds)
+
+        Returns
+        -------
+        values : tuple
+            Arrays with leading axis num_cells. If the cache is enabled, they are shared, so they are read-only.
+        """
+        points = onp.asarray(points)
+        cells = onp.asarray(cells)
+        # max_bytes may have been lowered since the last call
+        self.evict()
+        if self.max_bytes <= 0:
+            return compute_fn(onp.arange(len(cells)))
+
+        mesh_hash = content_hash(points, cells)
+        key = (table_key, mesh_hash)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            logger.debug(f"Geometry cache hit")
+            return self.entries[key]['values']
+
+        self.misses += 1
+        values = self.extend(table_key, points, cells, compute_fn)
+        for value in values:
+            value.setflags(write=False)
+        entry = {'points': points.copy(), 'cells': cells.copy(), 'values': values}
+        entry['nbytes'] = points.nbytes + cells.nbytes + sum(value.nbytes for value in values)
+        self.entries[key] = entry
+        self.nbytes += entry['nbytes']
+        # An entry larger than max_bytes is not kept either
+        self.evict()
+        return values
+
+    def extend(self, table_key, points, cells, compute_fn):
+        """Reuse cells of the most recent entry with the same reference element, compute the rest.
+        """
+        candidates = [entry for (k, _), entry in reversed(self.entries.items()) if k == table_key]
+        num_cells = len(cells)
+        if len(candidates) == 0 or candidates[0]['points'].shape[1] != points.shape[1] or num_cells == 0:
+            return compute_fn(onp.arange(num_cells))
+
+        entry = candidates[0]
+        old_rows = as_rows(onp.take(entry['points'], entry['cells'], axis=0).reshape(len(entry['cells']), -1))
+        new_rows = as_rows(onp.take(points, cells, axis=0).reshape(num_cells, -1))
+        sorter = onp.argsort(old_rows)
+        pos = onp.clip(onp.searchsorted(old_rows[sorter], new_rows), 0, len(old_rows) - 1)
+        old_inds = sorter[pos]
+        found = old_rows[old_inds] == new_rows
+        new_inds = onp.argwhere(~found).reshape(-1)
+        logger.debug(f"Geometry cache extension: reusing {num_cells - len(new_inds)} cells, computing {len(new_inds)} cells")
+
+        if len(new_inds) == num_cells:
+            return compute_fn(onp.arange(num_cells))
+
+        old_values = entry['values']
+        new_values = compute_fn(new_inds)
+        values = []
+        for old_value, new_value in zip(old_values, new_values):
+            value = onp.empty((num_cells,) + old_value.shape[1:], dtype=old_value.dtype)
+            value[found] = old_value[old_inds[found]]
+            value[new_inds] = new_value
+            values.append(value)
+        return tuple(values)
+
+
+geometry_cache = GeometryCache()
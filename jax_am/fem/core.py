@@ -1,4 +1,5 @@
 import numpy as onp
+import scipy
 import jax
 import jax.numpy as np
 import sys
@@ -9,20 +10,46 @@ from typing import Any, Callable, Optional, List, Union
 
 from jax_am.common import timeit
 from jax_am.fem.generate_mesh import Mesh
-from jax_am.fem.basis import get_face_shape_vals_and_grads, get_shape_vals_and_grads
+from jax_am.fem.basis import get_face_shape_vals_and_grads, get_shape_vals_and_grads, get_tensor_product_tables, \
+    get_gauss_order
+from jax_am.fem.sparsity import SparsityPattern
+from jax_am.fem.cache import geometry_cache
+from jax_am.fem.internal_vars import vmap_quads, to_cells
+from jax_am.fem.precision import get_precision_policy, cast
 from jax_am.fem.autodiff_utils import jax_array_list_to_numpy_diff
-from jax.config import config
 from jax_am import logger
 
-
-config.update("jax_enable_x64", True)
-
 onp.set_printoptions(threshold=sys.maxsize,
                      linewidth=1000,
                      suppress=True,
                      precision=5)
 
 
+# Methods of child classes that create material maps
+material_map_names = ['get_tensor_map', 'get_mass_map', 'get_energy_density', 'get_volumetric_tensor_map']
+
+
+def is_param_value(value):
+    """Values that compiled kernels can take as traced arguments, see FEM.get_kernel_params
+    """
+    return isinstance(value, (float, complex, onp.ndarray, onp.floating, jax.Array, jax.core.Tracer))
+
+
+def record_param_attributes(set_params):
+    """Wrap set_params of a child class to record the attributes it assigns array or float values to.
+    """
+    @functools.wraps(set_params)
+    def set_params_recorded(self, params):
+        old_values = dict(self.__dict__)
+        result = set_params(self, params)
+        names = [name for name, value in self.__dict__.items()
+                 if is_param_value(value) and (name not in old_values or old_values[name] is not value)]
+        self.param_attributes = tuple(sorted(set(getattr(self, 'param_attributes', ())).union(names)))
+        return result
+
+    return set_params_recorded
+
+
 @dataclass
 class FEM:
     """
@@ -79,6 +106,53 @@ class FEM:
         A function that inputs a point and returns the body force at this point
     additional_info : Any
         Other information that the FEM solver should know
+    batch_memory_budget : float
+        Approximate memory (in bytes) that one batch of cells may use when computing
+        cell residuals and Jacobians. Determines the batch size.
+    symmetric : bool
+        Opt-in symmetric assembly for problems derived from an energy. The child class must
+        implement get_energy_density, the residual is its gradient and the element tangent its
+        Hessian (forward-over-reverse AD). Only the upper triangle of the global matrix is stored.
+        The mass kernel (if any) is assumed to have a symmetric Jacobian.
+    sum_factorization : bool
+        Evaluate solution gradients at quadrature points, and apply the transposed test function
+        gradients, through 1D basis tables along each axis, with per-cell inverse Jacobians.
+        The dense v_grads_JxW is then not stored. None selects it automatically for HEX8 and HEX27.
+    time_dependent_source : bool
+        The body force from source_info is cached, and recomputed only when source_info is replaced
+        by another function. Set to True if source_info reads attributes that change between solves
+        (e.g., time or parameters), so that it is recomputed at every residual evaluation.
+    quadrature : None, int or str
+        Quadrature rule for cell and face integrals, see basis.get_gauss_order.
+        None keeps the element default, an integer is the polynomial degree integrated exactly,
+        'full' and 'reduced' are the usual full/reduced integration rules.
+        'selective' integrates with the full rule, except for the volumetric part of the
+        tensor map returned by get_volumetric_tensor_map (child class must implement it),
+        which is integrated with the reduced rule, e.g., to avoid volumetric locking.
+    precision : None, str or PrecisionPolicy
+        Floating point precision of cell Jacobians, global assembly and linear solves,
+        see precision.get_precision_policy. None is float64 throughout.
+        Residuals are always evaluated in the accumulation precision, so that a Newton solve with
+        float32 tangents still converges to a float64 residual.
+        Kernels run in the dtype of the solution passed to them, material maps should create
+        constants with the dtype of their inputs (their outputs are cast anyway).
+    num_devices : int
+        Number of local devices the cell kernels are sharded over, None uses a single device.
+        Each device evaluates its share of the cell batches and scatter-adds them into its own copy of
+        the global residual and CSR values, which are then summed across devices.
+        On CPU, N devices are created with XLA_FLAGS=--xla_force_host_platform_device_count=N,
+        set before jax is imported.
+    linear_operator : bool
+        The global Jacobian is constant: it depends neither on the solution nor on internal variables or
+        parameters that change between solves (e.g., linear elasticity, or a linear heat equation step
+        with a fixed time step size, whose old solution only enters body force and Neumann terms).
+        The Jacobian is then assembled once and cached, residuals are the cached matrix times the solution
+        plus the cached residual at a zero solution (e.g., of an affine Cauchy term a (u - u_0)) minus body force
+        and Neumann terms, and the solvers keep its preconditioner (or PETSc factorization).
+        The cell and Cauchy terms must therefore be affine in the solution, with an offset that does not change either.
+        Call invalidate_kernels after changing what the Jacobian depends on, except for the attributes
+        of get_kernel_params, whose new values are detected.
+        None uses detect_linear_operator.
     """
     mesh: Mesh
     vec: int
@@ -90,41 +164,90 @@ class FEM:
     cauchy_bc_info: Optional[List[Union[List[Callable], List[Callable]]]] = None
     source_info: Callable = None
     additional_info: Any = ()
+    batch_memory_budget: float = 2.**31
+    symmetric: bool = False
+    sum_factorization: Optional[bool] = None
+    quadrature: Any = None
+    time_dependent_source: bool = False
+    precision: Any = None
+    num_devices: Optional[int] = None
+    linear_operator: Optional[bool] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'set_params' in cls.__dict__:
+            cls.set_params = record_param_attributes(cls.__dict__['set_params'])
 
     def __post_init__(self):
+        # Before anything is computed with JAX, since float64 requires jax_enable_x64
+        self.precision_policy = get_precision_policy(self.precision)
+        self.precision_policy.enable()
         self.points = self.mesh.points
         self.cells = self.mesh.cells
         self.num_cells = len(self.cells)
         self.num_total_nodes = len(self.mesh.points)
         self.num_total_dofs = self.num_total_nodes * self.vec
+        if self.symmetric:
+            assert hasattr(self, 'get_energy_density'), \
+                f"Symmetric assembly requires get_energy_density to be implemented"
+        self.selective = self.quadrature == 'selective'
+        if self.selective:
+            assert hasattr(self, 'get_volumetric_tensor_map'), \
+                f"Selective integration requires get_volumetric_tensor_map to be implemented"
+            assert not self.symmetric, f"Selective integration is not supported with symmetric assembly"
+        self.gauss_order = get_gauss_order(self.ele_type, self.quadrature)
+        if self.get_num_devices() > 1:
+            assert len(jax.local_devices()) >= self.num_devices, \
+                f"num_devices = {self.num_devices}, but only {len(jax.local_devices())} local devices are available. " \
+                f"On CPU, set XLA_FLAGS=--xla_force_host_platform_device_count={self.num_devices} before importing jax"
 
         start = time.time()
         logger.debug(f"Computing shape function values, gradients, etc.")
 
         self.shape_vals, self.shape_grads_ref, self.quad_weights = get_shape_vals_and_grads(
-            self.ele_type)
+            self.ele_type, self.gauss_order)
         self.face_shape_vals, self.face_shape_grads_ref, self.face_quad_weights, self.face_normals, self.face_inds \
-        = get_face_shape_vals_and_grads(self.ele_type)
+        = get_face_shape_vals_and_grads(self.ele_type, self.gauss_order)
         self.num_quads = self.shape_vals.shape[0]
         self.num_nodes = self.shape_vals.shape[1]
         self.num_faces = self.face_shape_vals.shape[0]
-        self.shape_grads, self.JxW = self.get_shape_grads()
+
+        if self.selective:
+            _, self.vol_shape_grads_ref, self.vol_quad_weights = get_shape_vals_and_grads(
+                self.ele_type, get_gauss_order(self.ele_type, 'reduced'))
+
+        self.tensor_product_tables = get_tensor_product_tables(self.ele_type, self.gauss_order)
+        if self.sum_factorization is None:
+            self.sum_factorization = self.ele_type in ['HEX8', 'HEX27'] and self.tensor_product_tables is not None
+        assert not self.sum_factorization or self.tensor_product_tables is not None, \
+            f"Sum factorization is not available for ele_type = {self.ele_type}"
+
+        geometry = geometry_cache.get((self.ele_type, self.gauss_order, self.sum_factorization, self.selective),
+                                      self.points, self.cells, self.compute_geometry)
+        if self.selective:
+            # (num_cells, num_vol_quads, num_nodes, dim), (num_cells, num_vol_quads, num_nodes, 1, dim)
+            self.vol_shape_grads, self.vol_v_grads_JxW = geometry[3:]
+            geometry = geometry[:3]
+        if self.sum_factorization:
+            # (num_cells, num_quads, num_nodes, dim), (num_cells, num_quads), (num_cells, num_quads, dim, dim)
+            self.shape_grads, self.JxW, self.inv_jacobians = geometry
+            self.v_grads_JxW = None
+        else:
+            # (num_cells, num_quads, num_nodes, dim), (num_cells, num_quads), (num_cells, num_quads, num_nodes, 1, dim)
+            self.shape_grads, self.JxW, self.v_grads_JxW = geometry
 
         self.node_inds_list, self.vec_inds_list, self.vals_list = self.Dirichlet_boundary_conditions(
             self.dirichlet_bc_info)
         self.p_node_inds_list_A, self.p_node_inds_list_B, self.p_vec_inds_list = self.periodic_boundary_conditions(
         )
 
-        # (num_cells, num_quads, num_nodes, 1, dim)
-        self.v_grads_JxW = self.shape_grads[:, :, :,
-                                            None, :] * self.JxW[:, :, None,
-                                                                None, None]
-
         end = time.time()
         compute_time = end - start
 
         self.internal_vars = {}
+        self.kernel_cache = {}
         self.compute_Neumann_boundary_inds()
+        self.compute_Cauchy_boundary_inds()
 
         logger.debug(f"Done pre-computations, took {compute_time} [s]")
         logger.info(
@@ -138,12 +261,84 @@ class FEM:
         """
         pass
 
-    def get_shape_grads(self):
+    def compute_geometry(self, cell_inds):
+        """Per-cell geometric factors, evaluated for a subset of cells so that the geometry cache
+        only needs to compute cells it has not seen.
+
+        Parameters
+        ----------
+        cell_inds : onp.ndarray
+            (num_selected_cells,)
+
+        Returns
+        -------
+        shape_grads_physical : onp.ndarray
+            (num_selected_cells, num_quads, num_nodes, dim)
+        JxW : onp.ndarray
+            (num_selected_cells, num_quads)
+        v_grads_JxW : onp.ndarray
+            (num_selected_cells, num_quads, num_nodes, 1, dim)
+            With sum factorization, the inverse Jacobians (num_selected_cells, num_quads, dim, dim) instead
+        vol_shape_grads, vol_v_grads_JxW : onp.ndarray
+            Only with selective integration, the same quantities on the reduced rule
+        """
+        shape_grads, JxW = self.get_shape_grads(cell_inds)
+        if self.sum_factorization:
+            _, inv_jacobians = self.get_jacobians(cell_inds)
+            geometry = (shape_grads, JxW, inv_jacobians)
+        else:
+            v_grads_JxW = shape_grads[:, :, :, None, :] * JxW[:, :, None, None, None]
+            geometry = (shape_grads, JxW, v_grads_JxW)
+        if self.selective:
+            vol_shape_grads, vol_JxW = self.get_shape_grads(cell_inds, self.vol_shape_grads_ref,
+                                                            self.vol_quad_weights)
+            geometry += (vol_shape_grads, vol_shape_grads[:, :, :, None, :] * vol_JxW[:, :, None, None, None])
+        return geometry
+
+    def get_jacobians(self, cell_inds=None, shape_grads_ref=None):
+        """Determinant and inverse of the Jacobian of the reference-to-physical map at quadrature points
+
+        Parameters
+        ----------
+        cell_inds : onp.ndarray
+            (num_selected_cells,) all cells if None
+        shape_grads_ref : onp.ndarray
+            (num_quads, num_nodes, dim) reference shape gradients of another quadrature rule,
+            self.shape_grads_ref if None
+
+        Returns
+        -------
+        jacobian_det : onp.ndarray
+            (num_cells, num_quads)
+        jacobian_deta_dx : onp.ndarray
+            (num_cells, num_quads, dim, dim)
+        """
+        shape_grads_ref = self.shape_grads_ref if shape_grads_ref is None else shape_grads_ref
+        cells = self.cells if cell_inds is None else onp.take(self.cells, cell_inds, axis=0)
+        physical_coos = onp.take(self.points, cells,
+                                 axis=0)  # (num_cells, num_nodes, dim)
+        # (num_cells, num_quads, num_nodes, dim, dim) -> (num_cells, num_quads, dim, dim)
+        jacobian_dx_deta = onp.sum(physical_coos[:, None, :, :, None] *
+                                   shape_grads_ref[None, :, :, None, :],
+                                   axis=2)
+        jacobian_det = onp.linalg.det(jacobian_dx_deta)  # (num_cells, num_quads)
+        jacobian_deta_dx = onp.linalg.inv(jacobian_dx_deta)
+        return jacobian_det, jacobian_deta_dx
+
+    def get_shape_grads(self, cell_inds=None, shape_grads_ref=None, quad_weights=None):
         """Compute shape function gradient value
         The gradient is w.r.t physical coordinates.
         See Hughes, Thomas JR. The finite element method: linear static and dynamic finite element analysis. Courier Corporation, 2012.
         Page 147, Eq. (3.9.3)
 
+        Parameters
+        ----------
+        cell_inds : onp.ndarray
+            (num_selected_cells,) all cells if None
+        shape_grads_ref, quad_weights : onp.ndarray
+            (num_quads, num_nodes, dim), (num_quads,) of another quadrature rule,
+            self.shape_grads_ref and self.quad_weights if None
+
         Returns
         -------
         shape_grads_physical : onp.ndarray
@@ -151,23 +346,15 @@ class FEM:
         JxW : onp.ndarray
             (num_cells, num_quads)
         """
-        assert self.shape_grads_ref.shape == (self.num_quads, self.num_nodes,
-                                              self.dim)
-        physical_coos = onp.take(self.points, self.cells,
-                                 axis=0)  # (num_cells, num_nodes, dim)
-        # (num_cells, num_quads, num_nodes, dim, dim) -> (num_cells, num_quads, 1, dim, dim)
-        jacobian_dx_deta = onp.sum(physical_coos[:, None, :, :, None] *
-                                   self.shape_grads_ref[None, :, :, None, :],
-                                   axis=2,
-                                   keepdims=True)
-        jacobian_det = onp.linalg.det(
-            jacobian_dx_deta)[:, :, 0]  # (num_cells, num_quads)
-        jacobian_deta_dx = onp.linalg.inv(jacobian_dx_deta)
+        if shape_grads_ref is None:
+            shape_grads_ref, quad_weights = self.shape_grads_ref, self.quad_weights
+        assert shape_grads_ref.shape == (len(quad_weights), self.num_nodes, self.dim)
+        jacobian_det, jacobian_deta_dx = self.get_jacobians(cell_inds, shape_grads_ref)
         # (1, num_quads, num_nodes, 1, dim) @ (num_cells, num_quads, 1, dim, dim)
         # (num_cells, num_quads, num_nodes, 1, dim) -> (num_cells, num_quads, num_nodes, dim)
-        shape_grads_physical = (self.shape_grads_ref[None, :, :, None, :]
-                                @ jacobian_deta_dx)[:, :, :, 0, :]
-        JxW = jacobian_det * self.quad_weights[None, :]
+        shape_grads_physical = (shape_grads_ref[None, :, :, None, :]
+                                @ jacobian_deta_dx[:, :, None, :, :])[:, :, :, 0, :]
+        JxW = jacobian_det * quad_weights[None, :]
         return shape_grads_physical, JxW
 
     def get_face_shape_grads(self, boundary_inds):
@@ -234,10 +421,8 @@ class FEM:
             (num_cells, num_quads, dim)
         """
         physical_coos = onp.take(self.points, self.cells, axis=0)
-        # (1, num_quads, num_nodes, 1) * (num_cells, 1, num_nodes, dim) -> (num_cells, num_quads, dim)
-        physical_quad_points = onp.sum(self.shape_vals[None, :, :, None] *
-                                       physical_coos[:, None, :, :],
-                                       axis=2)
+        # (num_quads, num_nodes), (num_cells, num_nodes, dim) -> (num_cells, num_quads, dim)
+        physical_quad_points = onp.einsum('qn,cnd->cqd', self.shape_vals, physical_coos)
         return physical_quad_points
 
     def get_physical_surface_quad_points(self, boundary_inds):
@@ -266,6 +451,33 @@ class FEM:
             axis=2)
         return physical_surface_quad_points
 
+    def get_boundary_integration_data(self, boundary_inds_list):
+        """Geometric data of boundary faces, computed once at setup so that residual evaluations
+        only evaluate the traction/Cauchy maps and scatter.
+
+        Parameters
+        ----------
+        boundary_inds_list : List[onp.ndarray]
+            (num_selected_faces, 2), see get_boundary_conditions_inds
+
+        Returns
+        -------
+        face_data_list : List[List[onp.ndarray]]
+            [face_shape_vals, nanson_scale, physical_surface_quad_points] of each boundary subset
+            (num_selected_faces, num_face_quads, num_nodes), (num_selected_faces, num_face_quads),
+            (num_selected_faces, num_face_quads, dim)
+        selected_cells : onp.ndarray
+            (num_selected_faces_of_all_subsets, num_nodes), scatter indices of all subsets, in order
+        """
+        face_data_list = []
+        for boundary_inds in boundary_inds_list:
+            _, nanson_scale = self.get_face_shape_grads(boundary_inds)
+            face_data_list.append([self.face_shape_vals[boundary_inds[:, 1]], nanson_scale,
+                                   self.get_physical_surface_quad_points(boundary_inds)])
+        selected_cells = onp.vstack([onp.zeros((0, self.num_nodes), dtype=self.cells.dtype)] +
+                                    [self.cells[boundary_inds[:, 0]] for boundary_inds in boundary_inds_list])
+        return face_data_list, selected_cells
+
     def Dirichlet_boundary_conditions(self, dirichlet_bc_info):
         """Indices and values for Dirichlet B.C.
 
@@ -290,20 +502,56 @@ class FEM:
             assert len(location_fns) == len(value_fns) and len(
                 value_fns) == len(vecs)
             for i in range(len(location_fns)):
-                node_inds = onp.argwhere(
-                    jax.vmap(location_fns[i])(self.mesh.points)).reshape(-1)
+                node_inds = self.locate_Dirichlet_nodes(location_fns[i])
                 vec_inds = onp.ones_like(node_inds, dtype=onp.int32) * vecs[i]
-                values = jax.vmap(value_fns[i])(
-                    self.mesh.points[node_inds].reshape(-1,
-                                                        self.dim)).reshape(-1)
                 node_inds_list.append(node_inds)
                 vec_inds_list.append(vec_inds)
-                vals_list.append(values)
+            vals_list = self.get_Dirichlet_values(value_fns, node_inds_list)
         return node_inds_list, vec_inds_list, vals_list
 
+    def locate_Dirichlet_nodes(self, location_fn):
+        """Nodes satisfying location_fn, the search over all mesh points is done once per location function.
+
+        Parameters
+        ----------
+        location_fn : Callable
+
+        Returns
+        -------
+        node_inds : onp.ndarray
+            (num_selected_nodes,)
+        """
+        if not hasattr(self, 'dirichlet_node_inds_cache'):
+            self.dirichlet_node_inds_cache = {}
+        # Keyed by the function object itself (not its id), so that the key cannot be reused by another function
+        if location_fn not in self.dirichlet_node_inds_cache:
+            self.dirichlet_node_inds_cache[location_fn] = onp.argwhere(
+                jax.vmap(location_fn)(self.mesh.points)).reshape(-1)
+        return self.dirichlet_node_inds_cache[location_fn]
+
+    def get_Dirichlet_values(self, value_fns, node_inds_list=None):
+        """Evaluate Dirichlet values at the located nodes
+
+        Parameters
+        ----------
+        value_fns : List[Callable]
+        node_inds_list : List[onp.ndarray]
+            self.node_inds_list if None
+
+        Returns
+        -------
+        vals_list : List[ndarray]
+            (num_selected_nodes,)
+        """
+        node_inds_list = self.node_inds_list if node_inds_list is None else node_inds_list
+        assert len(value_fns) == len(node_inds_list)
+        return [jax.vmap(value_fn)(self.mesh.points[node_inds].reshape(-1, self.dim)).reshape(-1)
+                for value_fn, node_inds in zip(value_fns, node_inds_list)]
+
     def update_Dirichlet_boundary_conditions(self, dirichlet_bc_info):
         """Reset Dirichlet boundary conditions.
         Useful when a time-dependent problem is solved, and at each iteration the boundary condition needs to be updated.
+        Boundary nodes are only searched for new location functions, see locate_Dirichlet_nodes.
 
         Parameters
         ----------
@@ -312,6 +560,26 @@ class FEM:
         self.node_inds_list, self.vec_inds_list, self.vals_list = self.Dirichlet_boundary_conditions(
             dirichlet_bc_info)
 
+    def update_Dirichlet_values(self, value_fns=None, vals_list=None):
+        """Change only the prescribed values of the current Dirichlet B.C., nodes and components are kept.
+        Either value_fns are evaluated at the boundary nodes, or vals_list is used as is,
+        so the values may be traced (e.g., the update runs inside jit or is differentiated).
+
+        Parameters
+        ----------
+        value_fns : List[Callable]
+            One per B.C. entry, see dirichlet_bc_info
+        vals_list : List[ndarray]
+            One per B.C. entry, (num_selected_nodes,) or a scalar that is broadcast to all its nodes
+        """
+        assert (value_fns is None) != (vals_list is None), f"Provide either value_fns or vals_list"
+        if value_fns is not None:
+            self.vals_list = self.get_Dirichlet_values(value_fns)
+        else:
+            assert len(vals_list) == len(self.node_inds_list)
+            self.vals_list = [np.broadcast_to(vals, node_inds.shape)
+                              for vals, node_inds in zip(vals_list, self.node_inds_list)]
+
     def periodic_boundary_conditions(self):
         p_node_inds_list_A = []
         p_node_inds_list_B = []
@@ -319,26 +587,8 @@ class FEM:
         if self.periodic_bc_info is not None:
             location_fns_A, location_fns_B, mappings, vecs = self.periodic_bc_info
             for i in range(len(location_fns_A)):
-                node_inds_A = onp.argwhere(
-                    jax.vmap(location_fns_A[i])(self.mesh.points)).reshape(-1)
-                node_inds_B = onp.argwhere(
-                    jax.vmap(location_fns_B[i])(self.mesh.points)).reshape(-1)
-                points_set_A = self.mesh.points[node_inds_A]
-                points_set_B = self.mesh.points[node_inds_B]
-
-                EPS = 1e-5
-                node_inds_B_ordered = []
-                for node_ind in node_inds_A:
-                    point_A = self.mesh.points[node_ind]
-                    dist = onp.linalg.norm(mappings[i](point_A)[None, :] -
-                                           points_set_B,
-                                           axis=-1)
-                    node_ind_B_ordered = node_inds_B[onp.argwhere(
-                        dist < EPS)].reshape(-1)
-                    node_inds_B_ordered.append(node_ind_B_ordered)
-
-                node_inds_B_ordered = onp.array(node_inds_B_ordered).reshape(
-                    -1)
+                node_inds_A, node_inds_B_ordered = self.match_periodic_nodes(
+                    location_fns_A[i], location_fns_B[i], mappings[i])
                 vec_inds = onp.ones_like(node_inds_A,
                                          dtype=onp.int32) * vecs[i]
 
@@ -349,8 +599,102 @@ class FEM:
 
         return p_node_inds_list_A, p_node_inds_list_B, p_vec_inds_list
 
+    def match_periodic_nodes(self, location_fn_A, location_fn_B, mapping, eps=1e-5):
+        """Pair each node on boundary A with the node on boundary B that it is mapped onto.
+        All A points are mapped at once and looked up in a KD-tree of B points. The pairing is
+        reused by the periodic B.C. entries (e.g., one per component) sharing the same functions.
+
+        Parameters
+        ----------
+        location_fn_A, location_fn_B : Callable
+        mapping : Callable
+            Maps a point from boundary A to boundary B
+        eps : float
+            Matching tolerance
+
+        Returns
+        -------
+        node_inds_A : onp.ndarray
+            (num_selected_nodes,)
+        node_inds_B : onp.ndarray
+            (num_selected_nodes,) node_inds_B[k] is the node paired with node_inds_A[k]
+        """
+        if not hasattr(self, 'periodic_pairs_cache'):
+            self.periodic_pairs_cache = {}
+        key = (location_fn_A, location_fn_B, mapping)
+        if key in self.periodic_pairs_cache:
+            return self.periodic_pairs_cache[key]
+
+        node_inds_A = self.locate_Dirichlet_nodes(location_fn_A)
+        node_inds_B = self.locate_Dirichlet_nodes(location_fn_B)
+        mapped_points_A = onp.array(jax.vmap(mapping)(self.mesh.points[node_inds_A])).reshape(-1, self.dim)
+        if len(node_inds_B) > 0:
+            # The two nearest B points, the second one must be out of tolerance for the pairing to be unique
+            dists, inds = scipy.spatial.cKDTree(self.mesh.points[node_inds_B]).query(
+                mapped_points_A, k=2, distance_upper_bound=eps)
+        else:
+            dists = onp.full((len(node_inds_A), 2), onp.inf)
+            inds = onp.zeros((len(node_inds_A), 2), dtype=onp.int64)
+
+        unmatched = dists[:, 0] >= eps
+        ambiguous = dists[:, 1] < eps
+        if onp.any(unmatched) or onp.any(ambiguous):
+            raise ValueError(f"Periodic B.C.: {onp.sum(unmatched)} of {len(node_inds_A)} nodes on boundary A have no match "
+                             f"and {onp.sum(ambiguous)} have more than one match on boundary B within eps = {eps}, "
+                             f"e.g., points {self.mesh.points[node_inds_A[unmatched | ambiguous][:5]].tolist()}")
+
+        pairs = (node_inds_A, node_inds_B[inds[:, 0]])
+        self.periodic_pairs_cache[key] = pairs
+        return pairs
+
+    def get_periodic_roots(self):
+        """Condensation of periodic B.C.: the dofs tied by periodic pairs, also through chains of pairs
+        (e.g., at edges and corners of an RVE), share the value of one root dof, a Dirichlet dof if there is one.
+        Solutions are prolonged from the roots with sol.reshape(-1)[roots].
+        Kept as long as the Dirichlet nodes do not change.
+
+        Returns
+        -------
+        roots : onp.ndarray
+            (num_total_dofs,) the root of each dof, itself for roots and dofs without periodic B.C.
+        """
+        cached = getattr(self, 'periodic_roots_cache', (None, None))
+        if cached[0] is self.node_inds_list:
+            return cached[1]
+
+        def to_dofs(node_inds_list, vec_inds_list):
+            return onp.hstack([onp.zeros(0, dtype=onp.int64)] +
+                              [onp.asarray(node_inds * self.vec + vec_inds, dtype=onp.int64)
+                               for node_inds, vec_inds in zip(node_inds_list, vec_inds_list)])
+
+        num_dofs = self.num_total_dofs
+        dofs_A = to_dofs(self.p_node_inds_list_A, self.p_vec_inds_list)
+        dofs_B = to_dofs(self.p_node_inds_list_B, self.p_vec_inds_list)
+        bc_dofs = to_dofs(self.node_inds_list, self.vec_inds_list)
+        # Dirichlet dofs first, then by index. Each dof takes the lowest priority of the dofs it is tied to,
+        # propagated along the pairs.
+        priorities = onp.arange(num_dofs) + num_dofs
+        priorities[bc_dofs] -= num_dofs
+        labels = priorities.copy()
+        while True:
+            pair_labels = onp.minimum(labels[dofs_A], labels[dofs_B])
+            new_labels = labels.copy()
+            onp.minimum.at(new_labels, dofs_A, pair_labels)
+            onp.minimum.at(new_labels, dofs_B, pair_labels)
+            if onp.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+        dofs_by_priority = onp.zeros(2 * num_dofs, dtype=onp.int64)
+        dofs_by_priority[priorities] = onp.arange(num_dofs)
+        roots = dofs_by_priority[labels]
+        assert onp.all(roots[bc_dofs] == bc_dofs), \
+            f"Periodic B.C. tie Dirichlet dofs {bc_dofs[roots[bc_dofs] != bc_dofs][:5].tolist()} to other Dirichlet dofs"
+        self.periodic_roots_cache = (self.node_inds_list, roots)
+        return roots
+
     def get_boundary_conditions_inds(self, location_fns):
         """Given location functions, compute which faces satisfy the condition.
+        Only external faces of the mesh are considered.
 
         Parameters
         ----------
@@ -365,24 +709,14 @@ class FEM:
             boundary_inds_list[k][i, 0] returns the global cell index of the ith selected face of boundary subset k
             boundary_inds_list[k][i, 1] returns the local face index of the ith selected face of boundary subset k
         """
-        cell_points = onp.take(self.points, self.cells,
-                               axis=0)  # (num_cells, num_nodes, dim)
-        cell_face_points = onp.take(
-            cell_points, self.face_inds,
-            axis=1)  # (num_cells, num_faces, num_face_nodes, dim)
         boundary_inds_list = []
-        for i in range(len(location_fns)):
-            vmap_location_fn = jax.vmap(location_fns[i])
-
-            def on_boundary(cell_points):
-                boundary_flag = vmap_location_fn(cell_points)
-                return onp.all(boundary_flag)
-
-            vvmap_on_boundary = jax.vmap(jax.vmap(on_boundary))
-            boundary_flags = vvmap_on_boundary(cell_face_points)
-            boundary_inds = onp.argwhere(
-                boundary_flags)  # (num_selected_faces, 2)
-            boundary_inds_list.append(boundary_inds)
+        # Only depends on the mesh, evaluated eagerly even when called inside jit (e.g., the matrix-free solver)
+        with jax.ensure_compile_time_eval():
+            for i in range(len(location_fns)):
+                # Location functions are only evaluated on external faces, see Mesh.get_topology
+                boundary_inds = self.mesh.get_boundary_faces(
+                    location_fns[i], self.ele_type)  # (num_selected_faces, 2)
+                boundary_inds_list.append(boundary_inds)
         return boundary_inds_list
 
     def compute_Neumann_integral_vars(self, **internal_vars):
@@ -395,38 +729,35 @@ class FEM:
         """
         integral = np.zeros((self.num_total_nodes, self.vec))
         if self.neumann_bc_info is not None:
-            for i, boundary_inds in enumerate(self.neumann_boundary_inds_list):
+            neumann_face_data, neumann_selected_cells = self.get_Neumann_face_data()
+            int_vals = []
+            for i, (v_vals, nanson_scale, subset_quad_points) in enumerate(neumann_face_data):
                 if 'neumann' in internal_vars.keys():
                     int_vars = internal_vars['neumann'][i]
                 else:
                     int_vars = ()
-                # (num_cells, num_faces, num_face_quads, dim) -> (num_selected_faces, num_face_quads, dim)
-                subset_quad_points = self.get_physical_surface_quad_points(
-                    boundary_inds)
-                # int_vars = [x[i] for x in internal_vars]
                 traction = jax.vmap(jax.vmap(self.neumann_value_fns[i]))(
                     subset_quad_points,
                     *int_vars)  # (num_selected_faces, num_face_quads, vec)
                 assert len(traction.shape) == 3
-                _, nanson_scale = self.get_face_shape_grads(
-                    boundary_inds)  # (num_selected_faces, num_face_quads)
-                # (num_faces, num_face_quads, num_nodes) ->  (num_selected_faces, num_face_quads, num_nodes)
-                v_vals = np.take(self.face_shape_vals,
-                                 boundary_inds[:, 1],
-                                 axis=0)
-                v_vals = np.repeat(
-                    v_vals[:, :, :, None], self.vec, axis=-1
-                )  # (num_selected_faces, num_face_quads, num_nodes, vec)
-                subset_cells = np.take(
-                    self.cells, boundary_inds[:, 0],
-                    axis=0)  # (num_selected_faces, num_nodes)
-                # (num_selected_faces, num_nodes, vec) -> (num_selected_faces*num_nodes, vec)
-                int_vals = np.sum(v_vals * traction[:, :, None, :] *
-                                  nanson_scale[:, :, None, None],
-                                  axis=1).reshape(-1, self.vec)
-                integral = integral.at[subset_cells.reshape(-1)].add(int_vals)
+                # (num_selected_faces, num_face_quads, num_nodes), (num_selected_faces, num_face_quads, vec),
+                # (num_selected_faces, num_face_quads) -> (num_selected_faces, num_nodes, vec)
+                int_vals.append(np.einsum('fqn,fqv,fq->fnv', v_vals, traction, nanson_scale))
+            # One scatter for all boundary subsets
+            int_vals = np.concatenate(int_vals, axis=0).reshape(-1, self.vec)
+            integral = integral.at[neumann_selected_cells.reshape(-1)].add(int_vals)
         return integral
 
+    def get_Neumann_face_data(self):
+        """Integration data of the Neumann boundary faces, see get_boundary_integration_data.
+        Computed once, and again only if neumann_boundary_inds_list is replaced (e.g., by a child class).
+        """
+        cached = getattr(self, 'neumann_face_data_cache', (None, ))
+        if cached[0] is not self.neumann_boundary_inds_list:
+            self.neumann_face_data_cache = (self.neumann_boundary_inds_list,
+                                            *self.get_boundary_integration_data(self.neumann_boundary_inds_list))
+        return self.neumann_face_data_cache[1:]
+
     def compute_Neumann_boundary_inds(self):
         """Child class should override if internal variables exist
         """
@@ -436,6 +767,15 @@ class FEM:
                 self.neumann_boundary_inds_list = self.get_boundary_conditions_inds(
                     self.neumann_location_fns)
 
+    def compute_Cauchy_boundary_inds(self):
+        """Boundary faces and their integration data for Cauchy B.C.
+        """
+        if self.cauchy_bc_info is not None:
+            location_fns, _ = self.cauchy_bc_info
+            self.cauchy_boundary_inds_list = self.get_boundary_conditions_inds(location_fns)
+            self.cauchy_face_data, self.cauchy_selected_cells = self.get_boundary_integration_data(
+                self.cauchy_boundary_inds_list)
+
     def compute_body_force_by_fn(self):
         """In the weak form, we have (body_force, v) * dx, and this function computes this
 
@@ -444,25 +784,27 @@ class FEM:
         body_force: np.DeviceArray
             (num_total_nodes, vec)
         """
+        if self.source_info is None:
+            return np.zeros((self.num_total_nodes, self.vec))
+
+        # The source is a function of position only, unless flagged otherwise
+        cached = getattr(self, 'body_force_cache', (None, None))
+        if not self.time_dependent_source and cached[0] is self.source_info:
+            return cached[1]
+
+        body_force_fn = self.source_info
+        physical_quad_points = self.get_physical_quad_points(
+        )  # (num_cells, num_quads, dim)
+        body_force = jax.vmap(jax.vmap(body_force_fn))(
+            physical_quad_points)  # (num_cells, num_quads, vec)
+        assert len(body_force.shape) == 3
+        # (num_quads, num_nodes), (num_cells, num_quads, vec), (num_cells, num_quads) -> (num_cells, num_nodes, vec)
+        rhs_vals = np.einsum('qn,cqv,cq->cnv', self.shape_vals, body_force, self.JxW).reshape(-1, self.vec)
         rhs = np.zeros((self.num_total_nodes, self.vec))
-        if self.source_info is not None:
-            body_force_fn = self.source_info
-            physical_quad_points = self.get_physical_quad_points(
-            )  # (num_cells, num_quads, dim)
-            body_force = jax.vmap(jax.vmap(body_force_fn))(
-                physical_quad_points)  # (num_cells, num_quads, vec)
-            assert len(body_force.shape) == 3
-            v_vals = np.repeat(self.shape_vals[None, :, :, None],
-                               self.num_cells,
-                               axis=0)  # (num_cells, num_quads, num_nodes, 1)
-            v_vals = np.repeat(
-                v_vals, self.vec,
-                axis=-1)  # (num_cells, num_quads, num_nodes, vec)
-            # (num_cells, num_nodes, vec) -> (num_cells*num_nodes, vec)
-            rhs_vals = np.sum(v_vals * body_force[:, :, None, :] *
-                              self.JxW[:, :, None, None],
-                              axis=1).reshape(-1, self.vec)
-            rhs = rhs.at[self.cells.reshape(-1)].add(rhs_vals)
+        rhs = rhs.at[self.cells.reshape(-1)].add(rhs_vals)
+        # A source_info that closes over traced parameters (e.g., in ad_wrapper) must not be cached
+        if not isinstance(rhs, jax.core.Tracer):
+            self.body_force_cache = (self.source_info, rhs)
         return rhs
 
     def compute_body_force_by_sol(self, sol, mass_map):
@@ -480,10 +822,12 @@ class FEM:
         body_force : np.DeviceArray
             (num_total_nodes, vec)
         """
-        mass_kernel = self.get_mass_kernel(mass_map)
         cells_sol = sol[self.cells]  # (num_cells, num_nodes, vec)
-        val = jax.vmap(mass_kernel)(cells_sol,
-                                    self.JxW)  # (num_cells, num_nodes, vec)
+        # (num_quads, num_nodes), (num_cells, num_nodes, vec) -> (num_cells, num_quads, vec)
+        u = np.einsum('qn,cnv->cqv', self.shape_vals, cells_sol)
+        u_physics = jax.vmap(jax.vmap(mass_map))(u)  # (num_cells, num_quads, vec)
+        # (num_quads, num_nodes), (num_cells, num_quads, vec), (num_cells, num_quads) -> (num_cells, num_nodes, vec)
+        val = np.einsum('qn,cqv,cq->cnv', self.shape_vals, u_physics, self.JxW)
         val = val.reshape(-1, self.vec)  # (num_cells*num_nodes, vec)
         body_force = np.zeros_like(sol)
         body_force = body_force.at[self.cells.reshape(-1)].add(val)
@@ -500,8 +844,8 @@ class FEM:
             u_grads_reshape = u_grads.reshape(
                 -1, self.vec, self.dim)  # (num_quads, vec, dim)
             # (num_quads, vec, dim)
-            u_physics = jax.vmap(tensor_map)(
-                u_grads_reshape, *cell_internal_vars).reshape(u_grads.shape)
+            u_physics = cast(vmap_quads(tensor_map)(
+                u_grads_reshape, *cell_internal_vars), cell_sol.dtype).reshape(u_grads.shape)
             # (num_quads, num_nodes, vec, dim) -> (num_nodes, vec) -> (num_nodes, vec)
             val = np.sum(u_physics[:, None, :, :] * cell_v_grads_JxW,
                          axis=(0, -1))
@@ -509,16 +853,116 @@ class FEM:
 
         return laplace_kernel
 
+    def get_tensor_product_grads(self, cell_sol, cell_inv_jacobians):
+        """Sum factorization: solution gradients at quadrature points with 1D tables along each axis,
+        O(n^4) instead of O(n^6) operations for n 1D nodes/quads.
+
+        Parameters
+        ----------
+        cell_sol : ndarray
+            (num_nodes, vec)
+        cell_inv_jacobians : ndarray
+            (num_quads, dim, dim)
+
+        Returns
+        -------
+        u_grads : ndarray
+            (num_quads, vec, dim)
+        """
+        basis_vals_1d, basis_grads_1d, tensor_node_inds, tensor_quad_inds = self.tensor_product_tables
+        n = basis_vals_1d.shape[1]
+        # (num_nodes, vec) -> (n, n, n, vec)
+        u_tensor = cell_sol[tensor_node_inds].reshape(n, n, n, self.vec)
+        B, D = cast((basis_vals_1d, basis_grads_1d), cell_sol.dtype)
+        # (num_quads_1d, num_quads_1d, num_quads_1d, vec, dim), reference gradients
+        u_grads_ref = np.stack([np.einsum('ai,bj,ck,ijkv->abcv', *tables, u_tensor)
+                                for tables in [(D, B, B), (B, D, B), (B, B, D)]], axis=-1)
+        u_grads_ref = u_grads_ref.reshape(self.num_quads, self.vec, self.dim)[onp.argsort(tensor_quad_inds)]
+        # (num_quads, vec, dim) @ (num_quads, dim, dim) -> (num_quads, vec, dim)
+        return u_grads_ref @ cell_inv_jacobians
+
+    def apply_tensor_product_grads_transpose(self, u_physics, cell_inv_jacobians, cell_JxW):
+        """Sum factorization: integrate u_physics against test function gradients, (u_physics, v_grad) * dx
+
+        Parameters
+        ----------
+        u_physics : ndarray
+            (num_quads, vec, dim)
+        cell_inv_jacobians : ndarray
+            (num_quads, dim, dim)
+        cell_JxW : ndarray
+            (num_quads,)
+
+        Returns
+        -------
+        val : ndarray
+            (num_nodes, vec)
+        """
+        basis_vals_1d, basis_grads_1d, tensor_node_inds, tensor_quad_inds = self.tensor_product_tables
+        n_quads = basis_vals_1d.shape[0]
+        # Pull back to reference gradients: (num_quads, vec, dim) @ (num_quads, dim, dim)
+        u_ref = u_physics @ np.transpose(cell_inv_jacobians, axes=(0, 2, 1)) * cell_JxW[:, None, None]
+        u_ref = u_ref[tensor_quad_inds].reshape(n_quads, n_quads, n_quads, self.vec, self.dim)
+        B, D = cast((basis_vals_1d, basis_grads_1d), u_physics.dtype)
+        val = sum([np.einsum('ai,bj,ck,abcv->ijkv', *tables, u_ref[..., e])
+                   for e, tables in enumerate([(D, B, B), (B, D, B), (B, B, D)])])
+        return val.reshape(self.num_nodes, self.vec)[onp.argsort(tensor_node_inds)]
+
+    def get_laplace_kernel_sum_factorization(self, tensor_map):
+
+        def laplace_kernel(cell_sol, cell_inv_jacobians, cell_JxW,
+                           *cell_internal_vars):
+            u_grads = self.get_tensor_product_grads(cell_sol, cell_inv_jacobians)  # (num_quads, vec, dim)
+            u_physics = cast(vmap_quads(tensor_map)(
+                u_grads, *cell_internal_vars), cell_sol.dtype).reshape(u_grads.shape)
+            val = self.apply_tensor_product_grads_transpose(u_physics, cell_inv_jacobians, cell_JxW)
+            return val
+
+        return laplace_kernel
+
+    def get_cell_geometry(self):
+        """Per-cell geometric factors fed to the cell kernels, JxW is always the second one,
+        with selective integration the reduced-rule shape gradients and v_grads_JxW are the last two
+        """
+        if self.sum_factorization:
+            geometry = [self.inv_jacobians, self.JxW]
+        else:
+            geometry = [self.shape_grads, self.JxW, self.v_grads_JxW]
+        if self.selective:
+            geometry += [self.vol_shape_grads, self.vol_v_grads_JxW]
+        return geometry
+
+    def get_cell_grads(self, cell_sol, cell_geometry):
+        """Solution gradients at quadrature points (num_quads, vec, dim), see get_cell_geometry
+        """
+        if self.sum_factorization:
+            return self.get_tensor_product_grads(cell_sol, cell_geometry[0])
+        # (1, num_nodes, vec, 1) * (num_quads, num_nodes, 1, dim) -> (num_quads, num_nodes, vec, dim)
+        u_grads = cell_sol[None, :, :, None] * cell_geometry[0][:, :, None, :]
+        return np.sum(u_grads, axis=1)
+
+    def get_energy_kernel(self, energy_density):
+
+        def energy_kernel(cell_sol, cell_geometry, *cell_internal_vars):
+            u_grads = self.get_cell_grads(cell_sol, cell_geometry)  # (num_quads, vec, dim)
+            psi = cast(vmap_quads(energy_density)(
+                u_grads, *cell_internal_vars), cell_sol.dtype)  # (num_quads,)
+            val = np.sum(psi * cell_geometry[1])
+            return val
+
+        return energy_kernel
+
     def get_mass_kernel(self, mass_map):
 
         def mass_kernel(cell_sol, cell_JxW, *cell_internal_vars):
+            shape_vals = cast(self.shape_vals, cell_sol.dtype)
             # (1, num_nodes, vec) * (num_quads, num_nodes, 1) -> (num_quads, num_nodes, vec) -> (num_quads, vec)
-            u = np.sum(cell_sol[None, :, :] * self.shape_vals[:, :, None],
+            u = np.sum(cell_sol[None, :, :] * shape_vals[:, :, None],
                        axis=1)
-            u_physics = jax.vmap(mass_map)(
-                u, *cell_internal_vars)  # (num_quads, vec)
+            u_physics = cast(vmap_quads(mass_map)(
+                u, *cell_internal_vars), cell_sol.dtype)  # (num_quads, vec)
             # (num_quads, 1, vec) * (num_quads, num_nodes, 1) * (num_quads, 1, 1) -> (num_nodes, vec)
-            val = np.sum(u_physics[:, None, :] * self.shape_vals[:, :, None] *
+            val = np.sum(u_physics[:, None, :] * shape_vals[:, :, None] *
                          cell_JxW[:, None, None],
                          axis=0)
             return val
@@ -530,7 +974,7 @@ class FEM:
             # (1, num_nodes, vec) * (num_face_quads, num_nodes, 1) -> (num_face_quads, vec)
             u = np.sum(cell_sol[None, :, :] * face_shape_vals[:, :, None],
                        axis=1)
-            u_physics = jax.vmap(cauchy_map)(u)  # (num_face_quads, vec)
+            u_physics = cast(jax.vmap(cauchy_map)(u), cell_sol.dtype)  # (num_face_quads, vec)
             # (num_face_quads, 1, vec) * (num_face_quads, num_nodes, 1) * (num_face_quads, 1, 1) -> (num_nodes, vec)
             val = np.sum(u_physics[:, None, :] * face_shape_vals[:, :, None] *
                          face_nanson_scale[:, None, None],
@@ -552,9 +996,20 @@ class FEM:
 
         return [mass_internal_vars, laplace_internal_vars]
 
+    def get_num_devices(self):
+        return self.num_devices or 1
+
     @timeit
-    def split_and_compute_cell(self, cells_sol, np_version, jac_flag,
+    def split_and_compute_cell(self, cells_sol, np_version, jac_flag, assemble=False,
                                **internal_vars):
+        """Cell residuals, and cell Jacobians if jac_flag is True.
+        If jac_flag is 'diag', only the diagonals of cell Jacobians (num_cells, num_nodes, vec)
+        are returned, the full cell Jacobians never leave a batch.
+
+        With assemble (jac_flag True or False), cell values are scatter-added where they are computed
+        and the assembled residual (num_total_nodes, vec), and CSR values (nnz,) if jac_flag is True,
+        are returned instead. This is how cells sharded over several devices are reduced.
+        """
 
         def value_and_jacrev(f, x):
             y, pullback = jax.vjp(f, x)
@@ -572,10 +1027,18 @@ class FEM:
             return y, jac.reshape(self.num_nodes, self.vec, self.num_nodes,
                                   self.vec)
 
+        def get_deviatoric_tensor_map():
+            tensor_map = self.get_tensor_map()
+            if not self.selective:
+                return tensor_map
+            vol_map = self.get_volumetric_tensor_map()
+            return lambda u_grad, *args: tensor_map(u_grad, *args) - vol_map(u_grad)
+
         def get_kernel_fn_cell():
 
-            def kernel(cell_sol, cell_shape_grads, cell_JxW, cell_v_grads_JxW,
-                       cell_mass_internal_vars, cell_laplace_internal_vars):
+            def kernel(cell_sol, cell_geometry, cell_mass_internal_vars,
+                       cell_laplace_internal_vars):
+                cell_JxW = cell_geometry[1]
                 if hasattr(self, 'get_mass_map'):
                     mass_kernel = self.get_mass_kernel(self.get_mass_map())
                     mass_val = mass_kernel(cell_sol, cell_JxW,
@@ -583,15 +1046,33 @@ class FEM:
                 else:
                     mass_val = 0.
 
-                if hasattr(self, 'get_tensor_map'):
+                if self.symmetric:
+                    # The residual is the gradient of the element energy (reverse mode)
+                    energy_kernel = self.get_energy_kernel(
+                        self.get_energy_density())
+                    laplace_val = jax.grad(energy_kernel)(
+                        cell_sol, cell_geometry, *cell_laplace_internal_vars)
+                elif hasattr(self, 'get_tensor_map') and self.sum_factorization:
+                    laplace_kernel = self.get_laplace_kernel_sum_factorization(
+                        get_deviatoric_tensor_map())
+                    laplace_val = laplace_kernel(cell_sol, cell_geometry[0],
+                                                 cell_JxW,
+                                                 *cell_laplace_internal_vars)
+                elif hasattr(self, 'get_tensor_map'):
                     laplace_kernel = self.get_laplace_kernel(
-                        self.get_tensor_map())
-                    laplace_val = laplace_kernel(cell_sol, cell_shape_grads,
-                                                 cell_v_grads_JxW,
+                        get_deviatoric_tensor_map())
+                    laplace_val = laplace_kernel(cell_sol, cell_geometry[0],
+                                                 cell_geometry[2],
                                                  *cell_laplace_internal_vars)
                 else:
                     laplace_val = 0.
 
+                if self.selective:
+                    # Volumetric part on the reduced rule, it does not see the internal variables
+                    # since those live on the full rule quadrature points.
+                    vol_kernel = self.get_laplace_kernel(self.get_volumetric_tensor_map())
+                    laplace_val = laplace_val + vol_kernel(cell_sol, *cell_geometry[-2:])
+
                 return laplace_val + mass_val
 
             def kernel_jac(cell_sol, *args):
@@ -600,70 +1081,264 @@ class FEM:
                     kernel_partial, cell_sol
                 )  # kernel(cell_sol, *args), jax.jacfwd(kernel)(cell_sol, *args)
 
-            return kernel, kernel_jac
-
-        kernel, kernel_jac = get_kernel_fn_cell()
-        fn = kernel_jac if jac_flag else kernel
-        vmap_fn = jax.jit(jax.vmap(fn))
-        kernal_vars = self.unpack_kernels_vars(**internal_vars)
-        num_cuts = 20
-        if num_cuts > len(self.cells):
-            num_cuts = len(self.cells)
-        batch_size = len(self.cells) // num_cuts
-        input_collection = [
-            cells_sol, self.shape_grads, self.JxW, self.v_grads_JxW,
-            *kernal_vars
-        ]
+            def kernel_hess(cell_sol, *args):
+                # In symmetric mode, kernel is a reverse-mode gradient, so kernel_jac is forward-over-reverse.
+                # Only the upper triangle of the element Hessian is returned.
+                val, jac = kernel_jac(cell_sol, *args)
+                rows, cols = onp.triu_indices(self.num_nodes * self.vec)
+                return val, jac.reshape(self.num_nodes * self.vec, -1)[rows, cols]
+
+            def kernel_diag(cell_sol, *args):
+                # JVPs of the linearized kernel with the vec unit tangents of one node at a time,
+                # the (num_nodes*vec)^2 cell Jacobian is never formed.
+                val, kernel_jvp = jax.linearize(lambda cell_sol: kernel(cell_sol, *args), cell_sol)
+                eye = np.eye(self.vec, dtype=cell_sol.dtype)
+
+                def node_diag(node):
+                    tangents = np.zeros((self.vec, ) + cell_sol.shape, dtype=cell_sol.dtype).at[:, node, :].set(eye)
+                    jvps = jax.vmap(kernel_jvp)(tangents)  # (vec, num_nodes, vec)
+                    return np.diagonal(jvps[:, node, :])
+
+                return val, jax.lax.map(node_diag, np.arange(self.num_nodes))
+
+            return kernel, kernel_jac, kernel_hess, kernel_diag
+
+        def get_map_fn():
+            kernel, kernel_jac, kernel_hess, kernel_diag = get_kernel_fn_cell()
+            if jac_flag == 'diag':
+                fn = kernel_diag
+            elif jac_flag:
+                fn = kernel_hess if self.symmetric else kernel_jac
+            else:
+                fn = kernel
+            vmap_fn = jax.vmap(fn)
+
+            def map_fn(input_collection):
+                return jax.lax.map(lambda input_col: vmap_fn(*input_col), input_collection)
+
+            def assembled_map_fn(input_collection, mask, res_inds, jac_inds):
+                # Padded cells have a zero mask, their values are computed but not added
+                outputs = map_fn(input_collection)
+                values, jacs = outputs if jac_flag else (outputs, None)
+                mask = self.precision_policy.to_accumulate(mask)
+                values = self.precision_policy.to_accumulate(values).reshape(*mask.shape, -1) * mask[..., None]
+                res = jax.ops.segment_sum(values.reshape(-1), res_inds.reshape(-1), num_segments=self.num_total_dofs)
+                if jac_flag:
+                    jacs = self.precision_policy.to_accumulate(jacs).reshape(*mask.shape, -1) * mask[..., None]
+                    csr_data = jax.ops.segment_sum(jacs.reshape(-1), jac_inds.reshape(-1),
+                                                   num_segments=self.get_sparsity_pattern().nnz)
+                outputs = (res, csr_data) if jac_flag else res
+                if num_devices > 1:
+                    outputs = jax.lax.psum(outputs, 'devices')
+                return outputs
+
+            fn = self.with_kernel_params(assembled_map_fn if assemble else map_fn)
+            if num_devices > 1:
+                in_axes = (None,) + (0,) * (4 if assemble else 1)
+                return jax.pmap(fn, axis_name='devices', in_axes=in_axes, devices=jax.local_devices()[:num_devices])
+            return jax.jit(fn)
+
+        # Per-grain constants are gathered to cells so that all internal variables are batched by cells
+        # Jacobians in the kernel precision, residuals in the accumulation precision
+        policy = self.precision_policy
+        dtype = policy.kernel_dtype if jac_flag else policy.accumulate_dtype
+        kernal_vars = cast(to_cells(self.unpack_kernels_vars(**internal_vars)), dtype)
+        cells_sol = cast(cells_sol, dtype)
+        assert not assemble or jac_flag != 'diag'
+        batch_size = self.get_batch_size(jac_flag, cells_sol, kernal_vars)
+        num_devices = self.get_num_devices()
+        # Each device gets the same number of batches
+        num_batches = num_devices * -(-len(self.cells) // (batch_size * num_devices))
+        logger.debug(f"Computing {len(self.cells)} cells in {num_batches} batches of size {batch_size}"
+                     f"{f' on {num_devices} devices' if num_devices > 1 else ''}")
+        key = ('cell', jac_flag, batch_size, jax.tree_util.tree_structure(kernal_vars), assemble)
+        map_fn = self.get_cached_kernel(key, get_map_fn)
+
+        def to_shards(x):
+            # (num_batches, batch_size, ...) -> (num_devices, num_batches/num_devices, batch_size, ...)
+            return x.reshape(num_devices, -1, *x.shape[1:]) if num_devices > 1 else x
+
+        # All batches have the same shape (the tail batch is padded), so the kernel is compiled only once.
+        # (num_batches, batch_size, ...)
+        input_collection = jax.tree_map(to_shards, [
+            self.to_batches(cells_sol, batch_size, np, num_batches),
+            self.get_batched_geometry(batch_size, dtype, num_batches),
+            *jax.tree_map(lambda x: self.to_batches(x, batch_size, np, num_batches), kernal_vars)
+        ])
+
+        if assemble:
+            mask, res_inds, jac_inds = jax.tree_map(to_shards, self.get_batched_scatter_inds(batch_size, num_batches))
+            outputs = map_fn(self.get_kernel_param_values(), input_collection, mask, res_inds, jac_inds)
+            if num_devices > 1:
+                # The reduced values are replicated on all devices
+                outputs = jax.tree_map(lambda x: x[0], outputs)
+            if not jac_flag:
+                return outputs.reshape(self.num_total_nodes, self.vec)
+            res, csr_data = outputs
+            if np_version.__name__ != 'jax.numpy' and not isinstance(csr_data, jax.core.Tracer):
+                csr_data = onp.asarray(csr_data)
+            return res.reshape(self.num_total_nodes, self.vec), csr_data
+
+        def from_batches(x):
+            num_batch_axes = 3 if num_devices > 1 else 2
+            return policy.to_accumulate(x.reshape(-1, *x.shape[num_batch_axes:])[:len(self.cells)])
 
         if jac_flag:
-            values = []
-            jacs = []
-            for i in range(num_cuts):
-                if i < num_cuts - 1:
-                    input_col = jax.tree_map(
-                        lambda x: x[i * batch_size:(i + 1) * batch_size],
-                        input_collection)
-                else:
-                    input_col = jax.tree_map(lambda x: x[i * batch_size:],
-                                             input_collection)
-
-                val, jac = vmap_fn(*input_col)
-
-                values.append(val)
-                jacs.append(jac)
-
+            values, jacs = map_fn(self.get_kernel_param_values(), input_collection)
+            values = from_batches(values)
+            jacs = from_batches(jacs)
             # np_version set to jax.numpy allows for auto diff, but uses GPU memory
-            if np_version.__name__ == 'jax.numpy':
-                values = np_version.vstack(values)
-                jacs = np_version.vstack(jacs)
-            else:
+            if np_version.__name__ != 'jax.numpy':
                 # np_version set to ordinary numpy saves GPU memory
-                # values = jax_array_list_to_numpy_diff(values)
-                # jacs = jax_array_list_to_numpy_diff(jacs)
-
                 # Putting the large matrix on CPU - This allows
                 # differentiation as well
                 cpu = jax.devices("cpu")[0]
-                values = np.vstack(jax.device_put(values, cpu))
-                jacs = np.vstack(jax.device_put(jacs, cpu))
-
+                values = jax.device_put(values, cpu)
+                jacs = jax.device_put(jacs, cpu)
             return values, jacs
         else:
-            values = []
-            for i in range(num_cuts):
-                if i < num_cuts - 1:
-                    input_col = jax.tree_map(
-                        lambda x: x[i * batch_size:(i + 1) * batch_size],
-                        input_collection)
-                else:
-                    input_col = jax.tree_map(lambda x: x[i * batch_size:],
-                                             input_collection)
-
-                val = vmap_fn(*input_col)
-                values.append(val)
-            values = np_version.vstack(values)
+            values = from_batches(map_fn(self.get_kernel_param_values(), input_collection))
             return values
 
+    def get_material_maps_key(self):
+        """Identify the material maps by the functions that create them, e.g., a new get_tensor_map assigned to the instance.
+        """
+        maps = [getattr(self, name, None) for name in material_map_names]
+        return tuple([getattr(fn, '__func__', fn) for fn in maps])
+
+    def get_kernel_params(self):
+        """Names of the attributes that material maps read and that may change between solves
+        (e.g., a time step size or a macroscopic strain). Child class should override.
+
+        The compiled kernels take their current values as traced arguments, so new values are used
+        without recompiling. They must be arrays or scalars (or pytrees of them) that the maps only use
+        in JAX operations, not in Python control flow.
+
+        By default, the attributes that set_params of the child class has assigned arrays or floats to,
+        so that parameters of an inverse problem (e.g., a Young's modulus) are not frozen in the kernels.
+
+        Returns
+        -------
+        names : Tuple[str]
+        """
+        return getattr(self, 'param_attributes', ())
+
+    def get_kernel_param_values(self):
+        return {name: getattr(self, name) for name in self.get_kernel_params()}
+
+    def with_kernel_params(self, fn):
+        """fn(*args) -> fn(kernel_params, *args). The attributes are set to kernel_params
+        (traced values inside jit) while fn runs, see get_kernel_params.
+        """
+        def fn_with_kernel_params(kernel_params, *args):
+            values = {name: getattr(self, name) for name in kernel_params}
+            for name, value in kernel_params.items():
+                setattr(self, name, value)
+            try:
+                return fn(*args)
+            finally:
+                for name, value in values.items():
+                    setattr(self, name, value)
+
+        return fn_with_kernel_params
+
+    def get_cached_kernel(self, key, build_fn):
+        """Compiled kernels are memoized so that JAX does not retrace and recompile them at every
+        residual/Jacobian evaluation. The kernels are traced with the material maps (and the attributes
+        they read) at the time of the first call, except for the attributes of get_kernel_params,
+        which are kernel arguments.
+
+        Parameters
+        ----------
+        key : Hashable
+        build_fn : Callable
+            Returns the jitted kernel, only called on a cache miss
+        """
+        maps_key = self.get_material_maps_key()
+        if getattr(self, 'kernel_maps_key', None) != maps_key:
+            self.invalidate_kernels()
+            self.kernel_maps_key = maps_key
+        if key not in self.kernel_cache:
+            logger.debug(f"Compiling kernel for key = {key[:3]}")
+            self.kernel_cache[key] = build_fn()
+        return self.kernel_cache[key]
+
+    def invalidate_kernels(self):
+        """Drop compiled kernels, and the cached Jacobian of a linear operator.
+        Child class should call this if attributes used in material maps, other than those of get_kernel_params
+        and set_params, are modified after the first solve.
+        """
+        self.kernel_cache = {}
+        self.linear_operator_data = None
+
+    def get_batch_size(self, jac_flag, cells_sol, kernal_vars):
+        """Choose the number of cells per batch from batch_memory_budget.
+
+        The per-cell footprint accounts for the kernel inputs and the largest intermediate of the
+        laplace kernel (num_quads, num_nodes, vec, dim), which forward-mode differentiation
+        carries for each of the num_nodes*vec tangents, producing the (num_nodes*vec)^2 cell Jacobian.
+        The Jacobian diagonal only carries the vec tangents of one node at a time.
+
+        Returns
+        -------
+        batch_size : int
+        """
+        itemsize = onp.dtype(cells_sol.dtype).itemsize
+        inputs = [cells_sol] + self.get_cell_geometry() + jax.tree_util.tree_leaves(kernal_vars)
+        input_bytes = sum([onp.prod(x.shape[1:], dtype=onp.int64) * itemsize for x in inputs])
+        num_tangents = self.vec if jac_flag == 'diag' else self.num_nodes * self.vec if jac_flag else 1
+        work_bytes = num_tangents * (self.num_quads * self.num_nodes * self.vec * self.dim + self.num_nodes * self.vec) * itemsize
+        # With sharding, every device gets at least one batch of its own cells
+        num_devices = self.get_num_devices()
+        num_cells_per_device = -(-len(self.cells) // num_devices)
+        batch_size = int(max(1, min(num_cells_per_device, self.batch_memory_budget // (input_bytes + work_bytes))))
+        # Balance the batches so that the padding of the tail batch is minimal
+        num_batches = num_devices * -(-num_cells_per_device // batch_size)
+        batch_size = -(-len(self.cells) // num_batches)
+        return batch_size
+
+    def to_batches(self, x, batch_size, np_version, num_batches=None):
+        """Pad the leading (cell) axis by repeating the last cell, then reshape to (num_batches, batch_size, ...)
+        Repeating a valid cell (instead of zeros) avoids NaNs in the padded part.
+        """
+        if num_batches is None:
+            num_batches = -(-len(x) // batch_size)
+        num_pads = num_batches * batch_size - len(x)
+        if num_pads > 0:
+            x = np_version.concatenate((x, np_version.repeat(x[-1:], num_pads, axis=0)), axis=0)
+        return x.reshape(num_batches, batch_size, *x.shape[1:])
+
+    def get_batched_geometry(self, batch_size, dtype=None, num_batches=None):
+        """Geometric factors do not change, so their padded and batched versions are kept.
+        """
+        key = (batch_size, dtype, num_batches)
+        if getattr(self, 'batched_geometry', (None, ))[0] != key:
+            self.batched_geometry = (key, [cast(self.to_batches(x, batch_size, onp, num_batches), dtype)
+                for x in self.get_cell_geometry()])
+        return self.batched_geometry[1]
+
+    def get_batched_scatter_inds(self, batch_size, num_batches):
+        """Batched scatter maps of cell values, for assembling where the cells are computed, see split_and_compute_cell
+
+        Returns
+        -------
+        mask : onp.ndarray
+            (num_batches, batch_size), zero for the padded cells
+        res_inds : onp.ndarray
+            (num_batches, batch_size, num_nodes*vec) global dof of each entry of the cell residual
+        jac_inds : onp.ndarray
+            (num_batches, batch_size, num_entries) CSR data slot of each entry of the cell Jacobian
+        """
+        key = (batch_size, num_batches)
+        if getattr(self, 'batched_scatter_inds', (None, ))[0] != key:
+            mask = onp.zeros(num_batches * batch_size)
+            mask[:self.num_cells] = 1.
+            res_inds = (self.vec * self.cells[:, :, None] + onp.arange(self.vec)[None, None, :]).reshape(self.num_cells, -1)
+            jac_inds = self.get_sparsity_pattern().scatter_inds.reshape(self.num_cells, -1)
+            self.batched_scatter_inds = (key, [mask.reshape(num_batches, batch_size)] +
+                [self.to_batches(x.astype(onp.int32), batch_size, onp, num_batches) for x in [res_inds, jac_inds]])
+        return self.batched_scatter_inds[1]
+
     def compute_face(self, cells_sol, np_version, jac_flag):
 
         def get_kernel_fn_face(cauchy_map):
@@ -679,29 +1354,27 @@ class FEM:
 
             return kernel, kernel_jac
 
-        # TODO: Better to move the following to __init__ function?
-        location_fns, value_fns = self.cauchy_bc_info
-        boundary_inds_list = self.get_boundary_conditions_inds(location_fns)
+        # Boundary faces and their geometric data are computed once, see compute_Cauchy_boundary_inds
+        _, value_fns = self.cauchy_bc_info
         values = []
-        selected_cells = []
-        for i, boundary_inds in enumerate(boundary_inds_list):
+        for i, boundary_inds in enumerate(self.cauchy_boundary_inds_list):
             selected_cell_sols = cells_sol[
                 boundary_inds[:, 0]]  # (num_selected_faces, num_nodes, vec))
-            selected_face_shape_vals = self.face_shape_vals[
-                boundary_inds[:,
-                              1]]  # (num_selected_faces, num_face_quads, num_nodes)
-            _, nanson_scale = self.get_face_shape_grads(
-                boundary_inds)  # (num_selected_faces, num_face_quads)
-            kernel, kernel_jac = get_kernel_fn_face(value_fns[i])
-            fn = kernel_jac if jac_flag else kernel
-            vmap_fn = jax.jit(jax.vmap(fn))
-            val = vmap_fn(selected_cell_sols, selected_face_shape_vals,
-                          nanson_scale)
-            values.append(val)
-            selected_cells.append(self.cells[boundary_inds[:, 0]])
+            # (num_selected_faces, num_face_quads, num_nodes), (num_selected_faces, num_face_quads)
+            selected_face_shape_vals, nanson_scale, _ = self.cauchy_face_data[i]
+
+            def get_vmap_fn():
+                kernel, kernel_jac = get_kernel_fn_face(value_fns[i])
+                fn = kernel_jac if jac_flag else kernel
+                return jax.jit(self.with_kernel_params(jax.vmap(fn)))
+
+            vmap_fn = self.get_cached_kernel(('face', i, jac_flag, value_fns[i]), get_vmap_fn)
+            dtype = self.precision_policy.kernel_dtype if jac_flag else self.precision_policy.accumulate_dtype
+            val = vmap_fn(self.get_kernel_param_values(), *cast((selected_cell_sols, selected_face_shape_vals, nanson_scale), dtype))
+            values.append(self.precision_policy.to_accumulate(val))
 
         values = np_version.vstack(values)
-        selected_cells = onp.vstack(selected_cells)
+        selected_cells = self.cauchy_selected_cells
 
         assert len(values) == len(selected_cells)
 
@@ -746,9 +1419,8 @@ class FEM:
         boundary_inds = self.neumann_boundary_inds_list[index]
         selected_cell_sols = cells_old_sol[
             boundary_inds[:, 0]]  # (num_selected_faces, num_nodes, vec))
-        selected_face_shape_vals = self.face_shape_vals[
-            boundary_inds[:,
-                          1]]  # (num_selected_faces, num_face_quads, num_nodes)
+        # (num_selected_faces, num_face_quads, num_nodes)
+        selected_face_shape_vals = self.get_Neumann_face_data()[0][index][0]
         # (num_selected_faces, 1, num_nodes, vec) * (num_selected_faces, num_face_quads, num_nodes, 1) -> (num_selected_faces, num_face_quads, vec)
         u = np.sum(selected_cell_sols[:, None, :, :] *
                    selected_face_shape_vals[:, :, :, None],
@@ -776,82 +1448,222 @@ class FEM:
         u_grads = np.sum(u_grads, axis=2)  # (num_cells, num_quads, vec, dim)
         return u_grads
 
-    def compute_residual_vars_helper(self, sol, weak_form, **internal_vars):
-        res = np.zeros((self.num_total_nodes, self.vec))
+    def compute_cell_residual(self, cells_sol, **internal_vars):
+        """Assembled cell residual (num_total_nodes, vec), without boundary and body force terms
+        """
+        if self.get_num_devices() > 1:
+            return self.split_and_compute_cell(cells_sol, np, False, assemble=True, **internal_vars)
+        weak_form = self.split_and_compute_cell(
+            cells_sol, np, False,
+            **internal_vars)  # (num_cells, num_nodes, vec)
+        return self.assemble_cell_residual(weak_form)
+
+    def assemble_cell_residual(self, weak_form):
+        res = np.zeros((self.num_total_nodes, self.vec), dtype=self.precision_policy.accumulate_dtype)
         weak_form = weak_form.reshape(-1,
                                       self.vec)  # (num_cells*num_nodes, vec)
-        res = res.at[self.cells.reshape(-1)].add(weak_form)
+        return res.at[self.cells.reshape(-1)].add(weak_form)
 
+    def compute_residual_vars_helper(self, sol, res, **internal_vars):
+        """Add boundary and body force terms to the assembled cell residual res (num_total_nodes, vec)
+        """
+        res = self.compute_cauchy_helper(sol, res)
+        return self.compute_loads_helper(res, **internal_vars)
+
+    def compute_cauchy_helper(self, sol, res):
+        """Add Cauchy terms to res (num_total_nodes, vec)
+        """
         if self.cauchy_bc_info is not None:
             cells_sol = sol[self.cells]
             values, selected_cells = self.compute_face(cells_sol, np, False)
             values = values.reshape(-1, self.vec)
             res = res.at[selected_cells.reshape(-1)].add(values)
+        return res
 
-        self.body_force = self.compute_body_force_by_fn()
+    def compute_loads_helper(self, res, **internal_vars):
+        """Subtract body force and Neumann terms from res (num_total_nodes, vec)
+        """
+        return res - self.compute_loads(**internal_vars)
+
+    def compute_loads(self, **internal_vars):
+        """Body force and Neumann terms, the right-hand side of a linear problem.
+        Nothing is stored on the problem, so that the residual can be traced (e.g., in a jitted Newton step).
+
+        Returns
+        -------
+        loads : np.DeviceArray
+            (num_total_nodes, vec)
+        """
+        body_force = self.compute_body_force_by_fn()
 
         # TODO: Should be useless since mass_map will handle it.
         if 'body' in internal_vars.keys():
-            self.body_force = self.compute_body_force_by_sol(
+            body_force = self.compute_body_force_by_sol(
                 internal_vars['body'], self.get_body_map())
 
-        self.neumann = self.compute_Neumann_integral_vars(**internal_vars)
-
-        res = res - self.body_force - self.neumann
-        return res
+        return body_force + self.compute_Neumann_integral_vars(**internal_vars)
 
     def compute_residual_vars(self, sol, **internal_vars):
         logger.debug(f"Computing cell residual...")
         cells_sol = sol[self.cells]  # (num_cells, num_nodes, vec)
-        weak_form = self.split_and_compute_cell(
-            cells_sol, np, False,
-            **internal_vars)  # (num_cells, num_nodes, vec)
-        return self.compute_residual_vars_helper(sol, weak_form,
+        res = self.compute_cell_residual(cells_sol, **internal_vars)
+        return self.compute_residual_vars_helper(sol, res,
                                                  **internal_vars)
 
+    def compute_constant_residual_vars(self, **internal_vars):
+        """Cell and Cauchy terms of the residual at a zero solution, without body force and Neumann terms.
+        The constant r(0) of an affine residual r(u) = A u + r(0), e.g., from a Cauchy term a (u - u_0).
+        """
+        logger.debug(f"Computing constant part of the residual...")
+        sol = np.zeros((self.num_total_nodes, self.vec), dtype=self.precision_policy.accumulate_dtype)
+        res = self.compute_cell_residual(sol[self.cells], **internal_vars)
+        return self.compute_cauchy_helper(sol, res)
+
+    def compute_linear_residual_vars(self, sol, **internal_vars):
+        """Residual of a linear operator from its cached Jacobian A and constant r(0) (cell and Cauchy terms),
+        A u + r(0) minus body force and Neumann terms, no cell kernel is evaluated
+        """
+        logger.debug(f"Computing residual with the cached linear operator...")
+        res = self.get_sparsity_pattern().matvec(self.linear_operator_data, sol.reshape(-1))
+        res = res.reshape(self.num_total_nodes, self.vec) + self.linear_operator_r0
+        return self.compute_loads_helper(res, **internal_vars)
+
     def compute_newton_vars(self, sol, **internal_vars):
         logger.debug(f"Computing cell Jacobian and cell residual...")
         cells_sol = sol[self.cells]  # (num_cells, num_nodes, vec)
-        # (num_cells, num_nodes, vec), (num_cells, num_nodes, vec, num_nodes, vec)
-        weak_form, cells_jac = self.split_and_compute_cell(
-            cells_sol, onp, True, **internal_vars)
-        V = cells_jac.reshape(-1)
-        inds = (self.vec * self.cells[:, :, None] +
-                onp.arange(self.vec)[None, None, :]).reshape(
-                    len(self.cells), -1)
-        I = onp.repeat(inds[:, :, None], self.num_nodes * self.vec,
-                       axis=2).reshape(-1)
-        J = onp.repeat(inds[:, None, :], self.num_nodes * self.vec,
-                       axis=1).reshape(-1)
-        self.I = I
-        self.J = J
-        self.V = V  # This is a jax array for now but in CPU memory
-        del V, I, J
+        sparsity = self.get_sparsity_pattern()
+        if self.get_num_devices() > 1:
+            res, self.csr_data = self.split_and_compute_cell(cells_sol, onp, True, assemble=True, **internal_vars)
+        else:
+            # (num_cells, num_nodes, vec), (num_cells, num_nodes, vec, num_nodes, vec)
+            weak_form, cells_jac = self.split_and_compute_cell(
+                cells_sol, onp, True, **internal_vars)
+            # Only values are scattered, the sparsity pattern is computed once
+            self.csr_data = sparsity.assemble(cells_jac)
+            del cells_jac
+            res = self.assemble_cell_residual(weak_form)
+        if self.precision_policy.kernel_dtype != self.precision_policy.accumulate_dtype:
+            # The residual (and with it the Newton convergence check) in full accumulation precision,
+            # much cheaper than the cell Jacobians
+            res = self.compute_cell_residual(cells_sol, **internal_vars)
 
         if self.cauchy_bc_info is not None:
             D_face, selected_cells = self.compute_face(cells_sol, onp, True)
-            V_face = D_face.reshape(-1)
-            inds_face = (self.vec * selected_cells[:, :, None] +
-                         onp.arange(self.vec)[None, None, :]).reshape(
-                             len(selected_cells), -1)
-            I_face = onp.repeat(inds_face[:, :, None],
-                                self.num_nodes * self.vec,
-                                axis=2).reshape(-1)
-            J_face = onp.repeat(inds_face[:, None, :],
-                                self.num_nodes * self.vec,
-                                axis=1).reshape(-1)
-            self.I = onp.hstack((self.I, I_face))
-            self.J = onp.hstack((self.J, J_face))
-            self.V = onp.hstack((self.V, V_face))
-
-        return self.compute_residual_vars_helper(sol, weak_form,
+            if not hasattr(self, 'cauchy_scatter_inds'):
+                self.cauchy_scatter_inds = sparsity.locate(selected_cells)
+            if self.symmetric:
+                D_face = sparsity.upper_triangle(D_face)
+            self.csr_data = self.csr_data + sparsity.assemble(
+                D_face, self.cauchy_scatter_inds)
+
+        return self.compute_residual_vars_helper(sol, res,
                                                  **internal_vars)
 
+    def compute_jacobian_diagonal(self, sol, **internal_vars):
+        """Diagonal of the global Jacobian, summed from the diagonals of cell (and Cauchy face) Jacobians.
+        Used to precondition the matrix-free solver, the global matrix is never formed.
+
+        Parameters
+        ----------
+        sol : np.DeviceArray
+            (num_total_nodes, vec)
+
+        Returns
+        -------
+        diag : np.DeviceArray
+            (num_total_nodes, vec)
+        """
+        cells_sol = sol[self.cells]  # (num_cells, num_nodes, vec)
+        _, cells_diag = self.split_and_compute_cell(cells_sol, np, 'diag',
+                                                    **internal_vars)
+        diag = np.zeros((self.num_total_nodes, self.vec), dtype=self.precision_policy.accumulate_dtype)
+        diag = diag.at[self.cells.reshape(-1)].add(cells_diag.reshape(-1, self.vec))
+
+        if self.cauchy_bc_info is not None:
+            D_face, selected_cells = self.compute_face(cells_sol, np, True)
+            # (num_selected_faces, num_nodes, vec, num_nodes, vec) -> (num_selected_faces*num_nodes, vec)
+            D_face = D_face.reshape(len(D_face), self.num_nodes * self.vec, -1)
+            face_diag = np.diagonal(D_face, axis1=1, axis2=2).reshape(-1, self.vec)
+            diag = diag.at[selected_cells.reshape(-1)].add(face_diag)
+
+        return diag
+
+    def get_sparsity_pattern(self):
+        """The global matrix sparsity pattern only depends on cells and vec, so it is built once.
+
+        Returns
+        -------
+        sparsity : SparsityPattern
+        """
+        if not hasattr(self, 'sparsity'):
+            logger.debug(f"Building sparsity pattern of the global matrix...")
+            self.sparsity = SparsityPattern(self.cells, self.vec,
+                                            self.num_total_dofs, self.symmetric)
+        return self.sparsity
+
+    @property
+    def A_sp_scipy(self):
+        """The global matrix of csr_data as scipy.sparse.csr_array, the full one also in symmetric mode.
+        Only built at the first access after an assembly, e.g., to set up a preconditioner on the host.
+        """
+        cached = getattr(self, 'A_sp_scipy_cache', (None, None))
+        if cached[0] is not self.csr_data:
+            logger.debug(f"Converting the global matrix to scipy...")
+            self.A_sp_scipy_cache = (self.csr_data, self.get_sparsity_pattern().to_scipy(onp.asarray(self.csr_data)))
+        return self.A_sp_scipy_cache[1]
+
+    def is_linear_operator(self):
+        """See linear_operator
+        """
+        if self.linear_operator is None:
+            return self.detect_linear_operator()
+        return self.linear_operator
+
+    def detect_linear_operator(self):
+        """Child class should override if its Jacobian is constant by default, see linear_operator
+        """
+        return False
+
+    def get_linear_operator_data(self):
+        """The cached Jacobian (nnz,) of a linear operator, None if there is none or it is outdated,
+        e.g., by a new material map
+        """
+        if not self.is_linear_operator() or getattr(self, 'kernel_maps_key', None) != self.get_material_maps_key():
+            return None
+        # Residuals in the accumulation precision need the cell kernels if the Jacobian is in a lower precision
+        if self.precision_policy.kernel_dtype != self.precision_policy.accumulate_dtype:
+            return None
+        # The Jacobian may depend on kernel parameters, e.g., a time step size
+        leaves, treedef = jax.tree_util.tree_flatten(self.get_kernel_param_values())
+        cached_leaves, cached_treedef = getattr(self, 'linear_operator_params', (None, None))
+        if cached_treedef is None or treedef != cached_treedef or \
+                not all(onp.array_equal(x, y) for x, y in zip(leaves, cached_leaves)):
+            return None
+        return getattr(self, 'linear_operator_data', None)
+
     def compute_residual(self, sol):
+        if self.get_linear_operator_data() is not None:
+            return self.compute_linear_residual_vars(sol, **self.internal_vars)
         return self.compute_residual_vars(sol, **self.internal_vars)
 
     def newton_update(self, sol):
-        return self.compute_newton_vars(sol, **self.internal_vars)
+        """The Jacobian is kept in self.csr_data, which is not recomputed for a cached linear operator.
+        self.tangent_sol = (sol, csr_data) records the solution it is the Jacobian at,
+        e.g., for the adjoint solve after the last Newton iteration, see solver.implicit_vjp.
+        """
+        if self.get_linear_operator_data() is not None:
+            res = self.compute_linear_residual_vars(sol, **self.internal_vars)
+        else:
+            res = self.compute_newton_vars(sol, **self.internal_vars)
+            # Not inside JAX transformations, e.g., newton_update called inside jax.jvp
+            if self.is_linear_operator() and not isinstance(self.csr_data, jax.core.Tracer):
+                self.linear_operator_data = np.asarray(self.csr_data)
+                self.linear_operator_r0 = self.compute_constant_residual_vars(**self.internal_vars)
+                leaves, treedef = jax.tree_util.tree_flatten(self.get_kernel_param_values())
+                self.linear_operator_params = ([onp.array(x) for x in leaves], treedef)
+        if not isinstance(sol, jax.core.Tracer) and not isinstance(self.csr_data, jax.core.Tracer):
+            self.tangent_sol = (sol, self.csr_data)
+        return res
 
     def set_params(self, params):
         """Used for solving inverse problems.
@@ -0,0 +1,327 @@
+"""Distributed solves with MPI: mesh partitioning, per-rank assembly, PETSc MPIAIJ matrices and parallel KSP.
+
+Rank 0 reads (or generates) the full mesh, partitions it and scatters to each rank only its own cells and nodes:
+the FEM problem (geometry, cell kernels, cell Jacobians) is created on the local mesh with the existing classes.
+Faces on the interfaces between ranks are found from the local topologies and an exchange with neighbor ranks.
+The local residuals and Jacobian values are summed into distributed PETSc objects, entries of nodes shared
+by several ranks (ghost nodes) are exchanged by PETSc.
+
+Usage, run with e.g. mpirun -n 4 python example.py (requires mpi4py and PETSc built with MPI):
+    dmesh = DistributedMesh(mesh if rank == 0 else None, 'HEX8')
+    problem = HyperElasticity(dmesh.local_mesh, vec=3, dim=3, ele_type='HEX8', dirichlet_bc_info=...)
+    local_sol = distributed_solver(problem, dmesh)
+    sol = dmesh.gather(local_sol)  # (num_total_nodes, vec) on rank 0, None on other ranks
+"""
+import numpy as onp
+import time
+from petsc4py import PETSc
+
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.basis import get_face_shape_vals_and_grads
+from jax_am.fem.cache import as_rows
+from jax_am import logger
+
+
+def partition_cells_rcb(points, cells, num_parts):
+    """Recursive coordinate bisection of the cell centroids. Each cut is normal to the longest extent of the
+    cells it splits, and the cells are split in proportion to the number of parts on each side.
+
+    Returns
+    -------
+    parts : onp.ndarray
+        (num_cells,) part index of each cell
+    """
+    centroids = onp.mean(onp.take(points, cells, axis=0), axis=1)
+    parts = onp.zeros(len(cells), dtype=onp.int32)
+
+    def bisect(cell_inds, first_part, num_sub_parts):
+        if num_sub_parts == 1:
+            parts[cell_inds] = first_part
+            return
+        num_left = num_sub_parts // 2
+        sub_centroids = centroids[cell_inds]
+        axis = onp.argmax(onp.max(sub_centroids, axis=0) - onp.min(sub_centroids, axis=0))
+        cell_inds = cell_inds[onp.argsort(sub_centroids[:, axis], kind='stable')]
+        split = len(cell_inds) * num_left // num_sub_parts
+        bisect(cell_inds[:split], first_part, num_left)
+        bisect(cell_inds[split:], first_part + num_left, num_sub_parts - num_left)
+
+    bisect(onp.arange(len(cells)), 0, num_parts)
+    return parts
+
+
+def split_mesh(points, cells, parts, num_ranks):
+    """Split a mesh over ranks, run on one rank only.
+
+    Nodes are renumbered for PETSc so that the nodes owned by each rank are contiguous.
+    A node is owned by the lowest rank among the cells it belongs to.
+
+    Parameters
+    ----------
+    parts : onp.ndarray
+        (num_cells,) rank of each cell
+
+    Returns
+    -------
+    petsc_inds : onp.ndarray
+        (num_total_nodes,) PETSc index of each original node
+    rank_data : list
+        Dict of the local mesh of each rank, the attributes of DistributedMesh and
+        shared_nodes, shared_ranks : onp.ndarray
+            (num_shared,) local node and other rank of each pair of a local node and another rank having it
+    """
+    owners = onp.full(len(points), num_ranks - 1, dtype=onp.int32)
+    onp.minimum.at(owners, cells.reshape(-1), onp.repeat(parts, cells.shape[1]).astype(onp.int32))
+    petsc_inds = onp.empty(len(points), dtype=onp.int64)
+    petsc_inds[onp.argsort(owners, kind='stable')] = onp.arange(len(points))
+    offsets = onp.hstack((0, onp.cumsum(onp.bincount(owners, minlength=num_ranks))))
+
+    # Unique (node, rank) pairs of the nodes of the cells of each rank
+    pairs = onp.unique(cells.reshape(-1).astype(onp.int64) * num_ranks + onp.repeat(parts, cells.shape[1]))
+    pair_nodes, pair_ranks = pairs // num_ranks, pairs % num_ranks
+    rank_data = []
+    for rank in range(num_ranks):
+        cell_inds = onp.flatnonzero(parts == rank)
+        node_inds, local_cells = onp.unique(cells[cell_inds], return_inverse=True)
+        shared = onp.isin(pair_nodes, node_inds) & (pair_ranks != rank)
+        rank_data.append({'cell_inds': cell_inds,
+                          'node_inds': node_inds,
+                          'petsc_node_inds': petsc_inds[node_inds],
+                          'owned_range': (offsets[rank], offsets[rank + 1]),
+                          'num_total_nodes': len(points),
+                          'points': points[node_inds],
+                          'cells': local_cells.reshape(len(cell_inds), -1),
+                          'shared_nodes': onp.searchsorted(node_inds, pair_nodes[shared]),
+                          'shared_ranks': pair_ranks[shared]})
+    return petsc_inds, rank_data
+
+
+def get_external_face_flags(local_mesh, ele_type, node_inds, shared_nodes, shared_ranks, mpi_comm):
+    """(num_local_cells, num_faces) True if the face is on the boundary of the full mesh.
+    A face of only one local cell is on the interface to another rank if that rank has it too: each rank sends
+    the faces all of whose nodes it shares with a neighbor rank to it, identified by their original node indices.
+
+    Parameters
+    ----------
+    node_inds : onp.ndarray
+        (num_local_nodes,) original index of each local node
+    shared_nodes, shared_ranks : onp.ndarray
+        See split_mesh
+    mpi_comm : mpi4py.MPI.Comm
+        None on a single rank
+    """
+    topology = local_mesh.get_topology(ele_type)
+    flags = topology.face_counts[topology.face_ids] == 1
+    if mpi_comm is None:
+        return flags
+    _, _, _, _, face_inds = get_face_shape_vals_and_grads(ele_type)
+    cell_inds, faces = onp.nonzero(flags)
+    # (num_candidate_faces, num_face_nodes) local nodes of each candidate face
+    face_nodes = onp.asarray(local_mesh.cells)[cell_inds[:, None], onp.asarray(face_inds)[faces]]
+    face_keys = onp.sort(node_inds[face_nodes], axis=-1).astype(onp.int64)
+    sent = [face_keys[:0]] * mpi_comm.size
+    for rank in onp.unique(shared_ranks):
+        shared = onp.zeros(len(node_inds), dtype=bool)
+        shared[shared_nodes[shared_ranks == rank]] = True
+        sent[rank] = face_keys[onp.all(shared[face_nodes], axis=1)]
+    received = onp.vstack(mpi_comm.alltoall(sent))
+    interface = onp.isin(as_rows(face_keys), as_rows(received))
+    flags[cell_inds[interface], faces[interface]] = False
+    return flags
+
+
+class SubMesh(Mesh):
+    """The cells of one partition with locally numbered nodes.
+    Faces on the interface to other partitions are not boundary faces.
+    """
+    def __init__(self, points, cells, ele_type, external_face_flags):
+        super().__init__(points, cells, ele_type)
+        # (num_cells, num_faces) True if the face is on the boundary of the full mesh, see get_external_face_flags
+        self.external_face_flags = external_face_flags
+
+    def get_boundary_faces(self, location_fn, ele_type=None):
+        boundary_inds = super().get_boundary_faces(location_fn, ele_type)
+        return boundary_inds[self.external_face_flags[boundary_inds[:, 0], boundary_inds[:, 1]]]
+
+
+class DistributedMesh():
+    """Partition of a mesh over the ranks of an MPI communicator, see split_mesh.
+    Only rank 0 holds the full mesh, the other ranks receive their cells and nodes.
+
+    Attributes
+    ----------
+    local_mesh : SubMesh
+        The cells of this rank, create the FEM problem on it
+    cell_inds : onp.ndarray
+        (num_local_cells,) original index of each local cell
+    node_inds : onp.ndarray
+        (num_local_nodes,) original index of each local node
+    petsc_node_inds : onp.ndarray
+        (num_local_nodes,) PETSc index of each local node
+    owned_range : tuple
+        (start, end) PETSc indices of the nodes owned by this rank
+    petsc_inds : onp.ndarray
+        (num_total_nodes,) PETSc index of each original node on rank 0, None on the other ranks
+    """
+    def __init__(self, mesh, ele_type, comm=None, parts=None):
+        """
+        Parameters
+        ----------
+        mesh : Mesh
+            The full mesh, only read on rank 0, the other ranks may pass None
+        ele_type : str
+        comm : PETSc.Comm
+            Defaults to PETSc.COMM_WORLD
+        parts : onp.ndarray
+            (num_cells,) rank of each cell, e.g., from a graph partitioner, only read on rank 0.
+            Recursive coordinate bisection if None.
+        """
+        self.comm = PETSc.COMM_WORLD if comm is None else comm
+        self.rank, self.size = self.comm.getRank(), self.comm.getSize()
+        # PETSc without MPI has no mpi4py communicator
+        mpi_comm = self.comm.tompi4py() if self.size > 1 else None
+        self.petsc_inds, rank_data = None, None
+        if self.rank == 0:
+            points, cells = onp.asarray(mesh.points), onp.asarray(mesh.cells)
+            parts = partition_cells_rcb(points, cells, self.size) if parts is None else onp.asarray(parts)
+            self.petsc_inds, rank_data = split_mesh(points, cells, parts, self.size)
+        data = rank_data[0] if mpi_comm is None else mpi_comm.scatter(rank_data, root=0)
+        del rank_data
+
+        self.cell_inds, self.node_inds = data['cell_inds'], data['node_inds']
+        self.petsc_node_inds, self.owned_range = data['petsc_node_inds'], data['owned_range']
+        self.num_total_nodes = data['num_total_nodes']
+        self.local_mesh = SubMesh(data['points'], data['cells'], ele_type, None)
+        self.local_mesh.external_face_flags = get_external_face_flags(self.local_mesh, ele_type, self.node_inds,
+                                                                      data['shared_nodes'], data['shared_ranks'],
+                                                                      mpi_comm)
+        logger.debug(f"Rank {self.rank}: {len(self.cell_inds)} cells, {len(self.node_inds)} nodes, "
+                     f"{self.owned_range[1] - self.owned_range[0]} owned")
+
+    def get_petsc_dofs(self, vec):
+        """(num_local_nodes*vec,) PETSc index of each local dof
+        """
+        return (vec * self.petsc_node_inds[:, None] + onp.arange(vec)[None, :]).reshape(-1).astype(PETSc.IntType)
+
+    def create_vec(self, vec):
+        num_owned_dofs = (self.owned_range[1] - self.owned_range[0]) * vec
+        return PETSc.Vec().createMPI((num_owned_dofs, self.num_total_nodes * vec), comm=self.comm)
+
+    def gather(self, local_sol):
+        """Collect the local solutions to rank 0
+
+        Parameters
+        ----------
+        local_sol : ndarray
+            (num_local_nodes, vec)
+
+        Returns
+        -------
+        sol : onp.ndarray
+            (num_total_nodes, vec) in the original node order on rank 0, None on the other ranks
+        """
+        local_sol = onp.asarray(local_sol)
+        vec = local_sol.shape[1]
+        x = self.create_vec(vec)
+        x.setValues(self.get_petsc_dofs(vec), local_sol.reshape(-1), addv=PETSc.InsertMode.INSERT_VALUES)
+        x.assemble()
+        scatter, x_zero = PETSc.Scatter().toZero(x)
+        scatter.scatter(x, x_zero, PETSc.InsertMode.INSERT_VALUES, PETSc.ScatterMode.FORWARD)
+        if self.rank != 0:
+            return None
+        return x_zero.getArray().reshape(-1, vec)[self.petsc_inds]
+
+
+def distributed_solver(problem, dmesh, linear=False, initial_guess=None, ksp_type='bcgsl', pc_type='bjacobi', tol=1e-6):
+    """Newton's method with Dirichlet B.C. imposed by row elimination, the global matrix is an MPIAIJ matrix
+    and the linear systems are solved with a parallel KSP.
+
+    Parameters
+    ----------
+    problem : FEM
+        Created on dmesh.local_mesh, periodic B.C. and symmetric assembly are not supported
+    dmesh : DistributedMesh
+    initial_guess : ndarray
+        (num_local_nodes, vec)
+    ksp_type, pc_type : str
+        PETSc types, the default block Jacobi preconditioner uses ILU on each rank
+    tol : float
+        Tolerance on the l_2 norm of the global residual
+
+    Returns
+    -------
+    local_sol : onp.ndarray
+        (num_local_nodes, vec), see DistributedMesh.gather
+    """
+    assert len(problem.p_node_inds_list_A) == 0, f"Periodic B.C. are not supported by the distributed solver"
+    assert not problem.symmetric, f"Symmetric assembly is not supported by the distributed solver"
+    start = time.time()
+    vec = problem.vec
+    petsc_dofs = dmesh.get_petsc_dofs(vec)
+
+    # Local Dirichlet dofs, the nodes shared by several ranks are set by each of them
+    bc_dofs = onp.hstack([onp.zeros(0, dtype=onp.int64)] + [onp.asarray(node_inds * vec + vec_inds) for node_inds, vec_inds
+                         in zip(problem.node_inds_list, problem.vec_inds_list)]).astype(onp.int64)
+    bc_vals = onp.hstack([onp.zeros(0)] + [onp.broadcast_to(onp.asarray(vals, dtype=onp.float64), (len(node_inds),))
+                         for node_inds, vals in zip(problem.node_inds_list, problem.vals_list)])
+    bc_rows = petsc_dofs[bc_dofs]
+
+    # The sparsity pattern is fixed, COO preallocation lets PETSc sum entries of shared dofs across ranks
+    sparsity = problem.get_sparsity_pattern()
+    num_owned_dofs = (dmesh.owned_range[1] - dmesh.owned_range[0]) * vec
+    A = PETSc.Mat().create(comm=dmesh.comm)
+    A.setSizes(((num_owned_dofs, dmesh.num_total_nodes * vec), (num_owned_dofs, dmesh.num_total_nodes * vec)))
+    A.setType(PETSc.Mat.Type.AIJ)
+    A.setPreallocationCOO(petsc_dofs[sparsity.rows], petsc_dofs[sparsity.cols])
+    # Zeroed Dirichlet rows must keep their entries, so that the COO values can be set again
+    A.setOption(PETSc.Mat.Option.KEEP_NONZERO_PATTERN, True)
+
+    x = dmesh.create_vec(vec)
+    b, inc = x.duplicate(), x.duplicate()
+    # Owned and ghost values of the local dofs
+    local_x = PETSc.Vec().createSeq(len(petsc_dofs), comm=PETSc.COMM_SELF)
+    local_is = PETSc.IS().createGeneral(petsc_dofs, comm=PETSc.COMM_SELF)
+    to_local = PETSc.Scatter().create(x, local_is, local_x, None)
+
+    ksp = PETSc.KSP().create(comm=dmesh.comm)
+    ksp.setOperators(A)
+    ksp.setType(ksp_type)
+    ksp.pc.setType(pc_type)
+    ksp.setFromOptions()
+
+    if initial_guess is not None:
+        x.setValues(petsc_dofs, onp.asarray(initial_guess).reshape(-1))
+    x.setValues(bc_rows, bc_vals)
+    x.assemble()
+
+    def newton_update():
+        to_local.scatter(x, local_x, PETSc.InsertMode.INSERT_VALUES, PETSc.ScatterMode.FORWARD)
+        local_dofs = local_x.getArray()
+        res = onp.asarray(problem.newton_update(local_dofs.reshape(-1, vec))).reshape(-1)
+        b.zeroEntries()
+        b.setValues(petsc_dofs, res, addv=PETSc.InsertMode.ADD_VALUES)
+        b.assemble()
+        # Row elimination: res = u - u_b on Dirichlet dofs
+        b.setValues(bc_rows, local_dofs[bc_dofs] - bc_vals, addv=PETSc.InsertMode.INSERT_VALUES)
+        b.assemble()
+        A.setValuesCOO(onp.asarray(problem.csr_data), addv=PETSc.InsertMode.INSERT_VALUES)
+        A.zeroRows(bc_rows, diag=1.)
+        return b.norm()
+
+    res_val = newton_update()
+    logger.debug(f"Before, res l_2 = {res_val}")
+    while res_val > tol:
+        b.scale(-1.)
+        ksp.solve(b, inc)
+        logger.debug(f"KSP {ksp.getType()} with pc {ksp.pc.getType()} took {ksp.getIterationNumber()} iterations")
+        x.axpy(1., inc)
+        res_val = newton_update()
+        logger.debug(f"res l_2 = {res_val}")
+        if linear:
+            break
+
+    assert onp.isfinite(res_val), f"res_val contains NaN, stop the program!"
+    to_local.scatter(x, local_x, PETSc.InsertMode.INSERT_VALUES, PETSc.ScatterMode.FORWARD)
+    local_sol = local_x.getArray().copy().reshape(-1, vec)
+    logger.info(f"Rank {dmesh.rank}: distributed solve took {time.time() - start} [s]")
+    return local_sol
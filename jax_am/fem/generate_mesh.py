@@ -1,15 +1,141 @@
 import os
 import gmsh
 import numpy as onp
+import scipy
 import meshio
 
 from jax_am.fem.basis import get_elements
 from jax_am.fem.basis import get_face_shape_vals_and_grads
+from jax_am.fem.cache import as_rows
 
 import jax
 import jax.numpy as np
 
 
+def get_rcm_node_order(cells, num_total_nodes):
+    """Reverse Cuthill-McKee ordering of the node graph (nodes sharing a cell are connected)
+
+    Returns
+    -------
+    node_perm : onp.ndarray
+        (num_total_nodes,) new-to-original node indices
+    """
+    num_cells, num_nodes = cells.shape
+    # Node-cell incidence, (num_total_nodes, num_cells), the graph is its product with its transpose
+    incidence = scipy.sparse.csr_matrix((onp.ones(cells.size), (cells.reshape(-1), onp.repeat(onp.arange(num_cells), num_nodes))),
+                                        shape=(num_total_nodes, num_cells))
+    graph = (incidence @ incidence.T).tocsr()
+    return onp.asarray(scipy.sparse.csgraph.reverse_cuthill_mckee(graph, symmetric_mode=True), dtype=onp.int64)
+
+
+def get_morton_cell_order(points, cells, num_bits=21):
+    """Order cells along a Morton (Z-order) space-filling curve through their centroids
+
+    Returns
+    -------
+    cell_perm : onp.ndarray
+        (num_cells,) new-to-original cell indices
+    """
+    centroids = onp.mean(onp.take(points, cells, axis=0), axis=1)  # (num_cells, dim)
+    lower, upper = onp.min(centroids, axis=0), onp.max(centroids, axis=0)
+    scale = (2**num_bits - 1)/onp.where(upper > lower, upper - lower, 1.)
+    coords = ((centroids - lower)*scale).astype(onp.uint64)  # (num_cells, dim)
+    dim = coords.shape[1]
+    codes = onp.zeros(len(cells), dtype=onp.uint64)
+    # Interleave the bits of all coordinates, most significant first
+    for bit in range(num_bits - 1, -1, -1):
+        for d in range(dim):
+            codes = (codes << onp.uint64(1)) | ((coords[:, d] >> onp.uint64(bit)) & onp.uint64(1))
+    return onp.argsort(codes, kind='stable')
+
+
+class MeshTopology():
+    """Face and node connectivity of a mesh, built with sort/unique (no Python loops over cells).
+
+    Attributes
+    ----------
+    face_ids : onp.ndarray
+        (num_cells, num_faces) unique face index of each local face, shared faces have the same index
+    face_cells : onp.ndarray
+        (num_unique_faces, 2) the (at most two) cells adjacent to each unique face, -1 if there is only one
+    face_counts : onp.ndarray
+        (num_unique_faces,) number of cells adjacent to each unique face
+    node_cells_indptr, node_cells : onp.ndarray
+        Node-to-cell map in CSR format, the cells of node i are node_cells[node_cells_indptr[i]:node_cells_indptr[i + 1]]
+    """
+    def __init__(self, cells, face_inds):
+        """
+        Parameters
+        ----------
+        cells : onp.ndarray
+            (num_cells, num_nodes)
+        face_inds : onp.ndarray
+            (num_faces, num_face_nodes) local node indices of each face
+        """
+        cells = onp.asarray(cells)
+        self.num_cells, self.num_faces = len(cells), len(face_inds)
+        # A face is identified by its sorted node indices, (num_cells*num_faces, num_face_nodes)
+        face_keys = onp.sort(cells[:, face_inds], axis=-1).reshape(self.num_cells*self.num_faces, -1)
+        _, first_inds, face_ids, self.face_counts = onp.unique(as_rows(face_keys), return_index=True,
+                                                               return_inverse=True, return_counts=True)
+        self.face_ids = face_ids.reshape(self.num_cells, self.num_faces)
+        assert onp.all(self.face_counts <= 2), f"Non-manifold mesh: a face is shared by more than two cells"
+
+        flat_face_ids = self.face_ids.reshape(-1)
+        cell_inds = onp.repeat(onp.arange(self.num_cells), self.num_faces)
+        self.face_cells = -onp.ones((len(self.face_counts), 2), dtype=onp.int64)
+        self.face_cells[:, 0] = cell_inds[first_inds]
+        # The second occurrence of each shared face
+        second = onp.ones(len(flat_face_ids), dtype=bool)
+        second[first_inds] = False
+        self.face_cells[flat_face_ids[second], 1] = cell_inds[second]
+
+        node_order = onp.argsort(cells.reshape(-1), kind='stable')
+        self.node_cells = node_order // cells.shape[1]
+        self.node_cells_indptr = onp.concatenate((onp.zeros(1, dtype=onp.int64),
+            onp.cumsum(onp.bincount(cells.reshape(-1), minlength=cells.max() + 1))))
+
+    def count_faces(self, cell_inds, face_counts=None):
+        """Number of cells (among cell_inds) adjacent to each unique face.
+        Pass the counts of previously active cells to update them incrementally when cells are activated.
+
+        Parameters
+        ----------
+        cell_inds : onp.ndarray
+            (num_selected_cells,) newly activated cells, must not be counted before
+        face_counts : onp.ndarray
+            (num_unique_faces,) counts of the previously active cells, zeros if None
+
+        Returns
+        -------
+        face_counts : onp.ndarray
+            (num_unique_faces,)
+        """
+        new_counts = onp.bincount(self.face_ids[cell_inds].reshape(-1), minlength=len(self.face_counts))
+        return new_counts if face_counts is None else face_counts + new_counts
+
+    def get_external_faces(self, active_cell_truth_tab=None, face_counts=None):
+        """Faces that belong to exactly one (active) cell
+
+        Parameters
+        ----------
+        active_cell_truth_tab : onp.ndarray
+            (num_cells,) bool, all cells are active if None
+        face_counts : onp.ndarray
+            (num_unique_faces,) see count_faces, computed from active_cell_truth_tab if None
+
+        Returns
+        -------
+        external_faces : onp.ndarray
+            (num_external_faces, 2) [cell index, local face index], ordered by cell and then local face
+        """
+        if active_cell_truth_tab is None:
+            return onp.argwhere(self.face_counts[self.face_ids] == 1)
+        if face_counts is None:
+            face_counts = self.count_faces(onp.argwhere(active_cell_truth_tab).reshape(-1))
+        return onp.argwhere((face_counts[self.face_ids] == 1) & active_cell_truth_tab[:, None])
+
+
 class Mesh():
     """
     A custom mesh manager might be better using a third-party library like
@@ -21,11 +147,107 @@ class Mesh():
         self.points = points
         self.cells = cells
         self.ele_type = ele_type
+        # Set by reorder, new-to-original node and cell indices
+        self.node_perm = None
+        self.cell_perm = None
+
+    def reorder(self, node_order='rcm', cell_order='morton'):
+        """Opt-in reordering for locality: nodes by Reverse Cuthill-McKee (smaller matrix bandwidth,
+        better ILU), cells along a Morton (Z-order) curve (better locality of gathers and scatter-adds).
+
+        Parameters
+        ----------
+        node_order : str or None
+            'rcm' or None to keep the node order
+        cell_order : str or None
+            'morton' or None to keep the cell order
+
+        Returns
+        -------
+        mesh : Mesh
+            Reordered mesh, with node_perm and cell_perm to map data back, see to_original_nodes etc.
+        """
+        assert node_order in ['rcm', None] and cell_order in ['morton', None]
+        points, cells = onp.asarray(self.points), onp.asarray(self.cells)
+        node_perm = get_rcm_node_order(cells, len(points)) if node_order == 'rcm' else onp.arange(len(points))
+        cell_perm = get_morton_cell_order(points, cells) if cell_order == 'morton' else onp.arange(len(cells))
+        node_inv_perm = onp.argsort(node_perm)
+        mesh = Mesh(points[node_perm], node_inv_perm[cells[cell_perm]], self.ele_type)
+        # Compose with an earlier reordering, so that the maps always refer to the original mesh
+        mesh.node_perm = node_perm if self.node_perm is None else self.node_perm[node_perm]
+        mesh.cell_perm = cell_perm if self.cell_perm is None else self.cell_perm[cell_perm]
+        return mesh
+
+    def to_original_nodes(self, data):
+        """Nodal data (num_total_nodes, ...) of this mesh in the node order of the original mesh
+        """
+        return data if self.node_perm is None else data[onp.argsort(self.node_perm)]
+
+    def from_original_nodes(self, data):
+        """Nodal data (num_total_nodes, ...) given in the node order of the original mesh, in the order of this mesh
+        """
+        return data if self.node_perm is None else data[self.node_perm]
+
+    def to_original_cells(self, data):
+        """Cell data (num_cells, ...) of this mesh in the cell order of the original mesh
+        """
+        return data if self.cell_perm is None else data[onp.argsort(self.cell_perm)]
+
+    def from_original_cells(self, data):
+        """Cell data (num_cells, ...) given in the cell order of the original mesh, in the order of this mesh
+        """
+        return data if self.cell_perm is None else data[self.cell_perm]
+
+    def get_original_mesh(self):
+        """Points and cells of the original mesh (before reorder)
+        """
+        points, cells = self.to_original_nodes(onp.asarray(self.points)), onp.asarray(self.cells)
+        if self.node_perm is not None:
+            cells = self.node_perm[cells]
+        return points, self.to_original_cells(cells)
+
+    def get_topology(self, ele_type=None):
+        """Topology is computed lazily and cached per element type (which defines the local faces).
+
+        Returns
+        -------
+        topology : MeshTopology
+        """
+        ele_type = self.ele_type if ele_type is None else ele_type
+        if not hasattr(self, 'topology_cache'):
+            self.topology_cache = {}
+        if ele_type not in self.topology_cache:
+            _, _, _, _, face_inds = get_face_shape_vals_and_grads(ele_type)
+            self.topology_cache[ele_type] = MeshTopology(self.cells, face_inds)
+        return self.topology_cache[ele_type]
+
+    def get_boundary_faces(self, location_fn, ele_type=None):
+        """External faces all of whose nodes satisfy location_fn, it is only evaluated on external faces.
+
+        Parameters
+        ----------
+        location_fn : Callable
+            Callable: a function that inputs a point and returns a boolean
+            value describing whether the boundary condition should be applied.
+
+        Returns
+        -------
+        boundary_inds : onp.ndarray
+            (num_selected_faces, 2) [cell index, local face index], ordered by cell and then local face
+        """
+        ele_type = self.ele_type if ele_type is None else ele_type
+        _, _, _, _, face_inds = get_face_shape_vals_and_grads(ele_type)
+        external_faces = self.get_topology(ele_type).get_external_faces()
+        # (num_external_faces, num_face_nodes, dim)
+        face_points = onp.take(self.points, self.cells[external_faces[:, 0, None], face_inds[external_faces[:, 1]]], axis=0)
+        boundary_flags = jax.vmap(location_fn)(face_points.reshape(-1, face_points.shape[-1]))
+        boundary_flags = onp.all(onp.array(boundary_flags).reshape(face_points.shape[:2]), axis=1)
+        return external_faces[boundary_flags]
 
     def count_selected_faces(self, location_fn):
         """Given location functions, compute the count of faces that satisfy
         the location function. Useful for setting up distributed load
-        conditions.
+        conditions. Only external faces are considered.
 
         Parameters
         ----------
@@ -37,21 +259,7 @@ class Mesh():
         -------
         face_count : int
         """
-
-        _, _, _, _, face_inds = get_face_shape_vals_and_grads(self.ele_type)
-        cell_points = onp.take(self.points, self.cells, axis=0)
-        cell_face_points = onp.take(cell_points, face_inds, axis=1)
-
-        vmap_location_fn = jax.vmap(location_fn)
-
-        def on_boundary(cell_points):
-            boundary_flag = vmap_location_fn(cell_points)
-            return onp.all(boundary_flag)
-
-        vvmap_on_boundary = jax.vmap(jax.vmap(on_boundary))
-        boundary_flags = vvmap_on_boundary(cell_face_points)
-        boundary_inds = onp.argwhere(boundary_flags)
-        return boundary_inds.shape[0]
+        return self.get_boundary_faces(location_fn).shape[0]
 
 
 
@@ -0,0 +1,200 @@
+"""Compact storage of internal variables (history state, material parameters, etc.).
+
+Internal variables are passed to the material maps as (num_cells, num_quads, ...) arrays by default.
+The containers below store them more compactly and are expanded lazily, one cell or one quadrature
+point at a time, inside the kernels:
+    - SymmetricTensor : symmetric (dim, dim) tensors at quadrature points in Voigt form
+    - CellConstant : one value per cell, shared by all quadrature points of the cell
+    - GrainConstant : one value per grain (or any group of cells), with a cell-to-grain index map
+
+The containers are JAX pytrees, so they can be differentiated (e.g., params of ad_wrapper)
+and updated like plain arrays. The material maps always see the expanded (dim, dim) tensors or values.
+"""
+import numpy as onp
+import jax
+import jax.numpy as np
+
+
+def get_voigt_inds(dim):
+    """Row and column indices of the Voigt components, [xx, yy, zz, yz, xz, xy] in 3D and [xx, yy, xy] in 2D
+
+    Returns
+    -------
+    rows, cols : onp.ndarray
+        (dim*(dim + 1)//2,)
+    """
+    if dim == 3:
+        return onp.array([0, 1, 2, 1, 0, 0]), onp.array([0, 1, 2, 2, 2, 1])
+    if dim == 2:
+        return onp.array([0, 1, 0]), onp.array([0, 1, 1])
+    return onp.array([0]), onp.array([0])
+
+
+def to_voigt(tensor):
+    """(..., dim, dim) -> (..., dim*(dim + 1)//2), the tensor is assumed to be symmetric
+    """
+    rows, cols = get_voigt_inds(tensor.shape[-1])
+    return tensor[..., rows, cols]
+
+
+def from_voigt(voigt):
+    """(..., dim*(dim + 1)//2) -> (..., dim, dim)
+    """
+    dim = {1: 1, 3: 2, 6: 3}[voigt.shape[-1]]
+    rows, cols = get_voigt_inds(dim)
+    # Voigt component of each (i, j) entry, (dim, dim)
+    inds = onp.zeros((dim, dim), dtype=onp.int32)
+    inds[rows, cols] = onp.arange(len(rows))
+    inds[cols, rows] = onp.arange(len(rows))
+    return voigt[..., inds]
+
+
+@jax.tree_util.register_pytree_node_class
+class SymmetricTensor:
+    """Symmetric tensors at quadrature points, stored in Voigt form
+
+    Attributes
+    ----------
+    values : ndarray
+        (num_cells, num_quads, dim*(dim + 1)//2)
+    """
+    def __init__(self, values):
+        self.values = values
+
+    @classmethod
+    def from_tensor(cls, tensor):
+        """(num_cells, num_quads, dim, dim) -> SymmetricTensor
+        """
+        return cls(to_voigt(tensor))
+
+    def to_tensor(self):
+        """(num_cells, num_quads, dim, dim)
+        """
+        return from_voigt(self.values)
+
+    def expand(self):
+        return from_voigt(self.values)
+
+    def to_cells(self):
+        return self
+
+    def tree_flatten(self):
+        return (self.values, ), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
+
+
+@jax.tree_util.register_pytree_node_class
+class CellConstant:
+    """Internal variable that is constant in each cell, not repeated over quadrature points
+
+    Attributes
+    ----------
+    values : ndarray
+        (num_cells, ...)
+    """
+    def __init__(self, values):
+        self.values = values
+
+    def expand(self):
+        return self.values
+
+    def to_cells(self):
+        return self
+
+    def tree_flatten(self):
+        return (self.values, ), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
+
+
+class StaticArray:
+    """Hashable (by identity) wrapper of an integer array, used as pytree aux data so that
+    index maps are neither traced nor differentiated
+    """
+    def __init__(self, array):
+        self.array = array
+
+    def __eq__(self, other):
+        return isinstance(other, StaticArray) and self.array is other.array
+
+    def __hash__(self):
+        return id(self.array)
+
+
+@jax.tree_util.register_pytree_node_class
+class GrainConstant:
+    """Internal variable that is constant in each grain, e.g., the crystal orientation in polycrystals.
+    Stored once per grain, and only gathered to the cells of a kernel evaluation.
+
+    Attributes
+    ----------
+    values : ndarray
+        (num_grains, ...)
+    inds : onp.ndarray
+        (num_cells,) grain index of each cell
+    """
+    def __init__(self, values, inds):
+        self.values = values
+        self.inds = onp.asarray(inds)
+
+    def to_cells(self):
+        return CellConstant(self.values[self.inds])
+
+    def tree_flatten(self):
+        return (self.values, ), StaticArray(self.inds)
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children, aux_data.array)
+
+
+internal_var_types = (SymmetricTensor, CellConstant, GrainConstant)
+
+
+def is_internal_var(x):
+    return isinstance(x, internal_var_types)
+
+
+def to_cells(internal_vars):
+    """Convert GrainConstant to CellConstant so that all leaves have a leading cell axis (for batching)
+    """
+    return jax.tree_util.tree_map(lambda x: x.to_cells() if is_internal_var(x) else x,
+                                  internal_vars, is_leaf=is_internal_var)
+
+
+def vmap_quads(fn):
+    """Vectorize a material map over the quadrature points of one cell.
+    Plain arrays are mapped over their leading (quadrature) axis, CellConstant is broadcast,
+    and the containers are expanded before fn sees them. GrainConstant must be converted with to_cells first.
+
+    Parameters
+    ----------
+    fn : Callable
+        fn(u, *internal_vars) at a single quadrature point
+
+    Returns
+    -------
+    vmap_fn : Callable
+        vmap_fn(u, *cell_internal_vars), u with a leading num_quads axis
+    """
+    def vmap_fn(u, *cell_internal_vars):
+        assert not any([isinstance(x, GrainConstant) for x in cell_internal_vars])
+        in_axes = (0, ) + tuple([None if isinstance(x, CellConstant) else 0 for x in cell_internal_vars])
+        expanded_fn = lambda u, *args: fn(u, *[x.expand() if is_internal_var(x) else x for x in args])
+        return jax.vmap(expanded_fn, in_axes=in_axes)(u, *cell_internal_vars)
+
+    return vmap_fn
+
+
+def vmap_cells_quads(fn):
+    """Vectorize a material map over (num_cells, num_quads), e.g., to update history variables
+    """
+    def vmap_fn(u, *internal_vars):
+        return jax.vmap(vmap_quads(fn))(u, *to_cells(list(internal_vars)))
+
+    return vmap_fn
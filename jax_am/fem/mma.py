@@ -16,9 +16,6 @@ from functools import partial
 import time
 import scipy
 
-from jax.config import config
-config.update("jax_enable_x64", True)
-
 
 def compute_filter_kd_tree(problem):
     """This function is created by Tianju. Not from the original code.
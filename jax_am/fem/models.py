@@ -2,13 +2,31 @@ import numpy as onp
 import jax
 import jax.numpy as np
 
-from jax_am.fem.core import FEM
+from jax_am.fem.core import FEM, material_map_names
+from jax_am.fem.internal_vars import SymmetricTensor, vmap_cells_quads
+
+
+def has_linear_maps(problem, model):
+    """Whether the Jacobian of problem is that of the linear model: the material maps are those of the model class
+    (neither replaced by a child class nor by the instance), no internal variables enter them and there is
+    no Cauchy B.C.
+    """
+    maps_key = tuple([getattr(model, name, None) for name in material_map_names])
+    internal_vars = problem.internal_vars
+    return problem.get_material_maps_key() == maps_key and problem.cauchy_bc_info is None and \
+        len(internal_vars.get('laplace', ())) == 0 and len(internal_vars.get('mass', ())) == 0
 
 
 class LinearPoisson(FEM):
     def get_tensor_map(self):
         return lambda x: x
 
+    def detect_linear_operator(self):
+        return has_linear_maps(self, LinearPoisson)
+
+    def get_energy_density(self):
+        return lambda x: 0.5*np.sum(x*x)
+
     def compute_l2_norm_error(self, sol, true_u_fn):
         cells_sol = sol[self.cells] # (num_cells, num_nodes, vec)
         # (num_cells, 1, num_nodes, vec) * (1, num_quads, num_nodes, 1) -> (num_cells, num_quads, vec)
@@ -102,20 +120,52 @@ class Mechanics(FEM):
 
 
 class LinearElasticity(Mechanics):
+    """Isotropic linear elasticity with Young's modulus E and Poisson's ratio nu, read by all material maps.
+    Both are kernel parameters, so they can be set on an instance between solves.
+    """
+    E = 70e3
+    nu = 0.3
+
+    def detect_linear_operator(self):
+        return has_linear_maps(self, LinearElasticity)
+
+    def get_kernel_params(self):
+        return tuple(sorted(set(super().get_kernel_params()).union(['E', 'nu'])))
+
+    def get_lame_parameters(self):
+        """Lame parameters (mu, lmbda) from E and nu
+        """
+        mu = self.E/(2.*(1. + self.nu))
+        lmbda = self.E*self.nu/((1+self.nu)*(1-2*self.nu))
+        return mu, lmbda
+
     def get_tensor_map(self):
         def stress(u_grad):
-            E = 70e3
-            nu = 0.3
-            mu = E/(2.*(1. + nu))
-            lmbda = E*nu/((1+nu)*(1-2*nu))
+            mu, lmbda = self.get_lame_parameters()
             epsilon = 0.5*(u_grad + u_grad.T)
             sigma = lmbda*np.trace(epsilon)*np.eye(self.dim) + 2*mu*epsilon
             return sigma
         return stress
 
+    def get_energy_density(self):
+        stress = self.get_tensor_map()
+        def psi(u_grad):
+            epsilon = 0.5*(u_grad + u_grad.T)
+            energy = 0.5*np.sum(stress(u_grad)*epsilon)
+            return energy
+        return psi
+
+    def get_volumetric_tensor_map(self):
+        """Volumetric part of the stress, integrated with the reduced rule when quadrature='selective'
+        """
+        def volumetric_stress(u_grad):
+            _, lmbda = self.get_lame_parameters()
+            return lmbda*np.trace(u_grad)*np.eye(self.dim)
+        return volumetric_stress
+
 
 class HyperElasticity(Mechanics):
-    def get_tensor_map(self):
+    def get_psi(self):
         def psi(F):
             E = 1e3
             nu = 0.3
@@ -126,7 +176,17 @@ class HyperElasticity(Mechanics):
             I1 = np.trace(F.T @ F)
             energy = (mu/2.)*(Jinv*I1 - 3.) + (kappa/2.) * (J - 1.)**2.
             return energy
-        P_fn = jax.grad(psi)
+        return psi
+
+    def get_energy_density(self):
+        psi = self.get_psi()
+        def energy_density(u_grad):
+            F = u_grad + np.eye(self.dim)
+            return psi(F)
+        return energy_density
+
+    def get_tensor_map(self):
+        P_fn = jax.grad(self.get_psi())
 
         def first_PK_stress(u_grad):
             I = np.eye(self.dim)
@@ -138,8 +198,9 @@ class HyperElasticity(Mechanics):
 
 class Plasticity(Mechanics):
     def custom_init(self):
-        self.epsilons_old = onp.zeros((len(self.cells), self.num_quads, self.vec, self.dim))
-        self.sigmas_old = onp.zeros_like(self.epsilons_old)
+        # Stress and strain history in Voigt form, (num_cells, num_quads, dim*(dim + 1)//2)
+        self.epsilons_old = SymmetricTensor(onp.zeros((len(self.cells), self.num_quads, self.dim*(self.dim + 1)//2)))
+        self.sigmas_old = SymmetricTensor(onp.zeros_like(self.epsilons_old.values))
         self.internal_vars = {'laplace': [self.sigmas_old, self.epsilons_old]}
 
     def get_tensor_map(self):
@@ -182,8 +243,8 @@ class Plasticity(Mechanics):
 
     def stress_strain_fns(self):
         strain, stress_return_map = self.get_maps()
-        vmap_strain = jax.vmap(jax.vmap(strain))
-        vmap_stress_return_map = jax.vmap(jax.vmap(stress_return_map))
+        vmap_strain = vmap_cells_quads(strain)
+        vmap_stress_return_map = vmap_cells_quads(stress_return_map)
         return vmap_strain, vmap_stress_return_map
 
     def update_stress_strain(self, sol):
@@ -191,15 +252,15 @@ class Plasticity(Mechanics):
         u_grads = np.take(sol, self.cells, axis=0)[:, None, :, :, None] * self.shape_grads[:, :, :, None, :]
         u_grads = np.sum(u_grads, axis=2) # (num_cells, num_quads, vec, dim)
         vmap_strain, vmap_stress_rm = self.stress_strain_fns()
-        self.sigmas_old = vmap_stress_rm(u_grads, self.sigmas_old, self.epsilons_old)
-        self.epsilons_old = vmap_strain(u_grads)
+        self.sigmas_old = SymmetricTensor.from_tensor(vmap_stress_rm(u_grads, self.sigmas_old, self.epsilons_old))
+        self.epsilons_old = SymmetricTensor.from_tensor(vmap_strain(u_grads))
         self.internal_vars = {'laplace': [self.sigmas_old, self.epsilons_old]}
 
     def compute_avg_stress(self):
         """For post-processing only
         """
         # num_cells*num_quads, vec, dim) * (num_cells*num_quads, 1, 1)
-        sigma = np.sum(self.sigmas_old.reshape(-1, self.vec, self.dim) * self.JxW.reshape(-1)[:, None, None], 0)
+        sigma = np.sum(self.sigmas_old.to_tensor().reshape(-1, self.vec, self.dim) * self.JxW.reshape(-1)[:, None, None], 0)
         vol = np.sum(self.JxW)
         avg_sigma = sigma/vol
         return avg_sigma
@@ -0,0 +1,110 @@
+"""Precision policies for FEM problems and solvers.
+
+A policy is set per problem (FEM(..., precision=...)) instead of enabling float64 globally at import:
+    - 'float64' : everything in double precision (default)
+    - 'mixed' : float32 cell Jacobians (the bulk of the assembly work and memory),
+      float64 residuals, global assembly, linear solves and convergence checks
+    - 'mixed_solve' : as 'mixed', and float32 Krylov iterations for the assembled JAX solver,
+      corrected by iterative refinement with float64 residuals
+
+JAX computes in float64 only if jax_enable_x64 is set, which is a process-wide flag.
+A policy that uses float64 sets it when the problem is created, not when jax_am.fem is imported.
+"""
+import numpy as onp
+import jax
+import jax.numpy as np
+
+
+class PrecisionPolicy:
+    """
+    Attributes
+    ----------
+    kernel_dtype : str
+        Cell and face Jacobian kernels, including the batched geometric factors and internal variables they read.
+        Residual kernels run in accumulate_dtype.
+    accumulate_dtype : str
+        Global residual, global matrix values, Newton updates and convergence checks
+    solve_dtype : str
+        Krylov iterations of the assembled JAX linear solver. If lower than accumulate_dtype,
+        the solution is improved by iterative refinement. PETSc always solves in its own scalar type.
+    refinement_tol : float
+        Relative residual (in accumulate_dtype) at which iterative refinement stops
+    max_refinements : int
+    """
+    def __init__(self, kernel_dtype='float64', accumulate_dtype='float64', solve_dtype='float64',
+                 refinement_tol=1e-10, max_refinements=20):
+        self.kernel_dtype = onp.dtype(kernel_dtype)
+        self.accumulate_dtype = onp.dtype(accumulate_dtype)
+        self.solve_dtype = onp.dtype(solve_dtype)
+        self.refinement_tol = refinement_tol
+        self.max_refinements = max_refinements
+
+    def __repr__(self):
+        return f"PrecisionPolicy(kernel_dtype={self.kernel_dtype}, accumulate_dtype={self.accumulate_dtype}, " \
+               f"solve_dtype={self.solve_dtype})"
+
+    @property
+    def uses_x64(self):
+        return onp.dtype('float64') in [self.kernel_dtype, self.accumulate_dtype, self.solve_dtype]
+
+    @property
+    def refine(self):
+        return self.solve_dtype.itemsize < self.accumulate_dtype.itemsize
+
+    @property
+    def krylov_tol(self):
+        """Relative and absolute tolerance of the Krylov iterations, limited by the round-off of solve_dtype
+        """
+        return 1e-10 if self.solve_dtype.itemsize >= 8 else 1e-5
+
+    def enable(self):
+        if self.uses_x64 and not jax.config.jax_enable_x64:
+            jax.config.update("jax_enable_x64", True)
+
+    def to_kernel(self, tree):
+        return cast(tree, self.kernel_dtype)
+
+    def to_accumulate(self, tree):
+        return cast(tree, self.accumulate_dtype)
+
+    def to_solve(self, tree):
+        return cast(tree, self.solve_dtype)
+
+
+def cast(tree, dtype):
+    """Cast the floating point leaves of a pytree, other leaves (e.g., indices) are kept
+    """
+    if dtype is None:
+        return tree
+
+    def cast_leaf(x):
+        if hasattr(x, 'dtype') and np.issubdtype(x.dtype, np.floating) and x.dtype != dtype:
+            return x.astype(dtype)
+        return x
+    return jax.tree_util.tree_map(cast_leaf, tree)
+
+
+precision_policies = {'float64': PrecisionPolicy(),
+                      'mixed': PrecisionPolicy(kernel_dtype='float32'),
+                      'mixed_solve': PrecisionPolicy(kernel_dtype='float32', solve_dtype='float32')}
+
+
+def get_precision_policy(precision=None):
+    """
+    Parameters
+    ----------
+    precision : None, str or PrecisionPolicy
+        None is 'float64', see precision_policies for the names
+
+    Returns
+    -------
+    policy : PrecisionPolicy
+    """
+    if precision is None:
+        return precision_policies['float64']
+    if isinstance(precision, PrecisionPolicy):
+        return precision
+    if precision in precision_policies:
+        return precision_policies[precision]
+    raise ValueError(f"Unknown precision {precision}, choose from {list(precision_policies.keys())} "
+                     f"or pass a PrecisionPolicy")
@@ -0,0 +1,604 @@
+"""Preconditioners for the linear solves with the assembled tangent.
+
+A preconditioner is set up once per tangent from the global matrix with Dirichlet B.C. eliminated
+(rows and columns of Dirichlet dofs replaced by those of the identity, see get_eliminated_matrix),
+and both linear solver backends consume it:
+    - the JAX Krylov solvers call apply, a jittable function of the (num_total_dofs,) residual
+    - PETSc calls setup_petsc, which selects the equivalent native PETSc preconditioner,
+      or wraps apply in a shell preconditioner for preconditioners without one
+The adjoint solves of solver.implicit_vjp reuse the preconditioner of the forward solves, transposed
+(see transpose_apply).
+
+Available preconditioners (see preconditioners for the registry):
+    - 'jacobi' : inverse of the diagonal
+    - 'block_jacobi' : inverse of the (vec, vec) diagonal block of each node
+    - 'ilu0' : incomplete LU without fill-in on the cached sparsity pattern. Factorized by fixed-point sweeps
+      (Chow and Patel, 2015) and applied with Jacobi sweeps for the triangular solves, so that both are jittable.
+    - 'amg' : smoothed aggregation algebraic multigrid (Vanek, Mandel and Brezina, 1996). The hierarchy is set up
+      on the host with scipy, the V-cycle is a jitted JAX function. The near-nullspace defaults to the rigid body
+      modes of the mesh for elasticity (vec == dim) and to constants otherwise.
+
+Custom preconditioners subclass Preconditioner and are added to the registry, e.g.,
+    preconditioners['my_pc'] = MyPreconditioner
+    sol = solver(problem, precond='my_pc')
+"""
+import numpy as onp
+import jax
+import jax.numpy as np
+from jax.experimental.sparse import BCOO
+import scipy
+from petsc4py import PETSc
+
+from jax_am import logger
+
+
+def get_bc_dofs(problem):
+    """(num_bc_dofs,) global indices of the Dirichlet dofs
+    """
+    return onp.hstack([onp.zeros(0, dtype=onp.int64)] +
+                      [onp.asarray(node_inds * problem.vec + vec_inds, dtype=onp.int64) for node_inds, vec_inds
+                       in zip(problem.node_inds_list, problem.vec_inds_list)])
+
+
+def get_eliminated_matrix(problem, A=None):
+    """The global matrix problem.A_sp_scipy (or A) with rows and columns of Dirichlet dofs replaced by those
+    of the identity. The sparsity pattern is kept, eliminated entries are explicit zeros.
+
+    Parameters
+    ----------
+    A : scipy.sparse.csr_array
+        Defaults to problem.A_sp_scipy, e.g., the matrix condensed by periodic B.C. instead
+
+    Returns
+    -------
+    A : scipy.sparse.csr_array
+    """
+    A = scipy.sparse.csr_array(problem.A_sp_scipy if A is None else A, dtype=onp.float64, copy=True)
+    keep = onp.ones(A.shape[0])
+    keep[get_bc_dofs(problem)] = 0.
+    rows = onp.repeat(onp.arange(A.shape[0]), onp.diff(A.indptr))
+    A.data = A.data * keep[rows] * keep[A.indices]
+    diag_pos = onp.flatnonzero(rows == A.indices)
+    A.data[diag_pos[keep[rows[diag_pos]] == 0.]] = 1.
+    return A
+
+
+def get_rigid_body_modes(points, vec):
+    """Near-nullspace of the global matrix from the mesh coordinates: translations of each component and,
+    for elasticity (vec == dim, 2D or 3D), the rotations about the centroid.
+
+    Parameters
+    ----------
+    points : onp.ndarray
+        (num_total_nodes, dim)
+
+    Returns
+    -------
+    modes : onp.ndarray
+        (num_total_nodes*vec, num_modes)
+    """
+    points = onp.asarray(points, dtype=onp.float64)
+    points = points - onp.mean(points, axis=0)
+    num_nodes, dim = points.shape
+    zeros = onp.zeros(num_nodes)
+    # (num_modes, num_nodes, vec)
+    modes = [onp.stack([onp.ones(num_nodes) if i == j else zeros for j in range(vec)], axis=1) for i in range(vec)]
+    if vec == dim == 2:
+        x, y = points.T
+        modes.append(onp.stack((-y, x), axis=1))
+    elif vec == dim == 3:
+        x, y, z = points.T
+        modes += [onp.stack((zeros, -z, y), axis=1), onp.stack((z, zeros, -x), axis=1),
+                  onp.stack((-y, x, zeros), axis=1)]
+    return onp.stack(modes, axis=-1).reshape(num_nodes * vec, len(modes))
+
+
+def get_block_data(A, vec):
+    """Node blocks of a matrix with dofs numbered node by node
+
+    Returns
+    -------
+    rows, cols : onp.ndarray
+        (num_blocks,) node indices of each block, sorted by rows then cols
+    data : onp.ndarray
+        (num_blocks, vec, vec)
+    """
+    A_bsr = scipy.sparse.bsr_array(A, blocksize=(vec, vec))
+    A_bsr.sort_indices()
+    rows = onp.repeat(onp.arange(A_bsr.shape[0] // vec), onp.diff(A_bsr.indptr))
+    return rows, A_bsr.indices.astype(onp.int64), onp.asarray(A_bsr.data)
+
+
+def block_matvec(rows, cols, blocks, x, num_nodes):
+    """y_I = sum_J A_IJ x_J for node blocks A_IJ, x of shape (num_nodes, vec)
+    """
+    return jax.ops.segment_sum(np.einsum('tab,tb->ta', blocks, x[cols]), rows, num_segments=num_nodes)
+
+
+def transpose_apply(apply_fn):
+    """x -> M^{-T} x from apply_fn, x -> M^{-1} x, which is linear in x for all preconditioners,
+    e.g., to precondition the transposed tangent of the adjoint problem
+    """
+    def apply_transpose(x):
+        return jax.linear_transpose(apply_fn, x)(x)[0]
+
+    return apply_transpose
+
+
+class Preconditioner:
+    """Interface of the preconditioners. setup runs on the host once per tangent matrix, apply is jittable.
+    """
+    def setup(self, problem, dtype=None, A=None):
+        """
+        Parameters
+        ----------
+        problem : FEM
+            problem.A_sp_scipy holds the current global matrix, see get_eliminated_matrix
+        dtype : str
+            dtype of the vectors apply is called with, e.g., the solve precision of the problem
+        A : scipy.sparse.csr_array
+            Used instead of problem.A_sp_scipy if given, see get_eliminated_matrix
+
+        Returns
+        -------
+        self
+        """
+        raise NotImplementedError("Child class must implement this function!")
+
+    def apply(self, x):
+        """(num_total_dofs,) -> (num_total_dofs,), approximates the inverse of the matrix
+        """
+        raise NotImplementedError("Child class must implement this function!")
+
+    def setup_petsc(self, pc, problem):
+        """Configure a PETSc preconditioner, whose operator is the PETSc tangent matrix.
+        Defaults to a shell preconditioner calling apply.
+        """
+        self.setup(problem, onp.float64)
+        pc.setType(PETSc.PC.Type.PYTHON)
+        pc.setPythonContext(PetscShell(jax.jit(self.apply)))
+
+
+class PetscShell:
+    """Python context of a PETSc shell preconditioner
+    """
+    def __init__(self, apply_fn):
+        self.apply_fn = apply_fn
+
+    def apply(self, pc, x, y):
+        y.setArray(onp.asarray(self.apply_fn(np.array(x.getArray(readonly=True)))))
+
+    def applyTranspose(self, pc, x, y):
+        # Adjoint solves with KSP.solveTranspose
+        if not hasattr(self, 'apply_transpose_fn'):
+            self.apply_transpose_fn = jax.jit(transpose_apply(self.apply_fn))
+        y.setArray(onp.asarray(self.apply_transpose_fn(np.array(x.getArray(readonly=True)))))
+
+
+class JacobiPreconditioner(Preconditioner):
+    def setup(self, problem, dtype=None, A=None):
+        self.jacobi = np.array(get_eliminated_matrix(problem, A).diagonal(), dtype=dtype)
+        return self
+
+    def apply(self, x):
+        return x * (1. / self.jacobi)
+
+    def setup_petsc(self, pc, problem):
+        pc.setType(PETSc.PC.Type.JACOBI)
+
+
+class BlockJacobiPreconditioner(Preconditioner):
+    """Inverse of the (vec, vec) diagonal blocks, couples the components of each node, e.g., in elasticity
+    """
+    def setup(self, problem, dtype=None, A=None):
+        self.vec = problem.vec
+        rows, cols, data = get_block_data(get_eliminated_matrix(problem, A), self.vec)
+        # (num_total_nodes, vec, vec)
+        self.inv_blocks = np.array(onp.linalg.inv(data[rows == cols]), dtype=dtype)
+        return self
+
+    def apply(self, x):
+        return np.einsum('nab,nb->na', self.inv_blocks, x.reshape(-1, self.vec)).reshape(-1)
+
+    def setup_petsc(self, pc, problem):
+        if problem.symmetric:
+            # PETSc has no point block Jacobi for the symmetric (SBAIJ) tangent
+            return super().setup_petsc(pc, problem)
+        # The block size of the PETSc tangent matrix is vec, see get_A_fn
+        pc.setType(PETSc.PC.Type.PBJACOBI)
+
+
+class ILU0Preconditioner(Preconditioner):
+    """ILU(0): L and U have the sparsity pattern of the global matrix.
+
+    The exact ILU(0) factors are the fixed point of
+        l_ij = (a_ij - sum_{k < j} l_ik u_kj) / u_jj for i > j,  u_ij = a_ij - sum_{k < i} l_ik u_kj for i <= j,
+    with the sums over the pattern. Each sweep updates all entries at once, and a few sweeps are sufficient
+    for preconditioning (Chow and Patel, 2015). The products are computed between (vec, vec) node blocks,
+    with masks for the scalar ordering k < min(i, j) inside blocks of the same node.
+    The triangular solves are approximated by Jacobi sweeps.
+
+    Parameters
+    ----------
+    factor_sweeps : int
+    solve_sweeps : int
+        Jacobi sweeps of each triangular solve
+    """
+    def __init__(self, factor_sweeps=5, solve_sweeps=3):
+        self.factor_sweeps = factor_sweeps
+        self.solve_sweeps = solve_sweeps
+
+    def setup(self, problem, dtype=None, A=None):
+        vec = problem.vec
+        rows, cols, data = get_block_data(get_eliminated_matrix(problem, A), vec)
+        num_nodes, num_blocks = problem.num_total_nodes, len(rows)
+        logger.debug(f"ILU(0) setup with {num_blocks} node blocks...")
+
+        # Products L_IK U_KJ contributing to block (I, J), K <= min(I, J): loop over blocks (I, K) with K <= I,
+        # then over the blocks (K, J) of row K with J >= K, and keep the (I, J) in the pattern
+        indptr = onp.hstack((0, onp.cumsum(onp.bincount(rows, minlength=num_nodes))))
+        ik = onp.flatnonzero(cols <= rows)
+        starts, counts = indptr[cols[ik]], indptr[cols[ik] + 1] - indptr[cols[ik]]
+        kj = onp.repeat(starts, counts) + onp.arange(onp.sum(counts)) - onp.repeat(onp.cumsum(counts) - counts, counts)
+        ik = onp.repeat(ik, counts)
+        I, K, J = rows[ik], cols[ik], cols[kj]
+        keep = J >= K
+        ik, kj, I, K, J = ik[keep], kj[keep], I[keep], K[keep], J[keep]
+        keys = rows * num_nodes + cols
+        ij = onp.minimum(onp.searchsorted(keys, I * num_nodes + J), num_blocks - 1)
+        found = keys[ij] == I * num_nodes + J
+        # Scalar ordering inside blocks, (4, vec, vec, vec) masks [case, a, b, c] for rows a, cols b, inner c
+        # 0: K < min(I, J), 1: K == I < J, 2: K == J < I, 3: K == I == J
+        case = ((K == I).astype(int) + 2 * (K == J).astype(int))[found]
+        a, b, c = onp.meshgrid(onp.arange(vec), onp.arange(vec), onp.arange(vec), indexing='ij')
+        masks = onp.stack((onp.ones_like(a), c < a, c < b, c < onp.minimum(a, b))).astype(onp.float64)
+        # Masked products are only needed for the few products involving diagonal blocks
+        self.products = [(ik[found][case == i], kj[found][case == i], ij[found][case == i], masks[i])
+                         for i in range(4)]
+
+        diag_lower = onp.tril(onp.ones((vec, vec), dtype=bool), k=-1)
+        # (num_blocks, vec, vec) True for the entries of L
+        self.lower = (rows > cols)[:, None, None] | ((rows == cols)[:, None, None] & diag_lower[None, :, :])
+        self.diag_pos = onp.flatnonzero(rows == cols)
+        self.rows, self.cols, self.num_nodes, self.vec = rows, cols, num_nodes, vec
+        self.factors = self.factorize(np.array(data, dtype=dtype))
+        return self
+
+    def factorize(self, data):
+        lower, cols, diag_pos = self.lower, self.cols, self.diag_pos
+
+        def get_u_diag(F):
+            # (num_nodes, vec) diagonal of U, broadcast to the columns of each block
+            return np.diagonal(F[diag_pos], axis1=1, axis2=2)[cols][:, None, :]
+
+        def sweep(F, _):
+            S = np.zeros_like(F)
+            for ik, kj, ij, mask in self.products:
+                if len(ij) > 0:
+                    S = S.at[ij].add(np.einsum('tac,tcb,abc->tab', F[ik], F[kj], mask.astype(F.dtype)))
+            return np.where(lower, (data - S) / get_u_diag(F), data - S), None
+
+        F = np.where(lower, data / get_u_diag(data), data)
+        F, _ = jax.lax.scan(sweep, F, None, length=self.factor_sweeps)
+        return F
+
+    def apply(self, x):
+        F, rows, cols, num_nodes = self.factors, self.rows, self.cols, self.num_nodes
+        # Unit lower triangular L: y = x - L_strict y
+        L_strict = np.where(self.lower, F, 0.)
+        x = x.reshape(num_nodes, self.vec)
+        y = x
+        for i in range(self.solve_sweeps):
+            y = x - block_matvec(rows, cols, L_strict, y, num_nodes)
+        # Upper triangular U: z = (y - U_strict z)/u_diag
+        u_diag = np.diagonal(F[self.diag_pos], axis1=1, axis2=2)
+        U_strict = np.where(self.lower, 0., F).at[self.diag_pos].multiply(
+            1. - np.eye(self.vec, dtype=F.dtype)[None, :, :])
+        z = y / u_diag
+        for i in range(self.solve_sweeps):
+            z = (y - block_matvec(rows, cols, U_strict, z, num_nodes)) / u_diag
+        return z.reshape(-1)
+
+    def setup_petsc(self, pc, problem):
+        # Incomplete Cholesky for the symmetric (SBAIJ) tangent
+        pc.setType(PETSc.PC.Type.ICC if problem.symmetric else PETSc.PC.Type.ILU)
+        pc.setFactorLevels(0)
+
+
+class AMGPreconditioner(Preconditioner):
+    """Smoothed aggregation algebraic multigrid, one V-cycle per application.
+
+    Setup of each level (host):
+        - strength of connection between nodes from the Frobenius norms of the node blocks
+        - greedy aggregation of strongly connected nodes
+        - tentative prolongator T from the QR factorization of the near-nullspace restricted to each aggregate
+        - prolongator P = (I - 4/(3 rho) D^{-1} A) T, rho the spectral radius of D^{-1} A, and A_coarse = P^T A P
+    Nodes of the coarse levels are the aggregates, with one dof per near-nullspace vector.
+    The coarsest level is solved with a dense inverse if it has at most max_coarse dofs, otherwise
+    (coarsening stalled or max_levels reached) it is only smoothed with coarse_sweeps sweeps.
+    The smoother is damped Jacobi.
+
+    Parameters
+    ----------
+    near_nullspace : onp.ndarray
+        (num_total_dofs, num_modes), None for the rigid body modes of the mesh, see get_rigid_body_modes
+    strength : float
+        Nodes I and J are strongly connected if ||A_IJ|| >= strength*sqrt(||A_II|| ||A_JJ||)
+    max_coarse : int
+        Maximum number of dofs of the coarsest level
+    max_levels : int
+    smoothing_sweeps : int
+        Pre- and post-smoothing sweeps
+    coarse_sweeps : int
+        Smoothing sweeps on a coarsest level with more than max_coarse dofs
+    """
+    def __init__(self, near_nullspace=None, strength=0., max_coarse=500, max_levels=10, smoothing_sweeps=1,
+                 coarse_sweeps=10):
+        self.near_nullspace = near_nullspace
+        self.strength = strength
+        self.max_coarse = max_coarse
+        self.max_levels = max_levels
+        self.smoothing_sweeps = smoothing_sweeps
+        self.coarse_sweeps = coarse_sweeps
+
+    def get_near_nullspace(self, problem):
+        if self.near_nullspace is not None:
+            return onp.asarray(self.near_nullspace, dtype=onp.float64)
+        return get_rigid_body_modes(problem.points, problem.vec)
+
+    def setup(self, problem, dtype=None, A=None):
+        A = get_eliminated_matrix(problem, A)
+        B = self.get_near_nullspace(problem)
+        node_inds = onp.arange(A.shape[0]) // problem.vec
+        self.levels = []
+        while A.shape[0] > self.max_coarse and len(self.levels) < self.max_levels - 1:
+            dinv = 1. / A.diagonal()
+            omega = 4. / 3. / get_spectral_radius(A, dinv)
+            aggregates = get_aggregates(get_strength_graph(A, node_inds, self.strength))
+            T, B, node_inds = get_tentative_prolongator(aggregates[node_inds], B)
+            if T.shape[1] == 0 or T.shape[1] >= A.shape[0]:
+                break
+            P = scipy.sparse.csr_array(T - omega * (dinv[:, None] * (A @ T)))
+            logger.debug(f"AMG level {len(self.levels)}: {A.shape[0]} dofs, {A.nnz} nonzeros")
+            self.levels.append([A, P, dinv, omega])
+            A = scipy.sparse.csr_array(P.T @ A @ P)
+        logger.debug(f"AMG coarsest level: {A.shape[0]} dofs")
+        if A.shape[0] <= self.max_coarse:
+            self.coarse_inv = np.array(onp.linalg.pinv(A.toarray()), dtype=dtype)
+            self.coarse_smoother = None
+        else:
+            logger.warning(f"AMG coarsening stopped at {A.shape[0]} dofs > max_coarse = {self.max_coarse}, "
+                           f"the coarsest level is smoothed with {self.coarse_sweeps} sweeps instead of solved")
+            dinv = 1. / A.diagonal()
+            self.coarse_inv = None
+            self.coarse_smoother = (to_bcoo(A, dtype), np.array(dinv, dtype=dtype),
+                                    4. / 3. / get_spectral_radius(A, dinv))
+        self.levels = [(to_bcoo(A, dtype), to_bcoo(P, dtype), to_bcoo(P.T, dtype), np.array(dinv, dtype=dtype), omega)
+                       for A, P, dinv, omega in self.levels]
+        return self
+
+    def apply(self, x):
+        def v_cycle(level, b):
+            if level == len(self.levels):
+                if self.coarse_smoother is None:
+                    return self.coarse_inv @ b
+                A, dinv, omega = self.coarse_smoother
+                x = omega * dinv * b
+                for i in range(self.coarse_sweeps - 1):
+                    x = x + omega * dinv * (b - A @ x)
+                return x
+            A, P, R, dinv, omega = self.levels[level]
+            x = omega * dinv * b
+            for i in range(self.smoothing_sweeps - 1):
+                x = x + omega * dinv * (b - A @ x)
+            x = x + P @ v_cycle(level + 1, R @ (b - A @ x))
+            for i in range(self.smoothing_sweeps):
+                x = x + omega * dinv * (b - A @ x)
+            return x
+
+        return v_cycle(0, x)
+
+    def setup_petsc(self, pc, problem):
+        if problem.symmetric:
+            # GAMG does not support the symmetric (SBAIJ) tangent
+            return super().setup_petsc(pc, problem)
+        A, _ = pc.getOperators()
+        # PETSc expects orthonormal near-nullspace vectors
+        Q, _ = onp.linalg.qr(self.get_near_nullspace(problem))
+        vectors = [PETSc.Vec().createWithArray(onp.ascontiguousarray(Q[:, i]), comm=PETSc.COMM_SELF)
+                   for i in range(Q.shape[1])]
+        A.setNearNullSpace(PETSc.NullSpace().create(vectors=vectors, comm=PETSc.COMM_SELF))
+        pc.setType(PETSc.PC.Type.GAMG)
+
+
+def to_bcoo(A, dtype):
+    A = scipy.sparse.coo_array(A)
+    return BCOO((np.array(A.data, dtype=dtype), np.stack((A.row, A.col), axis=1).astype(onp.int32)), shape=A.shape)
+
+
+def get_spectral_radius(A, dinv, num_iters=20):
+    """Power iteration estimate of the spectral radius of D^{-1} A
+    """
+    x = onp.random.default_rng(0).random(A.shape[0])
+    rho = 1.
+    for i in range(num_iters):
+        y = dinv * (A @ x)
+        rho = onp.linalg.norm(y) / onp.linalg.norm(x)
+        x = y / onp.linalg.norm(y)
+    return rho
+
+
+def get_strength_graph(A, node_inds, strength):
+    """Symmetric graph of strongly connected nodes, without self loops
+
+    Parameters
+    ----------
+    node_inds : onp.ndarray
+        (num_dofs,) node of each dof
+
+    Returns
+    -------
+    C : scipy.sparse.csr_array
+        (num_nodes, num_nodes)
+    """
+    num_nodes = node_inds.max() + 1
+    N = scipy.sparse.csr_array((onp.ones(len(node_inds)), (onp.arange(len(node_inds)), node_inds)),
+                               shape=(len(node_inds), num_nodes))
+    A_abs = scipy.sparse.csr_array(A, copy=True)
+    A_abs.data = A_abs.data**2
+    C = scipy.sparse.coo_array(N.T @ A_abs @ N)
+    diag = onp.sqrt(C.diagonal())
+    norms = onp.sqrt(C.data)
+    strong = (C.row != C.col) & (norms > 0.) & (norms >= strength * onp.sqrt(diag[C.row] * diag[C.col]))
+    C = scipy.sparse.csr_array((onp.ones(onp.sum(strong)), (C.row[strong], C.col[strong])),
+                               shape=(num_nodes, num_nodes))
+    return scipy.sparse.csr_array(((C + C.T) > 0).astype(onp.float64))
+
+
+def get_neighbor_max(C, values):
+    """(num_nodes,) maximum of the nonnegative values of each node and its neighbors in the graph C
+    """
+    if C.nnz == 0:
+        return values.copy()
+    neighbor_max = onp.maximum.reduceat(values[C.indices], onp.minimum(C.indptr[:-1], C.nnz - 1))
+    neighbor_max[onp.diff(C.indptr) == 0] = 0.
+    return onp.maximum(values, neighbor_max)
+
+
+def get_mis2_roots(C, rng):
+    """Maximal independent set of the distance-2 graph (MIS-2) of the connected nodes of C, by Luby's algorithm:
+    each round, undecided nodes with a larger random priority than all undecided nodes within distance 2 are
+    selected, and nodes within distance 2 of them are decided. O(log num_nodes) rounds of sparse operations,
+    on the shrinking graph of the undecided nodes and their neighbors.
+
+    Returns
+    -------
+    roots : onp.ndarray
+        (num_nodes,) bool
+    """
+    roots = onp.zeros(C.shape[0], dtype=bool)
+    nodes = onp.flatnonzero(onp.diff(C.indptr) > 0)
+    # Distinct priorities for undecided nodes, 0 for decided ones
+    priorities = 1. + rng.permutation(len(nodes))
+    C = C[nodes][:, nodes]
+    while len(nodes) > 0:
+        new_roots = (priorities > 0.) & (get_neighbor_max(C, get_neighbor_max(C, priorities)) == priorities)
+        roots[nodes[new_roots]] = True
+        near_roots = new_roots + C @ new_roots.astype(onp.float64)
+        priorities[near_roots + C @ near_roots > 0.] = 0.
+        # Decided nodes are kept only as paths between undecided ones
+        undecided = (priorities > 0.).astype(onp.float64)
+        keep = undecided + C @ undecided > 0.
+        nodes, priorities, C = nodes[keep], priorities[keep], C[keep][:, keep]
+    return roots
+
+
+def get_aggregates(C, seed=0):
+    """Aggregation of the nodes of the strength graph, vectorized with sparse matrix operations
+    (Bell, Dalton and Olson, 2012):
+        - pass 1: the roots of an MIS-2 form aggregates with their neighbors. Roots are more than 2 apart,
+          so each node has at most one root neighbor.
+        - pass 2: the same on the graph of the nodes left, otherwise aggregates are much larger than those
+          of the greedy aggregation, and the V-cycle much weaker
+        - remaining nodes join an aggregate of a neighbor
+
+    Returns
+    -------
+    aggregates : onp.ndarray
+        (num_nodes,) aggregate of each node, -1 for nodes without strong connections (e.g., fully constrained)
+    """
+    rng = onp.random.default_rng(seed)
+    rows = onp.repeat(onp.arange(C.shape[0]), onp.diff(C.indptr))
+    # Aggregate + 1 of each node, 0 for nodes without one
+    aggregates = onp.zeros(C.shape[0])
+    for i in range(2):
+        free = aggregates == 0.
+        C_free = C.copy()
+        C_free.data = C.data * free[rows] * free[C.indices]
+        C_free.eliminate_zeros()
+        roots = get_mis2_roots(C_free, rng)
+        aggregates[roots] = aggregates.max() + onp.arange(1, onp.sum(roots) + 1)
+        root_aggregates = C_free @ (aggregates * roots)
+        aggregates[free & (root_aggregates > 0.)] = root_aggregates[free & (root_aggregates > 0.)]
+    aggregates = onp.where(aggregates > 0., aggregates, get_neighbor_max(C, aggregates))
+    return aggregates.astype(onp.int64) - 1
+
+
+def get_tentative_prolongator(aggregate_inds, B):
+    """Orthonormal basis of the near-nullspace B on each aggregate, by QR factorizations
+
+    Parameters
+    ----------
+    aggregate_inds : onp.ndarray
+        (num_dofs,) aggregate of each dof, -1 for dofs without an aggregate
+    B : onp.ndarray
+        (num_dofs, num_modes)
+
+    Returns
+    -------
+    T : scipy.sparse.csr_array
+        (num_dofs, num_coarse_dofs)
+    B_coarse : onp.ndarray
+        (num_coarse_dofs, num_modes)
+    coarse_node_inds : onp.ndarray
+        (num_coarse_dofs,) aggregate of each coarse dof
+    """
+    num_modes = B.shape[1]
+    dofs = onp.flatnonzero(aggregate_inds >= 0)
+    dofs = dofs[onp.argsort(aggregate_inds[dofs], kind='stable')]
+    sizes = onp.bincount(aggregate_inds[dofs])
+    offsets = onp.hstack((0, onp.cumsum(sizes)))
+    T_rows, T_cols, T_vals, B_coarse, coarse_node_inds = [], [], [], [], []
+    num_coarse = 0
+    # Batched QR over the aggregates of the same size
+    for size in onp.unique(sizes[sizes > 0]):
+        aggregates = onp.flatnonzero(sizes == size)
+        # (num_aggregates, size) dofs of each aggregate
+        agg_dofs = dofs[offsets[aggregates][:, None] + onp.arange(size)[None, :]]
+        Q, R = onp.linalg.qr(B[agg_dofs])
+        rank = Q.shape[2]
+        cols = num_coarse + onp.arange(len(aggregates) * rank).reshape(len(aggregates), rank)
+        T_rows.append(onp.repeat(agg_dofs[:, :, None], rank, axis=2).reshape(-1))
+        T_cols.append(onp.repeat(cols[:, None, :], size, axis=1).reshape(-1))
+        T_vals.append(Q.reshape(-1))
+        B_coarse.append(R.reshape(-1, num_modes))
+        coarse_node_inds.append(onp.repeat(aggregates, rank))
+        num_coarse += len(aggregates) * rank
+    if num_coarse == 0:
+        return scipy.sparse.csr_array((len(B), 0)), onp.zeros((0, num_modes)), onp.zeros(0, dtype=onp.int64)
+    T = scipy.sparse.csr_array((onp.hstack(T_vals), (onp.hstack(T_rows), onp.hstack(T_cols))),
+                               shape=(len(B), num_coarse))
+    # Coarse nodes numbered by aggregate
+    coarse_node_inds = onp.hstack(coarse_node_inds)
+    order = onp.argsort(coarse_node_inds, kind='stable')
+    T = scipy.sparse.csr_array(T[:, order])
+    return T, onp.vstack(B_coarse)[order], onp.unique(coarse_node_inds, return_inverse=True)[1][order]
+
+
+preconditioners = {'jacobi': JacobiPreconditioner,
+                   'block_jacobi': BlockJacobiPreconditioner,
+                   'ilu0': ILU0Preconditioner,
+                   'amg': AMGPreconditioner}
+
+
+def get_preconditioner(precond):
+    """
+    Parameters
+    ----------
+    precond : bool, str or Preconditioner
+        True is 'jacobi', False or None for no preconditioner, see preconditioners for the names
+
+    Returns
+    -------
+    preconditioner : Preconditioner or None
+    """
+    if precond is None or precond is False:
+        return None
+    if precond is True:
+        return JacobiPreconditioner()
+    if isinstance(precond, Preconditioner):
+        return precond
+    if precond in preconditioners:
+        return preconditioners[precond]()
+    raise ValueError(f"Unknown preconditioner {precond}, choose from {list(preconditioners.keys())} "
+                     f"or pass a Preconditioner")
@@ -8,20 +8,30 @@ import time
 # petsc4py.init()
 from petsc4py import PETSc
 
+from jax_am.fem.precision import get_precision_policy
+from jax_am.fem.preconditioners import get_preconditioner, transpose_apply
 from jax_am import logger
 
 ################################################################################
 # PETSc linear solver or JAX linear solver
 
 
-def petsc_solve(A, b, ksp_type, pc_type):
-    rhs = PETSc.Vec().createSeq(len(b))
-    rhs.setValues(range(len(b)), onp.array(b))
-    ksp = PETSc.KSP().create()
+def create_petsc_ksp(A, ksp_type, pc_type):
+    """The preconditioner is set up at the first solve and reused by later solves with the same KSP.
+    """
+    ksp = PETSc.KSP().create(comm=PETSc.COMM_SELF)
     ksp.setOperators(A)
     ksp.setFromOptions()
     ksp.setType(ksp_type)
     ksp.pc.setType(pc_type)
+    return ksp
+
+
+def petsc_solve(A, b, ksp_type, pc_type, ksp=None):
+    rhs = PETSc.Vec().createSeq(len(b))
+    rhs.setValues(range(len(b)), onp.array(b))
+    if ksp is None:
+        ksp = create_petsc_ksp(A, ksp_type, pc_type)
     logger.debug(
         f'PETSc - Solving with ksp_type = {ksp.getType()}, '
         f'pc = {ksp.pc.getType()}'
@@ -40,26 +50,175 @@ def petsc_solve(A, b, ksp_type, pc_type):
     return x.getArray()
 
 
-def jax_solve(problem, A_fn, b, x0, precond: bool, pc_matrix=None):
+class PetscLinearSolver:
+    """Long-lived PETSc objects of a problem, created at its first assembly with use_petsc=True and kept as
+    problem.petsc_linear_solver: the tangent matrix on the cached sparsity pattern, the KSP and the work vectors.
+
+    Matrix values are updated in place at each assembly, on the same nonzero pattern (also Dirichlet rows keep
+    their entries), and the KSP options are set once. The preconditioner is rebuilt once the matrix has been
+    updated pc_lag times since its last build, in between the Krylov iterations run with the current matrix
+    and the previous preconditioner.
+    """
+    def __init__(self, problem):
+        sparsity = problem.get_sparsity_pattern()
+        self.symmetric = sparsity.symmetric
+        # https://scicomp.stackexchange.com/questions/2355/32bit-64bit-issue-when-working-with-numpy-and-petsc4py/2356#2356
+        self.indptr = sparsity.indptr.astype(PETSc.IntType, copy=False)
+        self.indices = sparsity.indices.astype(PETSc.IntType, copy=False)
+        csr = (self.indptr, self.indices, onp.asarray(problem.csr_data))
+        size = (problem.num_total_dofs, problem.num_total_dofs)
+        if self.symmetric:
+            self.A = PETSc.Mat().createSBAIJ(size=size, bsize=1, csr=csr, comm=PETSc.COMM_SELF)
+        else:
+            # Node blocks, e.g., for point block Jacobi and GAMG
+            self.A = PETSc.Mat().createAIJ(size=size, bsize=problem.vec, csr=csr, comm=PETSc.COMM_SELF)
+        self.A.setOption(PETSc.Mat.Option.KEEP_NONZERO_PATTERN, True)
+        self.eliminate_bc(problem)
+        self.ksp = create_petsc_ksp(self.A, *get_petsc_solver_types(problem))
+        self.pc_type = self.ksp.pc.getType()
+        self.x, self.b = self.A.createVecs()
+        self.r = self.b.duplicate()
+        self.num_updates = 0
+        # num_updates at the last build of the preconditioner, None before the first one
+        self.pc_update = None
+        self.precond = None
+
+    def eliminate_bc(self, problem):
+        # Dirichlet dofs may change between solves, see FEM.update_Dirichlet_boundary_conditions
+        bc_rows = onp.hstack([onp.zeros(0, dtype=onp.int32)] +
+                             [onp.array(node_inds * problem.vec + vec_inds, dtype=onp.int32) for node_inds, vec_inds
+                              in zip(problem.node_inds_list, problem.vec_inds_list)])
+        if self.symmetric:
+            self.A.zeroRowsColumns(bc_rows)
+        else:
+            self.A.zeroRows(bc_rows)
+
+    def update(self, problem):
+        """Set the values of problem.csr_data in place
+        """
+        self.A.setValuesCSR(self.indptr, self.indices, onp.asarray(problem.csr_data))
+        self.A.assemble()
+        self.eliminate_bc(problem)
+        self.num_updates += 1
+
+    def set_preconditioner(self, problem, precond, pc_lag=1):
+        """Called for each tangent. The preconditioner is rebuilt if precond changed or the matrix
+        has been updated at least pc_lag times since the last build, otherwise the previous one is reused.
+
+        Parameters
+        ----------
+        precond : bool, str or Preconditioner
+            True and False keep the PETSc preconditioner of get_petsc_solver_types,
+            a name or a Preconditioner selects its PETSc counterpart, see Preconditioner.setup_petsc
+        """
+        rebuild = self.pc_update is None or precond != self.precond or \
+            self.num_updates - self.pc_update >= pc_lag
+        if rebuild:
+            self.ksp.pc.setType(self.pc_type)
+            if not isinstance(precond, bool) and precond is not None:
+                get_preconditioner(precond).setup_petsc(self.ksp.pc, problem)
+            self.pc_update = self.num_updates
+            self.precond = precond
+        else:
+            logger.debug(f"PETSc - Reusing the preconditioner built {self.num_updates - self.pc_update} "
+                         f"tangent updates ago")
+        self.ksp.pc.setReusePreconditioner(not rebuild)
+
+    def solve(self, b):
+        self.b.setArray(onp.asarray(b))
+        logger.debug(
+            f'PETSc - Solving with ksp_type = {self.ksp.getType()}, '
+            f'pc = {self.ksp.pc.getType()}'
+        )
+        self.ksp.solve(self.b, self.x)
+
+        # Verify convergence
+        self.A.mult(self.x, self.r)
+        err = np.linalg.norm(self.r.getArray() - self.b.getArray())
+        logger.debug(f"PETSc linear solve took {self.ksp.getIterationNumber()} iterations, res = {err}")
+        # The work vector is overwritten by the next solve
+        return self.x.getArray().copy()
+
+    def solve_transpose(self, bs):
+        """Solves A^T x = b for several right-hand sides in one call, e.g., the adjoint problems of several
+        cotangents, with the KSP and the preconditioner of the forward solves. A^T = A for the symmetric tangent.
+
+        Parameters
+        ----------
+        bs : NumpyArray
+            (num_rhs, num_total_dofs)
+
+        Returns
+        -------
+        xs : NumpyArray
+            (num_rhs, num_total_dofs)
+        """
+        bs = onp.asarray(bs, dtype=PETSc.ScalarType)
+        size = (bs.shape[1], bs.shape[0])
+        B = PETSc.Mat().createDense(size, array=onp.ascontiguousarray(bs.T), comm=PETSc.COMM_SELF)
+        X = PETSc.Mat().createDense(size, comm=PETSc.COMM_SELF)
+        X.setUp()
+        logger.debug(
+            f'PETSc - Solving the transposed system for {len(bs)} right-hand sides with '
+            f'ksp_type = {self.ksp.getType()}, pc = {self.ksp.pc.getType()}'
+        )
+        if self.symmetric:
+            self.ksp.matSolve(B, X)
+        else:
+            self.ksp.matSolveTranspose(B, X)
+        xs = X.getDenseArray().T.copy()
+
+        # Verify convergence
+        mult = self.A.mult if self.symmetric else self.A.multTranspose
+        err = 0.
+        for x, b in zip(xs, bs):
+            self.x.setArray(x)
+            mult(self.x, self.r)
+            err = max(err, np.linalg.norm(self.r.getArray() - b))
+        logger.debug(f"PETSc transposed linear solve res = {err}")
+        return xs
+
+
+def jax_solve(problem, A_fn, b, x0, precond, pc_matrix=None, A_fn_solve=None):
     """Solves the equilibrium equation using a JAX solver.
     Is fully traceable and runs on GPU.
 
     Parameters
     ----------
-    precond
-        Whether to calculate the preconditioner or not
-    pc_matrix
-        The matrix to use as preconditioner
-    """
-    pc = get_jacobi_precond(
-        jacobi_preconditioner(problem)) if precond else None
-    x, info = jax.scipy.sparse.linalg.bicgstab(A_fn,
-                                               b,
-                                               x0=x0,
-                                               M=pc,
-                                               tol=1e-10,
-                                               atol=1e-10,
-                                               maxiter=10000)
+    precond : bool, str or Preconditioner
+        The preconditioner to set up from problem.A_sp_scipy, see preconditioners.get_preconditioner
+    pc_matrix : Callable
+        A preconditioner that is already set up, x -> M^{-1} x. Used instead of precond.
+    A_fn_solve
+        A_fn in the solve precision of the problem's precision policy, used for the Krylov iterations
+        if that is lower than the accumulation precision. Defaults to A_fn with casts.
+    """
+    policy = get_precision_policy(getattr(problem, 'precision_policy', None))
+    pc = pc_matrix
+    if pc is None:
+        preconditioner = get_preconditioner(precond)
+        pc = None if preconditioner is None else preconditioner.setup(problem, policy.solve_dtype).apply
+    # Symmetric elimination keeps the operator symmetric, so CG applies
+    linear_solve = jax.scipy.sparse.linalg.cg if getattr(
+        problem, 'symmetric', False) else jax.scipy.sparse.linalg.bicgstab
+    if A_fn_solve is None:
+        A_fn_solve = A_fn if not policy.refine else \
+            lambda x: policy.to_solve(A_fn(policy.to_accumulate(x)))
+
+    def krylov_solve(b, x0):
+        x, info = linear_solve(A_fn_solve,
+                               policy.to_solve(b),
+                               x0=policy.to_solve(x0),
+                               M=pc,
+                               tol=policy.krylov_tol,
+                               # Refinement corrections are small, only the relative tolerance applies
+                               atol=0. if policy.refine else policy.krylov_tol,
+                               maxiter=10000)
+        return policy.to_accumulate(x)
+
+    x = krylov_solve(b, x0)
+    if policy.refine:
+        x = iterative_refinement(A_fn, b, x, lambda r: krylov_solve(r, np.zeros_like(r)), policy)
 
     # Verify convergence
     err = np.linalg.norm(A_fn(x) - b)
@@ -76,6 +235,27 @@ def jax_solve(problem, A_fn, b, x0, precond: bool, pc_matrix=None):
     return x
 
 
+def iterative_refinement(A_fn, b, x, inner_solve, policy):
+    """Correct a low precision solution with residuals in the accumulation precision:
+    x <- x + inner_solve(b - A_fn(x)), until the relative residual is below policy.refinement_tol.
+    Traceable, the loop is a lax.while_loop.
+    """
+    b_norm = np.linalg.norm(b)
+
+    def cond_fn(carry):
+        i, x, r = carry
+        return (i < policy.max_refinements) & (np.linalg.norm(r) > policy.refinement_tol * b_norm)
+
+    def body_fn(carry):
+        i, x, r = carry
+        x = x + inner_solve(r)
+        return i + 1, x, b - A_fn(x)
+
+    num_refinements, x, _ = jax.lax.while_loop(cond_fn, body_fn, (0, x, b - A_fn(x)))
+    logger.debug(f"Iterative refinement took {num_refinements} corrections")
+    return x
+
+
 ################################################################################
 # "row elimination" solver
 
@@ -119,6 +299,39 @@ def row_elimination(fn, problem):
     return fn_dofs_row
 
 
+def symmetric_elimination(fn, problem):
+    """Zero both rows and columns of Dirichlet dofs so that the operator stays symmetric:
+    A_fn = D*A*D + (I - D), see solver_row_elimination for the notation.
+    The eliminated columns must be moved to the right-hand side with symmetric_bc_rhs.
+    """
+
+    def fn_dofs_sym(dofs):
+        bc_part = copy_bc(dofs, problem)
+        res = fn(dofs - bc_part)
+        return res - copy_bc(res, problem) + bc_part
+
+    return fn_dofs_sym
+
+
+def symmetric_bc_rhs(problem, b, matvec=None):
+    """Right-hand side for symmetric elimination: b_free - A[free, bc] * b_bc, and b_bc unchanged.
+    A is applied from the stored upper triangle of problem.csr_data, or by matvec (e.g., a traced matrix).
+    """
+    bc_part = copy_bc(b, problem)
+    if matvec is None:
+        matvec = lambda x: problem.get_sparsity_pattern().matvec(problem.csr_data, x)
+    b = b - matvec(bc_part)
+    return b - copy_bc(b, problem) + bc_part
+
+
+def get_petsc_solver_types(problem):
+    """KSP and PC types for the tangent matrix. Symmetric (SBAIJ) matrices use CG with incomplete Cholesky.
+    """
+    if getattr(problem, 'symmetric', False):
+        return 'cg', 'icc'
+    return 'bcgsl', 'ilu'
+
+
 def assign_bc(dofs, problem):
     sol = dofs.reshape((problem.num_total_nodes, problem.vec))
     for i in range(len(problem.node_inds_list)):
@@ -201,7 +414,7 @@ def operator_to_matrix(operator_fn, problem):
 
 def jacobi_preconditioner(problem):
     logger.debug(f"Compute and use jacobi preconditioner")
-    jacobi = np.array(problem.A_sp_scipy.diagonal())
+    jacobi = np.array(problem.get_sparsity_pattern().diagonal(onp.asarray(problem.csr_data)))
     jacobi = assign_ones_bc(jacobi.reshape(-1), problem)
     return jacobi
 
@@ -230,106 +443,505 @@ def test_jacobi_precond(problem, jacobi, A_fn):
     logger.debug(f"finish jacobi preconditioner")
 
 
-def linear_guess_solve(problem, A_fn, precond, use_petsc):
+def linear_guess_solve(problem, A_fn, precond, use_petsc, pc_lag=1):
     logger.debug(f"Linear guess solve...")
     # b = np.zeros((problem.num_total_nodes, problem.vec))
-    b = problem.body_force + problem.neumann
+    b = problem.compute_loads(**problem.internal_vars)
     b = assign_bc(b, problem)
+    if problem.symmetric:
+        b = symmetric_bc_rhs(problem, b)
     if use_petsc:
-        dofs = petsc_solve(A_fn, b, 'bcgsl', 'ilu')
+        problem.petsc_linear_solver.set_preconditioner(problem, precond, pc_lag)
+        dofs = problem.petsc_linear_solver.solve(b)
     else:
-        dofs = jax_solve(problem, A_fn, b, b, precond)
+        dofs = jax_solve(problem, A_fn, b, b, precond, pc_matrix=get_jax_preconditioner(problem, A_fn, precond),
+                         A_fn_solve=getattr(problem, 'A_fn_solve', None))
     return dofs
 
 
 def linear_incremental_solver(problem, res_vec, A_fn, dofs, precond,
-                              use_petsc):
+                              use_petsc, pc_lag=1):
     """Lift solver
     """
     logger.debug(f"Solving linear system with lift solver...")
-    b = -res_vec
+    inc = get_tangent_solve(problem, A_fn, precond, use_petsc, pc_lag)(-res_vec)
+    dofs = dofs + inc
+    return dofs
+
 
+def get_jax_preconditioner(problem, A_fn, precond, reuse=False):
+    """Set up once per tangent (e.g., the AMG hierarchy) instead of at every solve, and kept for the next solves
+    with the same A_fn, see get_A_fn. With reuse=True, that of a previous tangent is also kept,
+    e.g., for the adjoint solve at the converged solution, see implicit_vjp.
+
+    Returns
+    -------
+    pc : Callable
+        x -> M^{-1} x, None without preconditioner
+    """
+    cached = getattr(problem, 'jax_preconditioner_cache', None)
+    if cached is not None and (cached[0] is A_fn or reuse) and cached[1] == precond:
+        return cached[2]
+    preconditioner = get_preconditioner(precond)
+    policy = get_precision_policy(getattr(problem, 'precision_policy', None))
+    pc = None if preconditioner is None else preconditioner.setup(problem, policy.solve_dtype).apply
+    problem.jax_preconditioner_cache = (A_fn, precond, pc)
+    return pc
+
+
+def get_tangent_solve(problem, A_fn, precond, use_petsc, pc_lag=1):
+    """Linear solver with a fixed tangent, applied to one or several right-hand sides
+    (e.g., by modified and quasi-Newton iterations). The preconditioner is set up once for all of them.
+    PETSc solves with problem.petsc_linear_solver, whose matrix A_fn is overwritten by the next assembly,
+    and rebuilds its preconditioner according to pc_lag, see PetscLinearSolver.
+
+    Returns
+    -------
+    tangent_solve : Callable
+        tangent_solve(b) returns x with A_fn x = b. On Dirichlet dofs, x = b (row elimination).
+    """
     if use_petsc:
-        inc = petsc_solve(A_fn, b, 'bcgsl', 'ilu')
+        petsc_linear_solver = problem.petsc_linear_solver
+        petsc_linear_solver.set_preconditioner(problem, precond, pc_lag)
     else:
-        x0_1 = assign_bc(np.zeros_like(b), problem)
-        x0_2 = copy_bc(dofs, problem)
-        x0 = x0_1 - x0_2
-        inc = jax_solve(problem, A_fn, b, x0, precond)
+        pc = get_jax_preconditioner(problem, A_fn, precond)
+    A_fn_solve = getattr(problem, 'A_fn_solve', None)
 
-    dofs = dofs + inc
+    def tangent_solve(b):
+        # The Dirichlet part of the solution is known, use it as the initial guess
+        x0 = copy_bc(b, problem)
+        if problem.symmetric:
+            b = symmetric_bc_rhs(problem, b)
+        if use_petsc:
+            return petsc_linear_solver.solve(b)
+        return jax_solve(problem, A_fn, b, x0, precond, pc_matrix=pc, A_fn_solve=A_fn_solve)
 
-    # dofs = line_search(problem, dofs, inc)
+    return tangent_solve
 
-    return dofs
 
+def get_A_fn(problem, use_petsc):
+    """The global matrix of problem.csr_data with Dirichlet B.C. eliminated, as a PETSc matrix or a linear function.
+    Kept and returned again as long as neither problem.csr_data (e.g., that of a cached linear operator,
+    see FEM.linear_operator) nor the Dirichlet nodes change.
+    """
+    cached = getattr(problem, 'A_fn_cache', None)
+    if cached is not None and cached[0] is problem.csr_data and cached[1] is problem.node_inds_list and \
+            cached[2] == use_petsc:
+        logger.debug(f"Reusing the sparse matrix, its values are unchanged")
+        return cached[3]
+    A = create_A_fn(problem, use_petsc)
+    problem.A_fn_cache = (problem.csr_data, problem.node_inds_list, use_petsc, A)
+    return A
 
-def line_search(problem, dofs, inc):
-    res_fn = problem.compute_residual
-    res_fn = get_flatten_fn(res_fn, problem)
-    res_fn = apply_bc(res_fn, problem)
 
-    def res_norm_fn(alpha):
-        res_vec = res_fn(dofs + alpha*inc)
-        return np.linalg.norm(res_vec)
-
-    # grad_res_norm_fn = jax.grad(res_norm_fn)
-    # hess_res_norm_fn = jax.hessian(res_norm_fn)
-
-    # tol = 1e-3
-    # alpha = 1.
-    # lr = 1.
-    # grad_alpha = 1.
-    # while np.abs(grad_alpha) > tol:
-    #     grad_alpha = grad_res_norm_fn(alpha)
-    #     hess_alpha = hess_res_norm_fn(alpha)
-    #     alpha = alpha - 1./hess_alpha*grad_alpha
-    #     print(f"alpha = {alpha}, grad_alpha = {grad_alpha}, hess_alpha = {hess_alpha}")
-
-    alpha = 1.
-    res_norm = res_norm_fn(alpha)
-    for i in range(3):
-        alpha *= 0.5
-        res_norm_half = res_norm_fn(alpha)
-        print(f"i = {i}, res_norm = {res_norm}, res_norm_half = {res_norm_half}")
-        if res_norm_half > res_norm:
-            alpha *= 2.
-            break
-        res_norm = res_norm_half
+def create_A_fn(problem, use_petsc):
+    """The scipy matrix problem.A_sp_scipy is not built here, but when a preconditioner setup needs it,
+    see FEM.A_sp_scipy. With PETSc, only the values of the PETSc matrix are updated.
+    """
+    if use_petsc:
+        if getattr(problem, 'petsc_linear_solver', None) is None:
+            problem.petsc_linear_solver = PetscLinearSolver(problem)
+        else:
+            problem.petsc_linear_solver.update(problem)
+        return problem.petsc_linear_solver.A
+
+    logger.debug(f"Creating sparse matrix from the cached sparsity pattern...")
+    sparsity = problem.sparsity
+    # The pattern is canonical (sorted, no duplicates), no conversion needed
+    A_sp = BCOO((np.array(problem.csr_data),
+                 np.stack((sparsity.rows, sparsity.cols), axis=1)),
+                shape=(problem.num_total_dofs, problem.num_total_dofs),
+                indices_sorted=True,
+                unique_indices=True)
+    # logger.info(f"Global sparse matrix takes about {A_sp.data.shape[0]*8*3/2**30} G memory to store.")
 
+    def get_linearized_residual_fn(A_sp):
+        if sparsity.symmetric:
+            # Only the upper triangle U is stored, A = U + U^T - diag(U)
+            A_sp_T = A_sp.T
+            diag = np.array(sparsity.diagonal(problem.csr_data), dtype=A_sp.dtype)
 
-    return dofs + alpha*inc
+            def compute_linearized_residual(dofs):
+                return A_sp @ dofs + A_sp_T @ dofs - diag * dofs
+        else:
 
+            def compute_linearized_residual(dofs):
+                return A_sp @ dofs
 
-def get_A_fn(problem, use_petsc):
-    logger.debug(f"Creating sparse matrix with scipy...")
-    A_sp_scipy = scipy.sparse.csr_array(
-        (onp.array(problem.V), (problem.I, problem.J)),
-        shape=(problem.num_total_dofs, problem.num_total_dofs))
-    # logger.debug(f"Creating sparse matrix from scipy using JAX BCOO...")
-    A_sp = BCOO.from_scipy_sparse(A_sp_scipy).sort_indices()
-    # logger.info(f"Global sparse matrix takes about {A_sp.data.shape[0]*8*3/2**30} G memory to store.")
-    problem.A_sp_scipy = A_sp_scipy
+        return compute_linearized_residual
 
-    def compute_linearized_residual(dofs):
-        return A_sp @ dofs
+    compute_linearized_residual = get_linearized_residual_fn(A_sp)
+    policy = get_precision_policy(getattr(problem, 'precision_policy', None))
+    if policy.refine:
+        # The Krylov iterations of jax_solve use a copy of the matrix in the solve precision
+        A_sp_solve = BCOO((policy.to_solve(A_sp.data), A_sp.indices), shape=A_sp.shape,
+                          indices_sorted=True, unique_indices=True)
+        eliminate = symmetric_elimination if sparsity.symmetric else row_elimination
+        problem.A_fn_solve = eliminate(get_linearized_residual_fn(A_sp_solve), problem)
 
-    if use_petsc:
-        # https://scicomp.stackexchange.com/questions/2355/32bit-64bit-issue-when-working-with-numpy-and-petsc4py/2356#2356
-        A = PETSc.Mat().createAIJ(size=A_sp_scipy.shape, csr=(A_sp_scipy.indptr.astype(PETSc.IntType, copy=False),
-                                                       A_sp_scipy.indices.astype(PETSc.IntType, copy=False), A_sp_scipy.data))
-        for i in range(len(problem.node_inds_list)):
-            row_inds = onp.array(problem.node_inds_list[i] * problem.vec +
-                                 problem.vec_inds_list[i],
-                                 dtype=onp.int32)
-            A.zeroRows(row_inds)
+    if sparsity.symmetric:
+        A = symmetric_elimination(compute_linearized_residual, problem)
     else:
         A = row_elimination(compute_linearized_residual, problem)
 
     return A
 
 
-def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
+class NewtonOptions:
+    """Convergence tolerances and tangent update strategy of the Newton loop
+
+    Attributes
+    ----------
+    tangent_update : str
+        - 'newton' : the tangent is assembled at every iteration
+        - 'modified' : the tangent is kept and only refreshed when the residual contracts slower than contraction_tol
+        - 'broyden' : "good" Broyden rank-one updates of the inverse of a frozen tangent (Kelley, 1995)
+        - 'bfgs' : limited memory BFGS with the frozen tangent as initial inverse, for symmetric tangents
+    rtol, atol : float
+        Converged if ||res|| <= max(atol, rtol*||res_0||), res_0 the residual before the first Newton step
+    contraction_tol : float
+        The tangent is refreshed when ||res_{k+1}||/||res_k|| exceeds it ('modified', 'broyden' and 'bfgs')
+    max_updates : int
+        Number of stored update pairs. Broyden refreshes the tangent when it is reached, BFGS drops the oldest pair.
+    max_iter : int
+        None for no limit
+    reuse_tangent : bool
+        Keep the last tangent on the problem and start the next solve (e.g., the next load increment) with it
+    line_search : str
+        Globalization of the Newton steps on the merit function f = ||res||^2/2, see get_line_search
+        - None : full steps
+        - 'backtracking' : Armijo backtracking with safeguarded quadratic interpolation
+        - 'cp' : critical point of f along the direction, by secant iterations on its derivative
+        - 'trust_region' : dogleg steps between the Cauchy point and the Newton step
+    max_line_search_iters : int
+        Maximum number of step reductions (or secant iterations) per Newton iteration
+    armijo_c : float
+        Sufficient decrease parameter of 'backtracking'
+    trust_radius : float
+        Initial trust region radius, None for the norm of the first Newton step
+    pc_lag : int
+        PETSc rebuilds the preconditioner every pc_lag tangent assemblies, counted across solves of the problem
+        (e.g., over time steps). Tangents in between reuse the previous preconditioner, see PetscLinearSolver.
+        The matrix-free solver recomputes its Jacobi preconditioner every pc_lag Newton steps of a solve.
+    """
+    def __init__(self, tangent_update='newton', rtol=0., atol=1e-6, contraction_tol=0.5, max_updates=10,
+                 max_iter=None, reuse_tangent=False, line_search=None, max_line_search_iters=10, armijo_c=1e-4,
+                 trust_radius=None, pc_lag=1):
+        assert tangent_update in tangent_updates, f"Unknown tangent update {tangent_update}, " \
+            f"choose from {tangent_updates}"
+        assert line_search is None or line_search in line_searches, f"Unknown line search {line_search}, " \
+            f"choose from {line_searches}"
+        self.tangent_update = tangent_update
+        self.rtol = rtol
+        self.atol = atol
+        self.contraction_tol = contraction_tol
+        self.max_updates = max_updates
+        self.max_iter = max_iter
+        self.reuse_tangent = reuse_tangent
+        self.line_search = line_search
+        self.max_line_search_iters = max_line_search_iters
+        self.armijo_c = armijo_c
+        self.trust_radius = trust_radius
+        self.pc_lag = pc_lag
+
+    def get_tol(self, res_val):
+        return max(self.atol, self.rtol * res_val)
+
+
+tangent_updates = ['newton', 'modified', 'broyden', 'bfgs']
+line_searches = ['backtracking', 'cp', 'trust_region']
+
+
+def get_newton_options(newton_options=None):
+    """
+    Parameters
+    ----------
+    newton_options : None, str or NewtonOptions
+        None is full Newton with atol = 1e-6, a str is the tangent update with default tolerances
+
+    Returns
+    -------
+    options : NewtonOptions
+    """
+    if newton_options is None:
+        return NewtonOptions()
+    if isinstance(newton_options, NewtonOptions):
+        return newton_options
+    return NewtonOptions(tangent_update=newton_options)
+
+
+def get_line_search(problem, options):
+    """Globalization of the Newton steps on the merit function f(dofs) = ||res(dofs)||^2/2.
+
+    Each strategy is a single jitted function of (dofs, direction), compiled once per solve:
+    the residual along the direction and its derivatives (JVP and VJP of the residual, no global matrix)
+    are evaluated with the cached geometry of the problem, and the step reductions are a lax.while_loop.
+
+    Returns
+    -------
+    line_search : Callable
+        line_search(dofs, direction) returns the step to take, None if options.line_search is None
+    """
+    if options.line_search is None:
+        return None
+
+    res_fn = apply_bc(get_flatten_fn(problem.compute_residual, problem), problem)
+    max_iters = options.max_line_search_iters
+
+    def merit_fn(dofs):
+        res_vec = res_fn(dofs)
+        return 0.5 * np.dot(res_vec, res_vec)
+
+    def armijo(dofs, direction, alpha, f0, slope):
+        """Reduce alpha until f(dofs + alpha*direction) <= f0 + c*alpha*slope, slope the directional derivative of f
+        """
+        def cond_fn(carry):
+            i, alpha, f = carry
+            # NaN (e.g., inverted elements) is not a sufficient decrease
+            return (i < max_iters) & (slope < 0.) & ~(f <= f0 + options.armijo_c * alpha * slope)
+
+        def body_fn(carry):
+            i, alpha, f = carry
+            # Minimizer of the quadratic interpolation of f(0), f'(0) and f(alpha), within [0.1, 0.5]*alpha
+            alpha_quad = -slope * alpha**2 / (2. * (f - f0 - slope * alpha))
+            alpha = np.where(np.isfinite(f), np.clip(alpha_quad, 0.1 * alpha, 0.5 * alpha), 0.1 * alpha)
+            return i + 1, alpha, merit_fn(dofs + alpha * direction)
+
+        i, alpha, f = jax.lax.while_loop(cond_fn, body_fn, (0, alpha, merit_fn(dofs + alpha * direction)))
+        return alpha
+
+    @jax.jit
+    def backtracking(dofs, direction):
+        res_vec, res_jvp = jax.jvp(res_fn, (dofs, ), (direction, ))
+        # Directional derivative of f, -2*f for an exact Newton direction
+        alpha = armijo(dofs, direction, 1., 0.5 * np.dot(res_vec, res_vec), np.dot(res_vec, res_jvp))
+        return alpha * direction, alpha
+
+    @jax.jit
+    def critical_point(dofs, direction):
+        def d_merit_fn(alpha):
+            res_vec, res_jvp = jax.jvp(res_fn, (dofs + alpha * direction, ), (direction, ))
+            return np.dot(res_vec, res_jvp)
+
+        res_vec, res_jvp = jax.jvp(res_fn, (dofs, ), (direction, ))
+        f0, df0 = 0.5 * np.dot(res_vec, res_vec), np.dot(res_vec, res_jvp)
+        df1 = d_merit_fn(1.)
+        # f'(1) < 0: the critical point is beyond the full step, extrapolate once (within [1, 2])
+        alpha_ext = np.clip(-df0 / (df1 - df0), 1., 2.)
+
+        def cond_fn(carry):
+            i, lo, df_lo, hi, df_hi = carry
+            return (i < max_iters) & (np.minimum(np.abs(df_lo), np.abs(df_hi)) > 1e-2 * np.abs(df0))
+
+        def body_fn(carry):
+            """Safeguarded false position on f'(alpha) = 0 in the bracket [lo, hi], f'(lo) < 0 < f'(hi).
+            NaN is treated as positive (e.g., inverted elements beyond the critical point).
+            """
+            i, lo, df_lo, hi, df_hi = carry
+            alpha = np.where(np.isfinite(df_hi), lo - df_lo * (hi - lo) / (df_hi - df_lo), 0.5 * (lo + hi))
+            alpha = np.clip(alpha, lo + 0.1 * (hi - lo), hi - 0.1 * (hi - lo))
+            df = d_merit_fn(alpha)
+            lower = np.isfinite(df) & (df < 0.)
+            return (i + 1, np.where(lower, alpha, lo), np.where(lower, df, df_lo),
+                    np.where(lower, hi, alpha), np.where(lower, df_hi, df))
+
+        i, lo, df_lo, hi, df_hi = jax.lax.while_loop(cond_fn, body_fn, (0, 0., df0, 1., df1))
+        alpha = np.where((lo == 0.) | (np.isfinite(df_hi) & (np.abs(df_hi) < np.abs(df_lo))), hi, lo)
+        alpha = np.where(np.isfinite(df1) & (df1 < 0.), alpha_ext, alpha)
+        # The critical point of a nonconvex f may be a maximum, keep a sufficient decrease
+        alpha = armijo(dofs, direction, alpha, f0, df0)
+        return alpha * direction, alpha
+
+    @jax.jit
+    def dogleg(dofs, direction, radius):
+        res_vec, res_vjp = jax.vjp(res_fn, dofs)
+        f0 = 0.5 * np.dot(res_vec, res_vec)
+        grad, = res_vjp(res_vec)
+        jvp_fn = lambda v: jax.jvp(res_fn, (dofs, ), (v, ))[1]
+        J_grad, J_direction = jvp_fn(grad), jvp_fn(direction)
+        # Cauchy point, minimizer of the linear model along -grad
+        tau = np.dot(grad, grad) / np.dot(J_grad, J_grad)
+        direction_norm, cauchy_norm = np.linalg.norm(direction), tau * np.linalg.norm(grad)
+
+        def get_step(radius):
+            """Dogleg step p = a*direction + b*grad, J*p follows by linearity
+            """
+            # Intersection of the segment from the Cauchy point to the Newton step with the radius
+            p_c, d = -tau * grad, direction + tau * grad
+            qa, qb, qc = np.dot(d, d), 2. * np.dot(p_c, d), np.dot(p_c, p_c) - radius**2
+            t = (-qb + np.sqrt(np.maximum(qb**2 - 4. * qa * qc, 0.))) / (2. * qa)
+            a = np.where(direction_norm <= radius, 1., np.where(cauchy_norm >= radius, 0., t))
+            b = np.where(direction_norm <= radius, 0.,
+                         np.where(cauchy_norm >= radius, -radius / np.linalg.norm(grad), -tau * (1. - t)))
+            step = a * direction + b * grad
+            predicted = f0 - 0.5 * np.sum((res_vec + a * J_direction + b * J_grad)**2)
+            actual = f0 - merit_fn(dofs + step)
+            return step, actual / predicted
+
+        def cond_fn(carry):
+            i, radius, step, rho = carry
+            return (i < max_iters) & ~(rho > 1e-4)
+
+        def body_fn(carry):
+            i, radius, step, rho = carry
+            radius = 0.25 * np.minimum(radius, np.linalg.norm(step))
+            return i + 1, radius, *get_step(radius)
+
+        i, radius, step, rho = jax.lax.while_loop(cond_fn, body_fn, (0, radius, *get_step(radius)))
+        step_norm = np.linalg.norm(step)
+        radius = np.where(rho < 0.25, 0.25 * step_norm,
+                          np.where((rho > 0.75) & (step_norm > 0.99 * radius), 2. * radius, radius))
+        return step, radius, rho
+
+    if options.line_search == 'trust_region':
+        # The radius is kept between Newton iterations
+        radius = [options.trust_radius]
+
+        def line_search(dofs, direction):
+            if radius[0] is None:
+                radius[0] = np.linalg.norm(direction)
+            step, radius[0], rho = dogleg(dofs, direction, radius[0])
+            logger.debug(f"Trust region: rho = {rho}, new radius = {radius[0]}")
+            return step
+    else:
+        def line_search(dofs, direction):
+            fn = backtracking if options.line_search == 'backtracking' else critical_point
+            step, alpha = fn(dofs, direction)
+            logger.debug(f"Line search {options.line_search}: alpha = {alpha}")
+            return step
+
+    return line_search
+
+
+def broyden_direction(tangent_solve, history, res_vec, step=None, last_direction=None):
+    """-H_{k+1} res_vec, res_vec the residual after the step s_k, with
+    H_{k+1} = (I + w_k s_k^T)...(I + w_0 s_0^T) H_0 and H_0 the inverse of the frozen tangent.
+    Appends (s_k, w_k) to history, which holds the pairs (s_j, w_j).
+
+    Parameters
+    ----------
+    step : np.DeviceArray
+        s_k, None for the first direction of a tangent
+    last_direction : np.DeviceArray
+        d_k = -H_k res_k, s_k differs from it after a line search
+    """
+    # z = H_k res_vec
+    z = tangent_solve(res_vec)
+    for s, w in history:
+        z = z + w * np.dot(s, z)
+    if step is None:
+        return -z
+    # H_k y_k = H_k (res_vec - res_k) = z + d_k, and w_k = (s_k - H_k y_k)/(s_k^T H_k y_k)
+    H_y = z + last_direction
+    w = (step - H_y) / np.dot(step, H_y)
+    history.append((step, w))
+    return -(z + w * np.dot(step, z))
+
+
+def bfgs_direction(tangent_solve, history, res_vec):
+    """-H_k res_vec by the two-loop recursion, H_0 the inverse of the frozen tangent.
+    history holds the pairs (s_j, y_j) with s_j^T y_j > 0.
+    """
+    q = res_vec
+    alphas = []
+    for s, y in reversed(history):
+        alpha = np.dot(s, q) / np.dot(s, y)
+        q = q - alpha * y
+        alphas.append(alpha)
+    r = tangent_solve(q)
+    for (s, y), alpha in zip(history, reversed(alphas)):
+        beta = np.dot(y, r) / np.dot(s, y)
+        r = r + s * (alpha - beta)
+    return -r
+
+
+def newton_iterations(dofs, tangent_solve, newton_update_helper, residual_helper, options, line_search=None):
+    """Newton's method with the tangent update strategy of options
+
+    Parameters
+    ----------
+    tangent_solve : Callable
+        Linear solver with a tangent from other dofs (see get_tangent_solve) to start with, None to assemble it at dofs
+    newton_update_helper : Callable
+        dofs -> residual and tangent_solve
+    residual_helper : Callable
+        dofs -> residual, without assembling the tangent
+    line_search : Callable
+        (dofs, direction) -> step, see get_line_search. Full steps if None.
+
+    Returns
+    -------
+    dofs, res_vec, tangent_solve
+    """
+    if tangent_solve is None:
+        res_vec, tangent_solve = newton_update_helper(dofs)
+        num_assemblies = 1
+    else:
+        res_vec = residual_helper(dofs)
+        num_assemblies = 0
+    res_val = np.linalg.norm(res_vec)
+    logger.debug(f"Before, res l_2 = {res_val}")
+    tol = options.get_tol(res_val)
+    # Whether the tangent is assembled at the current dofs
+    fresh = num_assemblies == 1
+    history = []
+    # The last accepted step and its search direction, for the Broyden update
+    step, last_direction = None, None
+    num_iters = 0
+    while res_val > tol:
+        if options.max_iter is not None and num_iters >= options.max_iter:
+            logger.warning(f"Newton's method did not converge in {num_iters} iterations, res l_2 = {res_val}")
+            break
+        if tangent_solve is None:
+            res_vec, tangent_solve = newton_update_helper(dofs)
+            res_val = np.linalg.norm(res_vec)
+            fresh, history, step, last_direction = True, [], None, None
+            num_assemblies += 1
+            if res_val <= tol:
+                break
+
+        if options.tangent_update == 'broyden':
+            direction = broyden_direction(tangent_solve, history, res_vec, step, last_direction)
+        elif options.tangent_update == 'bfgs':
+            direction = bfgs_direction(tangent_solve, history, res_vec)
+        else:
+            direction = -tangent_solve(res_vec)
+        step = direction if line_search is None else line_search(dofs, direction)
+        num_iters += 1
+
+        if options.tangent_update == 'newton':
+            dofs = dofs + step
+            res_vec, tangent_solve = newton_update_helper(dofs)
+            num_assemblies += 1
+            res_val = np.linalg.norm(res_vec)
+            logger.debug(f"res l_2 = {res_val}")
+            continue
+
+        res_vec_new = residual_helper(dofs + step)
+        res_val_new = np.linalg.norm(res_vec_new)
+        rate = res_val_new / res_val
+        logger.debug(f"res l_2 = {res_val_new}, contraction rate = {rate}")
+        if not rate < 1. and not fresh:
+            # Reject the step of an outdated tangent and take a Newton step from the same dofs
+            logger.debug(f"Residual did not decrease, refreshing the tangent")
+            tangent_solve = None
+            continue
+
+        res_change, last_direction = res_vec_new - res_vec, direction
+        dofs, res_vec, res_val = dofs + step, res_vec_new, res_val_new
+        fresh = False
+        if rate > options.contraction_tol:
+            tangent_solve = None
+        elif options.tangent_update == 'broyden' and len(history) >= options.max_updates:
+            tangent_solve = None
+        elif options.tangent_update == 'bfgs' and np.dot(step, res_change) > 0.:
+            history = (history + [(step, res_change)])[-options.max_updates:]
+
+    logger.debug(f"Newton's method took {num_iters} iterations and {num_assemblies} tangent assemblies")
+    return dofs, res_vec, tangent_solve
+
+
+def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc, newton_options=None):
     """The solver imposes Dirichlet B.C. with "row elimination" method.
 
     Some memo:
@@ -345,12 +957,13 @@ def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
          [0 0 0 1]
     A_fn = d(res)/d(u) = D*dr/du + (I - D)
 
-    The function newton_update computes r(u) and dr/du
+    The function newton_update computes r(u) and dr/du, see NewtonOptions for the tangent update strategies.
     """
     logger.debug(
         f"Calling the row elimination solver for imposing Dirichlet B.C.")
     logger.debug("Start timing")
     start = time.time()
+    options = get_newton_options(newton_options)
     sol_shape = (problem.num_total_nodes, problem.vec)
     dofs = np.zeros(sol_shape).reshape(-1)
 
@@ -360,35 +973,44 @@ def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
         A_fn = get_A_fn(problem, use_petsc)
         return res_vec, A_fn
 
+    def tangent_update_helper(dofs):
+        res_vec, A_fn = newton_update_helper(dofs)
+        return res_vec, get_tangent_solve(problem, A_fn, precond, use_petsc, options.pc_lag)
+
+    def residual_helper(dofs):
+        res_vec = problem.compute_residual(dofs.reshape(sol_shape)).reshape(-1)
+        return apply_bc_vec(res_vec, dofs, problem)
+
     if linear:
         dofs = assign_bc(dofs, problem)
         res_vec, A_fn = newton_update_helper(dofs)
 
         dofs = linear_incremental_solver(problem, res_vec, A_fn, dofs, precond,
-                                         use_petsc)
+                                         use_petsc, options.pc_lag)
 
         res_vec, A_fn = newton_update_helper(dofs)
         res_val = np.linalg.norm(res_vec)
         logger.debug(f"Linear solve, res l_2 = {res_val}")
 
     else:
+        # Modified and quasi-Newton iterations start with an available tangent,
+        # kept from the previous solve (e.g., the previous load increment) or from the linear guess
+        reuse = options.tangent_update != 'newton'
+        tangent_solve = getattr(problem, 'frozen_tangent_solve', None) if reuse and options.reuse_tangent else None
         if initial_guess is None:
             res_vec, A_fn = newton_update_helper(dofs)
-            dofs = linear_guess_solve(problem, A_fn, precond, use_petsc)
+            dofs = linear_guess_solve(problem, A_fn, precond, use_petsc, options.pc_lag)
+            if reuse:
+                tangent_solve = get_tangent_solve(problem, A_fn, precond, use_petsc, options.pc_lag)
         else:
             dofs = initial_guess.reshape(-1)
 
-        res_vec, A_fn = newton_update_helper(dofs)
+        dofs, res_vec, tangent_solve = newton_iterations(dofs, tangent_solve, tangent_update_helper,
+                                                         residual_helper, options,
+                                                         get_line_search(problem, options))
         res_val = np.linalg.norm(res_vec)
-        logger.debug(f"Before, res l_2 = {res_val}")
-        tol = 1e-6
-        while res_val > tol:
-            dofs = linear_incremental_solver(problem, res_vec, A_fn, dofs,
-                                             precond, use_petsc)
-            res_vec, A_fn = newton_update_helper(dofs)
-            # test_jacobi_precond(problem, jacobi_preconditioner(problem, dofs), A_fn)
-            res_val = np.linalg.norm(res_vec)
-            logger.debug(f"res l_2 = {res_val}")
+        if options.reuse_tangent:
+            problem.frozen_tangent_solve = tangent_solve
 
     assert np.all(
         np.isfinite(res_val)), f"res_val contains NaN, stop the program!"
@@ -405,6 +1027,129 @@ def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
     return sol
 
 
+################################################################################
+# Matrix-free Newton-Krylov solver
+
+
+def get_krylov_solver(krylov_type):
+    krylov_solvers = {'bicgstab': jax.scipy.sparse.linalg.bicgstab,
+                      'gmres': jax.scipy.sparse.linalg.gmres,
+                      'cg': jax.scipy.sparse.linalg.cg}
+    assert krylov_type in krylov_solvers, f"Unknown Krylov solver {krylov_type}, " \
+        f"choose from {list(krylov_solvers.keys())}"
+    return krylov_solvers[krylov_type]
+
+
+def get_matrix_free_newton_step(problem, precond, krylov_type, tol):
+    """A jitted Newton step that never forms the global matrix.
+
+    The residual (with "row elimination" of Dirichlet B.C.) is linearized with jax.linearize,
+    so the Jacobian is applied through element-level JVPs followed by a scatter-add.
+    The Jacobi preconditioner is summed from diagonals of cell Jacobians by jacobi_fn, separately,
+    so that it can be lagged over Newton steps.
+
+    Returns
+    -------
+    newton_step : Callable
+        newton_step(dofs, jacobi) returns the residual at dofs and the Newton increment,
+        the increment is zero if the residual norm is already below tol. jacobi is None without preconditioner.
+    jacobi_fn : Callable
+        jacobi_fn(dofs) returns the Jacobian diagonal at dofs, with ones at Dirichlet B.C. rows
+    """
+    res_fn = get_flatten_fn(problem.compute_residual, problem)
+    res_fn = apply_bc(res_fn, problem)
+    krylov_solver = get_krylov_solver(krylov_type)
+
+    @jax.jit
+    def jacobi_fn(dofs):
+        jacobi = problem.compute_jacobian_diagonal(
+            dofs.reshape((problem.num_total_nodes, problem.vec)),
+            **problem.internal_vars).reshape(-1)
+        return assign_ones_bc(jacobi, problem)
+
+    @jax.jit
+    def newton_step(dofs, jacobi):
+        res_vec, A_fn = jax.linearize(res_fn, dofs)
+        pc = None if jacobi is None else get_jacobi_precond(jacobi)
+
+        def linear_solve(b):
+            x0 = copy_bc(b, problem)
+            inc, info = krylov_solver(A_fn, b, x0=x0, M=pc, tol=1e-10,
+                                      atol=1e-10, maxiter=10000)
+            return inc
+
+        b = -res_vec
+        inc = jax.lax.cond(np.linalg.norm(res_vec) > tol, linear_solve,
+                           np.zeros_like, b)
+        return res_vec, inc
+
+    return newton_step, jacobi_fn
+
+
+def solver_matrix_free(problem, linear, precond, initial_guess,
+                       krylov_type='bicgstab', newton_options=None):
+    """Newton's method with a matrix-free Krylov solver, Dirichlet B.C. imposed with "row elimination".
+    Memory is dominated by the linearization of cell kernels, not by cell Jacobians
+    (num_cells, num_nodes, vec, num_nodes, vec), and nothing is copied to the host.
+
+    Parameters
+    ----------
+    krylov_type : str
+        'bicgstab', 'gmres' or 'cg'
+    newton_options : None, str or NewtonOptions
+        Only the tolerances, the line search and pc_lag apply, there is no tangent to reuse.
+        The Jacobi preconditioner is recomputed every pc_lag Newton steps.
+    """
+    logger.debug(
+        f"Calling the matrix-free solver for imposing Dirichlet B.C.")
+    start = time.time()
+    options = get_newton_options(newton_options)
+    assert options.tangent_update == 'newton', f"Matrix-free solver only supports full Newton"
+    assert precond in [True, False, 'jacobi'], f"Matrix-free solver only supports the Jacobi preconditioner"
+    sol_shape = (problem.num_total_nodes, problem.vec)
+    newton_step, jacobi_fn = get_matrix_free_newton_step(problem, precond, krylov_type,
+                                                         options.atol)
+    line_search = get_line_search(problem, options)
+
+    if initial_guess is None or linear:
+        dofs = assign_bc(np.zeros(sol_shape).reshape(-1), problem)
+    else:
+        dofs = initial_guess.reshape(-1)
+
+    def get_jacobi(dofs, num_steps, jacobi):
+        if not precond:
+            return None
+        if jacobi is None or num_steps % options.pc_lag == 0:
+            return jacobi_fn(dofs)
+        return jacobi
+
+    jacobi = get_jacobi(dofs, 0, None)
+    res_vec, inc = newton_step(dofs, jacobi)
+    res_val = np.linalg.norm(res_vec)
+    logger.debug(f"Before, res l_2 = {res_val}")
+    # Not below atol, so that the increments of newton_step are nonzero
+    tol = options.get_tol(res_val)
+    num_steps = 0
+    while res_val > tol:
+        dofs = dofs + (inc if line_search is None else line_search(dofs, inc))
+        num_steps += 1
+        jacobi = get_jacobi(dofs, num_steps, jacobi)
+        res_vec, inc = newton_step(dofs, jacobi)
+        res_val = np.linalg.norm(res_vec)
+        logger.debug(f"res l_2 = {res_val}")
+        if linear:
+            break
+
+    assert np.all(
+        np.isfinite(res_val)), f"res_val contains NaN, stop the program!"
+    assert np.all(np.isfinite(dofs)), f"dofs contains NaN, stop the program!"
+
+    sol = dofs.reshape(sol_shape)
+    end = time.time()
+    logger.info(f"Solve took {end - start} [s]")
+    return sol
+
+
 ################################################################################
 # Lagrangian multiplier solver
 
@@ -429,7 +1174,7 @@ def aug_dof_w_bc(problem, dofs, p_num_eps):
 
 
 def linear_guess_solve_lm(problem, A_aug, p_num_eps, use_petsc):
-    b = (problem.body_force + problem.neumann).reshape(-1)
+    b = problem.compute_loads(**problem.internal_vars).reshape(-1)
     b_aug = aug_dof_w_bc(problem, b, p_num_eps)
     if use_petsc:
         dofs_aug = petsc_solve(A_aug, b_aug, 'minres', 'none')
@@ -543,9 +1288,10 @@ def get_A_fn_and_res_aug(problem, dofs_aug, res_vec, p_num_eps, use_petsc):
         group_index += group_size
     I_p_sym, J_p_sym, V_p_sym = symmetry(I_p, J_p, V_p)
 
-    I = onp.hstack((problem.I, I_d_sym, I_p_sym))
-    J = onp.hstack((problem.J, J_d_sym, J_p_sym))
-    V = onp.hstack((problem.V, V_d_sym, V_p_sym))
+    I_A, J_A, V_A = problem.sparsity.to_coo(problem.csr_data)
+    I = onp.hstack((I_A, I_d_sym, I_p_sym))
+    J = onp.hstack((J_A, J_d_sym, J_p_sym))
+    V = onp.hstack((V_A, V_d_sym, V_p_sym))
 
     logger.debug(f"Aug - Creating sparse matrix with scipy...")
     A_sp_scipy_aug = scipy.sparse.csc_array((V, (I, J)),
@@ -567,7 +1313,8 @@ def get_A_fn_and_res_aug(problem, dofs_aug, res_vec, p_num_eps, use_petsc):
         A = PETSc.Mat().createAIJ(size=A_sp_scipy_aug.shape,
                                   csr=(A_sp_scipy_aug.indptr.astype(PETSc.IntType, copy=False),
                                        A_sp_scipy_aug.indices.astype(PETSc.IntType, copy=False),
-                                       A_sp_scipy_aug.data))
+                                       A_sp_scipy_aug.data),
+                                  comm=PETSc.COMM_SELF)
 
         # A_aug = PETSc.Mat().createAIJ(size=A_sp_scipy_aug.shape,
         #                               csr=(A_sp_scipy_aug.indptr,
@@ -581,7 +1328,7 @@ def get_A_fn_and_res_aug(problem, dofs_aug, res_vec, p_num_eps, use_petsc):
     return A_aug, res_vec_aug
 
 
-def solver_lagrange_multiplier(problem, linear, use_petsc=True):
+def solver_lagrange_multiplier(problem, linear, use_petsc=True, newton_options=None):
     """The solver imposes Dirichlet B.C. and periodic B.C. with lagrangian multiplier method.
 
     The global matrix is of the form
@@ -599,6 +1346,8 @@ def solver_lagrange_multiplier(problem, linear, use_petsc=True):
     )
     logger.info("Start timing")
     start = time.time()
+    options = get_newton_options(newton_options)
+    assert options.tangent_update == 'newton', f"Lagrange multiplier solver only supports full Newton"
     sol_shape = (problem.num_total_nodes, problem.vec)
     dofs = np.zeros(sol_shape).reshape(-1)
 
@@ -635,7 +1384,7 @@ def solver_lagrange_multiplier(problem, linear, use_petsc=True):
         res_vec_aug, A_aug = newton_update_helper(dofs_aug)
         res_val = np.linalg.norm(res_vec_aug)
         logger.debug(f"Before, res l_2 = {res_val}")
-        tol = 1e-6
+        tol = options.get_tol(res_val)
         while res_val > tol:
             dofs_aug = linear_incremental_solver_lm(problem, res_vec_aug,
                                                     A_aug, dofs_aug, p_num_eps,
@@ -661,13 +1410,12 @@ def solver_lagrange_multiplier(problem, linear, use_petsc=True):
 def assembleCSR(problem, dofs):
     problem.newton_update(dofs.reshape(
         (problem.num_total_nodes, problem.vec))).reshape(-1)
-    A_sp_scipy = scipy.sparse.csr_array(
-        (problem.V, (problem.I, problem.J)),
-        shape=(problem.num_total_dofs, problem.num_total_dofs))
+    A_sp_scipy = problem.sparsity.to_scipy(problem.csr_data)
 
     A = PETSc.Mat().createAIJ(size=A_sp_scipy.shape,
                               csr=(A_sp_scipy.indptr, A_sp_scipy.indices,
-                                   A_sp_scipy.data))
+                                   A_sp_scipy.data),
+                              comm=PETSc.COMM_SELF)
     for i in range(len(problem.node_inds_list)):
         row_inds = onp.array(problem.node_inds_list[i] * problem.vec +
                              problem.vec_inds_list[i],
@@ -837,24 +1585,235 @@ def solver(problem,
            linear=False,
            precond=True,
            initial_guess=None,
-           use_petsc=False):
+           use_petsc=False,
+           matrix_free=False,
+           newton_options=None):
     """periodic B.C. is a special form of adding a linear constraint.
     Lagrange multiplier seems to be convenient to impose this constraint.
+
+    matrix_free=True never forms the global matrix, see solver_matrix_free.
+    precond selects the preconditioner of the linear solves: True is 'jacobi', a name from
+    preconditioners.preconditioners (e.g., 'amg' or 'ilu0') or a Preconditioner instance.
+    newton_options sets the tolerances and the tangent update strategy (e.g., 'modified' or 'bfgs'),
+    see NewtonOptions.
+    A batch of samples (e.g., params or Dirichlet values) is solved at once by ensemble_solver.
     """
     # TODO: print platform jax.lib.xla_bridge.get_backend().platform
     # and suggest PETSc or jax solver
+    if matrix_free:
+        assert problem.periodic_bc_info is None and not use_petsc, \
+            f"Matrix-free solver supports neither periodic B.C. nor PETSc"
+        return solver_matrix_free(problem, linear, precond, initial_guess,
+                                  newton_options=newton_options)
     if problem.periodic_bc_info is None:
         return solver_row_elimination(problem, linear, precond, initial_guess,
-                                      use_petsc)
+                                      use_petsc, newton_options)
     else:
-        return solver_lagrange_multiplier(problem, linear, use_petsc)
+        return solver_lagrange_multiplier(problem, linear, use_petsc, newton_options)
+
+
+################################################################################
+# Ensemble solver
+
+
+def restore_problem_state(problem, state):
+    """Reset the attributes of problem to state, e.g., after they were set to traced values inside
+    a JAX transformation. New attributes are kept, unless they hold traced values.
+    """
+    for key in list(vars(problem)):
+        if key in state:
+            setattr(problem, key, state[key])
+        elif any(isinstance(leaf, jax.core.Tracer) for leaf in jax.tree_util.tree_leaves(getattr(problem, key))):
+            delattr(problem, key)
+
+
+def get_periodic_preconditioner(problem, roots, precond):
+    """Preconditioner set up from the tangent problem.csr_data condensed on the periodic roots, P^T A P + I on
+    the other dofs, see ensemble_solver
+
+    Returns
+    -------
+    pc : Callable
+        x -> M^{-1} x, None without preconditioner
+    """
+    preconditioner = get_preconditioner(precond)
+    if preconditioner is None:
+        return None
+    num_dofs = problem.num_total_dofs
+    P = scipy.sparse.csr_array((onp.ones(num_dofs), (onp.arange(num_dofs), roots)), shape=(num_dofs, num_dofs))
+    images = (roots != onp.arange(num_dofs)).astype(onp.float64)
+    A = scipy.sparse.csr_array(P.T @ problem.A_sp_scipy @ P + scipy.sparse.diags(images))
+    A.sort_indices()
+    policy = get_precision_policy(getattr(problem, 'precision_policy', None))
+    return preconditioner.setup(problem, policy.solve_dtype, A=A).apply
+
+
+def ensemble_solver(problem, params=None, vals_lists=None, linear=False, precond=True, initial_guess=None,
+                    newton_options=None):
+    """Solves the problem for a batch of samples at once, e.g., to generate the training data of a surrogate
+    or for calibration studies. The samples differ in params and/or Dirichlet values.
+
+    The Newton iterations of all samples are one jitted function, vmapped over the samples: the element kernels,
+    the assembly on the shared sparsity pattern and the JAX Krylov solves (see jax_solve) are batched.
+    Samples that converged wait for the others. The preconditioner is set up once, from the tangent of
+    the first sample at the initial guess, and shared by all samples.
+
+    Macroscopic strains (e.g., of an RVE) are batched as params if set_params passes them to the material maps
+    as internal variables or kernel parameters (see FEM.get_kernel_params), material maps must not read
+    other traced attributes of the problem.
+    Periodic B.C. are imposed by condensation on the root dofs (see FEM.get_periodic_roots): with the prolongation
+    P from the roots to all dofs, P^T r(P u) = 0 is solved with the tangent P^T A P on the root dofs and
+    the identity on the other dofs, A on the shared sparsity pattern.
+    Only full Newton steps with row (or symmetric) elimination of the Dirichlet B.C. are supported:
+    neither PETSc nor line searches.
+
+    Parameters
+    ----------
+    params : pytree
+        Leading axis num_samples, each sample is passed to problem.set_params. None keeps the current params.
+    vals_lists : List[ndarray]
+        One per Dirichlet B.C. entry, (num_samples,) or (num_samples, num_selected_nodes),
+        see FEM.update_Dirichlet_values. None keeps the current values.
+    initial_guess : ndarray
+        (num_total_nodes, vec) or (num_samples, num_total_nodes, vec), defaults to zeros.
+        The Dirichlet values of each sample are assigned.
+
+    Returns
+    -------
+    sols : ndarray
+        (num_samples, num_total_nodes, vec)
+    """
+    options = get_newton_options(newton_options)
+    assert options.tangent_update == 'newton' and options.line_search is None, \
+        f"Ensemble solver supports full Newton steps only"
+    samples = (params, vals_lists)
+    assert len(jax.tree_util.tree_leaves(samples)) > 0, f"Provide params and/or vals_lists"
+    num_samples = len(jax.tree_util.tree_leaves(samples)[0])
+    logger.info(f"Solving an ensemble of {num_samples} samples...")
+    start = time.time()
+    sol_shape = (problem.num_total_nodes, problem.vec)
+    initial_guess = np.zeros(sol_shape) if initial_guess is None else initial_guess
+    initial_guesses = np.broadcast_to(initial_guess, (num_samples, *sol_shape))
+    sparsity = problem.get_sparsity_pattern()
+    eliminate = symmetric_elimination if problem.symmetric else row_elimination
+    if problem.periodic_bc_info is None:
+        prolong = restrict = condense_matvec = lambda x: x
+    else:
+        roots = problem.get_periodic_roots()
+        images = roots != onp.arange(problem.num_total_dofs)
+        prolong = lambda dofs: dofs[roots]
+        restrict = lambda res_vec: jax.ops.segment_sum(res_vec, roots, num_segments=problem.num_total_dofs)
+        # Rows of the dofs that are not roots are identities
+        condense_matvec = lambda matvec: lambda dofs: restrict(matvec(prolong(dofs))) + np.where(images, dofs, 0.)
+
+    def set_sample(sample):
+        params, vals_list = sample
+        if params is not None:
+            problem.set_params(params)
+        if vals_list is not None:
+            problem.update_Dirichlet_values(vals_list=vals_list)
+
+    def newton_update_helper(dofs):
+        res_vec = restrict(problem.newton_update(dofs.reshape(sol_shape)).reshape(-1))
+        return apply_bc_vec(res_vec, dofs, problem), problem.csr_data
+
+    def tangent_solve(csr_data, b):
+        # See get_tangent_solve, the matrix of each sample on the shared sparsity pattern
+        matvec = condense_matvec(lambda dofs: sparsity.matvec(csr_data, dofs))
+        x0 = copy_bc(b, problem)
+        if problem.symmetric:
+            b = symmetric_bc_rhs(problem, b, matvec)
+        return jax_solve(problem, eliminate(matvec, problem), b, x0, precond, pc_matrix=pc)
+
+    def solve_sample(sample, dofs):
+        set_sample(sample)
+        dofs = prolong(assign_bc(dofs, problem))
+        res_vec, csr_data = newton_update_helper(dofs)
+        tol = np.maximum(options.atol, options.rtol * np.linalg.norm(res_vec))
+
+        def cond_fn(carry):
+            dofs, res_vec, csr_data, num_iters = carry
+            if linear:
+                return num_iters < 1
+            unconverged = np.linalg.norm(res_vec) > tol
+            return unconverged if options.max_iter is None else unconverged & (num_iters < options.max_iter)
+
+        def body_fn(carry):
+            dofs, res_vec, csr_data, num_iters = carry
+            dofs = prolong(dofs + tangent_solve(csr_data, -res_vec))
+            res_vec, csr_data = newton_update_helper(dofs)
+            return dofs, res_vec, csr_data, num_iters + 1
+
+        dofs, res_vec, _, num_iters = jax.lax.while_loop(cond_fn, body_fn, (dofs, res_vec, csr_data, 0))
+        return dofs.reshape(sol_shape), np.linalg.norm(res_vec), num_iters
+
+    # Attributes set to traced values by set_params, update_Dirichlet_values and newton_update are reset
+    state = dict(vars(problem), internal_vars=dict(problem.internal_vars))
+    try:
+        # The shared preconditioner, from the first sample
+        set_sample(jax.tree_map(lambda x: x[0], samples))
+        newton_update_helper(prolong(assign_bc(initial_guesses[0].reshape(-1), problem)))
+        if problem.periodic_bc_info is None:
+            pc = get_jax_preconditioner(problem, get_A_fn(problem, False), precond)
+        else:
+            pc = get_periodic_preconditioner(problem, roots, precond)
+        sols, res_vals, num_iters = jax.jit(jax.vmap(solve_sample))(samples,
+                                                                   initial_guesses.reshape(num_samples, -1))
+    finally:
+        restore_problem_state(problem, state)
+
+    assert np.all(np.isfinite(sols)), f"sols contain NaN, stop the program!"
+    logger.debug(f"Newton's method took at most {np.max(num_iters)} iterations, max res l_2 = {np.max(res_vals)}")
+    logger.info(f"Ensemble solve took {time.time() - start} [s]")
+    return sols
 
 
 ################################################################################
 # Implicit differentiation with the adjoint method
 
 
-def implicit_vjp(problem, sol, params, v, use_petsc):
+def same_values(tree1, tree2):
+    leaves1, treedef1 = jax.tree_util.tree_flatten(tree1)
+    leaves2, treedef2 = jax.tree_util.tree_flatten(tree2)
+    return treedef1 == treedef2 and all(onp.array_equal(x, y) for x, y in zip(leaves1, leaves2))
+
+
+def is_tangent_at(problem, sol, params):
+    """Whether problem.csr_data is the tangent at sol and params, assembled by the last Newton iteration
+    of the forward solve of ad_wrapper (see FEM.newton_update), so that the adjoint solve needs no assembly
+    """
+    forward_tangent = getattr(problem, 'forward_tangent', None)
+    if forward_tangent is None or forward_tangent[1] is None or \
+            forward_tangent[1] is not getattr(problem, 'tangent_sol', None) or \
+            forward_tangent[1][1] is not problem.csr_data:
+        return False
+    return same_values(forward_tangent[1][0], sol) and same_values(forward_tangent[0], params)
+
+
+def implicit_vjp(problem, sol, params, v, use_petsc, matrix_free=False, precond=True):
+    """The adjoint method, the constraint c(u, p) is the residual with Dirichlet B.C. eliminated:
+    solves (dc/du)^T adjoint = v and returns -adjoint^T dc/dp.
+
+    The tangent dc/du of the forward solve is reused if it is that at sol and params (see is_tangent_at),
+    and so is the preconditioner of the forward solves, transposed, with the Dirichlet B.C. elimination
+    of the matrix.
+
+    Parameters
+    ----------
+    v : JaxArray
+        (num_total_nodes, vec), or (num_cotangents, num_total_nodes, vec) for several cotangents
+        (e.g., of several objectives or constraints) whose adjoint problems are solved in one multi-RHS call.
+        Vectorizing over the cotangents, e.g., with jax.jacrev or jax.vmap, has the same effect.
+    precond : bool, str or Preconditioner
+        The preconditioner of the forward solves, see solver
+
+    Returns
+    -------
+    vjp_result : pytree
+        Same structure as params, with a leading axis num_cotangents for several cotangents
+    """
+    if v.ndim == sol.ndim + 1:
+        return jax.vmap(lambda v: implicit_vjp(problem, sol, params, v, use_petsc, matrix_free, precond))(v)
 
     def constraint_fn(dofs, params):
         """c(u, p)
@@ -870,8 +1829,9 @@ def implicit_vjp(problem, sol, params, v, use_petsc):
 
     def get_vjp_contraint_fn_dofs(dofs):
         # Just a transpose of A_fn
+        primals, f_vjp = jax.vjp(A_fn, dofs)
+
         def adjoint_linear_fn(adjoint):
-            primals, f_vjp = jax.vjp(A_fn, dofs)
             val, = f_vjp(adjoint)
             return val
 
@@ -899,12 +1859,25 @@ def implicit_vjp(problem, sol, params, v, use_petsc):
         return vjp_linear_fn
 
     problem.set_params(params)
-    problem.newton_update(sol)
-    A_fn = get_A_fn(problem, use_petsc)
-
-    if use_petsc:
-        A_transpose = A_fn.transpose()
+    if not matrix_free:
+        if is_tangent_at(problem, sol, params):
+            logger.debug(f"Reusing the tangent of the forward solve for the adjoint problem")
+        else:
+            problem.newton_update(sol)
+        A_fn = get_A_fn(problem, use_petsc)
 
+    if matrix_free:
+        # Transpose of the linearized residual, no matrix is formed
+        res_fn = apply_bc(get_flatten_fn(problem.compute_residual, problem), problem)
+        _, res_vjp = jax.vjp(res_fn, sol.reshape(-1))
+        adjoint_linear_fn = lambda adjoint: res_vjp(adjoint)[0]
+        jacobi = problem.compute_jacobian_diagonal(sol, **problem.internal_vars)
+        jacobi = assign_ones_bc(jacobi.reshape(-1), problem)
+        adjoint, info = jax.scipy.sparse.linalg.bicgstab(
+            adjoint_linear_fn, v.reshape(-1), M=get_jacobi_precond(jacobi),
+            tol=1e-10, atol=1e-10, maxiter=10000)
+
+    elif use_petsc:
         # Remark: Eliminating rows seems to make A better conditioned.
         # If Dirichlet B.C. is part of the design variable, the following should NOT be implemented.
         # for i in range(len(problem.node_inds_list)):
@@ -912,12 +1885,28 @@ def implicit_vjp(problem, sol, params, v, use_petsc):
         #     A_transpose.zeroRows(row_inds)
         # v = assign_zeros_bc(v, problem)
 
-        adjoint = petsc_solve(A_transpose, v.reshape(-1), 'minres', 'ilu')
+        # A_fn is the tangent of problem.petsc_linear_solver. Its preconditioner is kept however many
+        # tangent updates ago it was built, the Krylov iterations use the current tangent.
+        petsc_linear_solver = problem.petsc_linear_solver
+        petsc_linear_solver.set_preconditioner(problem, precond, pc_lag=onp.inf)
+        b = v.reshape(-1)
+
+        def solve_transpose(b):
+            # (num_total_dofs,), or (num_cotangents, num_total_dofs) if vectorized
+            return petsc_linear_solver.solve_transpose(b.reshape(-1, b.shape[-1])).reshape(b.shape).astype(b.dtype)
+
+        adjoint = jax.pure_callback(solve_transpose, jax.ShapeDtypeStruct(b.shape, b.dtype), b, vectorized=True)
 
     else:
-        adjoint_linear_fn = get_vjp_contraint_fn_dofs(sol.reshape(-1))
-        adjoint = jax_solve(problem, adjoint_linear_fn, v.reshape(-1), None,
-                            True)
+        pc = get_jax_preconditioner(problem, A_fn, precond, reuse=True)
+        if problem.symmetric:
+            # Symmetric elimination, A_fn is its own transpose
+            adjoint = jax_solve(problem, A_fn, v.reshape(-1), None, precond, pc_matrix=pc,
+                                A_fn_solve=getattr(problem, 'A_fn_solve', None))
+        else:
+            adjoint_linear_fn = get_vjp_contraint_fn_dofs(sol.reshape(-1))
+            pc = None if pc is None else transpose_apply(pc)
+            adjoint = jax_solve(problem, adjoint_linear_fn, v.reshape(-1), None, precond, pc_matrix=pc)
 
     vjp_linear_fn = get_vjp_contraint_fn_params(params, sol)
     vjp_result = vjp_linear_fn(adjoint.reshape(sol.shape))
@@ -926,12 +1915,19 @@ def implicit_vjp(problem, sol, params, v, use_petsc):
     return vjp_result
 
 
-def ad_wrapper(problem, linear=False, use_petsc=False):
+def ad_wrapper(problem, linear=False, use_petsc=False, matrix_free=False, newton_options=None, precond=True):
+    """Differentiable forward solve, params -> sol, whose VJP is computed by implicit_vjp.
+    Several cotangents, e.g., with jax.jacrev for several objectives or constraints, share one multi-RHS
+    adjoint solve.
+    """
 
     @jax.custom_vjp
     def fwd_pred(params):
         problem.set_params(params)
-        sol = solver(problem, linear=linear, use_petsc=use_petsc)
+        sol = solver(problem, linear=linear, precond=precond, use_petsc=use_petsc, matrix_free=matrix_free,
+                     newton_options=newton_options)
+        # The tangent of the last assembly, reused by the adjoint solve if it is at sol, see is_tangent_at
+        problem.forward_tangent = (params, getattr(problem, 'tangent_sol', None))
         return sol
 
     def f_fwd(params):
@@ -941,7 +1937,7 @@ def ad_wrapper(problem, linear=False, use_petsc=False):
     def f_bwd(res, v):
         logger.info("Running backward and solving the adjoint problem...")
         params, sol = res
-        vjp_result = implicit_vjp(problem, sol, params, v, use_petsc)
+        vjp_result = implicit_vjp(problem, sol, params, v, use_petsc, matrix_free, precond)
         return (vjp_result, )
 
     fwd_pred.defvjp(f_fwd, f_bwd)
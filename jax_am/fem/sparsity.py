@@ -0,0 +1,225 @@
+"""Symbolic assembly of the global sparse matrix.
+
+The nonzero structure of the global matrix only depends on the mesh
+connectivity and the number of vector components. We compute it once and,
+in every Newton iteration, only scatter the element Jacobian values into
+the CSR data array.
+
+For symmetric problems, only the upper triangle of the element Hessians and
+of the global matrix is stored.
+"""
+import numpy as onp
+import jax
+import jax.numpy as np
+import scipy
+
+from jax_am import logger
+
+
+class SparsityPattern():
+    """CSR sparsity pattern of the global matrix, with the map from element
+    Jacobian entries to CSR data slots.
+
+    Attributes
+    ----------
+    num_total_dofs : int
+    symmetric : bool
+        If True, the pattern covers the upper triangle only and element Jacobians are
+        given by their upper triangle (num_cells, num_nodes*vec*(num_nodes*vec + 1)//2),
+        see upper_triangle.
+    indptr : onp.ndarray
+        (num_total_dofs + 1,)
+    indices : onp.ndarray
+        (nnz,) column index of each CSR data slot
+    rows : onp.ndarray
+        (nnz,) row index of each CSR data slot
+    cols : onp.ndarray
+        (nnz,) same as indices
+    scatter_inds : onp.ndarray
+        (num_cells*(num_nodes*vec)**2,) CSR data slot of each entry of the
+        flattened element Jacobian array (num_cells, num_nodes, vec, num_nodes, vec).
+        Duplicated entries (shared dofs) point to the same slot and are summed.
+        In symmetric mode, (num_cells*num_nodes*vec*(num_nodes*vec + 1)//2,)
+    diag_inds : onp.ndarray
+        (num_total_dofs,) CSR data slot of the diagonal entry of each row, -1 if absent
+    """
+    def __init__(self, cells, vec, num_total_dofs, symmetric=False):
+        self.num_total_dofs = num_total_dofs
+        self.vec = vec
+        self.symmetric = symmetric
+        # Store only what depends on connectivity, all index arrays are int32
+        # since this is what PETSc and JAX use by default.
+        keys = self._get_keys(cells)
+        unique_keys, scatter_inds = onp.unique(keys, return_inverse=True)
+        del keys
+        self.rows = (unique_keys // num_total_dofs).astype(onp.int32)
+        self.cols = (unique_keys % num_total_dofs).astype(onp.int32)
+        self.indices = self.cols
+        self.nnz = len(unique_keys)
+        self.scatter_inds = scatter_inds.reshape(-1).astype(onp.int32)
+        del unique_keys
+        row_counts = onp.bincount(self.rows, minlength=num_total_dofs)
+        self.indptr = onp.hstack((0, onp.cumsum(row_counts))).astype(onp.int32)
+        self.diag_inds = -onp.ones(num_total_dofs, dtype=onp.int32)
+        diag_flags = self.rows == self.cols
+        self.diag_inds[self.rows[diag_flags]] = onp.argwhere(diag_flags).reshape(-1)
+        logger.debug(f"Sparsity pattern built, nnz = {self.nnz}, "
+                     f"num of element entries = {len(self.scatter_inds)}")
+
+    def _get_keys(self, cells):
+        """Flattened global (row, col) pairs of element Jacobian entries, encoded as row*num_total_dofs + col
+
+        Parameters
+        ----------
+        cells : onp.ndarray
+            (num_cells, num_nodes)
+
+        Returns
+        -------
+        keys : onp.ndarray
+            (num_cells*(num_nodes*vec)**2,)
+        """
+        # (num_cells, num_nodes, vec) -> (num_cells, num_nodes*vec)
+        cells = onp.asarray(cells, dtype=onp.int64)
+        inds = (self.vec * cells[:, :, None] +
+                onp.arange(self.vec)[None, None, :]).reshape(len(cells), cells.shape[1] * self.vec)
+        if self.symmetric:
+            # Local (a, b) with a <= b goes to global (min, max), i.e., the upper triangle
+            rows, cols = onp.triu_indices(inds.shape[1])
+            I, J = inds[:, rows], inds[:, cols]
+            keys = onp.minimum(I, J) * self.num_total_dofs + onp.maximum(I, J)
+        else:
+            # (num_cells, num_nodes*vec, 1) * N + (num_cells, 1, num_nodes*vec)
+            keys = inds[:, :, None] * self.num_total_dofs + inds[:, None, :]
+        return keys.reshape(-1)
+
+    def upper_triangle(self, values):
+        """Upper triangle of full element Jacobians, in the order expected by symmetric mode
+
+        Parameters
+        ----------
+        values : ndarray
+            (num_selected_cells, num_nodes, vec, num_nodes, vec)
+
+        Returns
+        -------
+        values_upper : ndarray
+            (num_selected_cells, num_nodes*vec*(num_nodes*vec + 1)//2)
+        """
+        num_cells = values.shape[0]
+        size = int(onp.sqrt(onp.prod(values.shape[1:])))
+        rows, cols = onp.triu_indices(size)
+        return values.reshape(num_cells, size, size)[:, rows, cols]
+
+    def locate(self, cells):
+        """Compute the CSR data slots for element Jacobian entries of a subset of cells,
+        e.g., cells that own a Cauchy boundary face.
+
+        Parameters
+        ----------
+        cells : onp.ndarray
+            (num_selected_cells, num_nodes), must be cells of the mesh this pattern is built on
+
+        Returns
+        -------
+        scatter_inds : onp.ndarray
+            (num_selected_cells*(num_nodes*vec)**2,), or the upper triangle size in symmetric mode
+        """
+        keys = self._get_keys(cells)
+        unique_keys = self.rows.astype(onp.int64) * self.num_total_dofs + self.cols
+        scatter_inds = onp.searchsorted(unique_keys, keys)
+        assert onp.all(unique_keys[scatter_inds] == keys), f"Cells do not belong to the sparsity pattern"
+        return scatter_inds.astype(onp.int32)
+
+    def assemble(self, values, scatter_inds=None):
+        """Sum element Jacobian values into the CSR data array.
+
+        Parameters
+        ----------
+        values : ndarray
+            Element Jacobian values, any shape, flattened in the same order as scatter_inds
+        scatter_inds : onp.ndarray
+            Defaults to the scatter map of all cells
+
+        Returns
+        -------
+        data : onp.ndarray
+            (nnz,), a JAX array if values are traced (e.g., newton_update called inside jax.jvp)
+        """
+        if scatter_inds is None:
+            scatter_inds = self.scatter_inds
+        values = values.reshape(-1)
+        assert len(values) == len(scatter_inds), \
+            f"Got {len(values)} values for {len(scatter_inds)} element entries"
+        if isinstance(values, jax.core.Tracer):
+            return jax.ops.segment_sum(values, scatter_inds, num_segments=self.nnz)
+        return onp.bincount(scatter_inds, weights=onp.asarray(values), minlength=self.nnz)
+
+    def diagonal(self, data):
+        """Diagonal of the matrix, zero for rows without a diagonal entry
+
+        Returns
+        -------
+        diag : onp.ndarray
+            (num_total_dofs,)
+        """
+        return onp.where(self.diag_inds >= 0, data[self.diag_inds], 0.)
+
+    def matvec(self, data, x):
+        """Product of the matrix with a vector, jittable. In symmetric mode, A = U + U^T - diag(U)
+
+        Parameters
+        ----------
+        data : ndarray
+            (nnz,)
+        x : ndarray
+            (num_total_dofs,)
+
+        Returns
+        -------
+        y : ndarray
+            (num_total_dofs,)
+        """
+        y = jax.ops.segment_sum(data * x[self.cols], self.rows, num_segments=self.num_total_dofs,
+                                indices_are_sorted=True)
+        if self.symmetric:
+            off_diag = np.where(self.rows != self.cols, data, 0.)
+            y = y + jax.ops.segment_sum(off_diag * x[self.rows], self.cols, num_segments=self.num_total_dofs)
+        return y
+
+    def to_scipy(self, data, upper=False):
+        """No sorting or duplicate summation is needed since the pattern is already canonical.
+
+        Parameters
+        ----------
+        data : onp.ndarray
+            (nnz,)
+        upper : bool
+            In symmetric mode, return the stored upper triangle instead of the full matrix
+
+        Returns
+        -------
+        A_sp_scipy : scipy.sparse.csr_array
+        """
+        A_sp_scipy = scipy.sparse.csr_array((data, self.indices, self.indptr),
+                                            shape=(self.num_total_dofs, self.num_total_dofs))
+        A_sp_scipy.has_sorted_indices = True
+        A_sp_scipy.has_canonical_format = True
+        if self.symmetric and not upper:
+            A_sp_scipy = scipy.sparse.csr_array(A_sp_scipy + scipy.sparse.triu(A_sp_scipy, k=1).T)
+            A_sp_scipy.sort_indices()
+        return A_sp_scipy
+
+    def to_coo(self, data):
+        """COO triplets of the full matrix, the strict upper triangle is mirrored in symmetric mode
+
+        Returns
+        -------
+        rows, cols, data : onp.ndarray
+        """
+        if not self.symmetric:
+            return self.rows, self.cols, data
+        off_diag = self.rows != self.cols
+        rows = onp.hstack((self.rows, self.cols[off_diag]))
+        cols = onp.hstack((self.cols, self.rows[off_diag]))
+        return rows, cols, onp.hstack((data, data[off_diag]))
@@ -1,3 +1,4 @@
+import jax
 import meshio
 import os
 import numpy as onp
@@ -9,19 +10,22 @@ def save_sol(problem, sol, sol_file, cell_infos=None, point_infos=None):
     cell_type = get_meshio_cell_type(problem.ele_type)
     sol_dir = os.path.dirname(sol_file)
     os.makedirs(sol_dir, exist_ok=True)
-    out_mesh = meshio.Mesh(points=problem.points, cells={cell_type: problem.cells})
-    out_mesh.point_data['sol'] = onp.array(sol, dtype=onp.float32)
+    # A reordered mesh (see Mesh.reorder) is written in the original node and cell order
+    mesh = problem.mesh
+    points, cells = (problem.points, problem.cells) if mesh.node_perm is None else mesh.get_original_mesh()
+    out_mesh = meshio.Mesh(points=points, cells={cell_type: cells})
+    out_mesh.point_data['sol'] = onp.array(mesh.to_original_nodes(onp.asarray(sol)), dtype=onp.float32)
     if cell_infos is not None:
         for cell_info in cell_infos:
             name, data = cell_info
             # TODO: vector-valued cell data
             assert data.shape == (problem.num_cells,), f"cell data wrong shape, get {data.shape}, while num_cells = {problem.num_cells}"
-            out_mesh.cell_data[name] = [onp.array(data, dtype=onp.float32)]
+            out_mesh.cell_data[name] = [onp.array(mesh.to_original_cells(onp.asarray(data)), dtype=onp.float32)]
     if point_infos is not None:
         for point_info in point_infos:
             name, data = point_info
             assert len(data) == len(sol), "point data wrong shape!"
-            out_mesh.point_data[name] = onp.array(data, dtype=onp.float32)
+            out_mesh.point_data[name] = onp.array(mesh.to_original_nodes(onp.asarray(data)), dtype=onp.float32)
     out_mesh.write(sol_file)
 
 
@@ -44,3 +48,28 @@ def read_abaqus_and_write_vtk(abaqus_file, vtk_file):
     meshio_mesh = meshio.read(abaqus_file)
     meshio_mesh.write(vtk_file)
 
+
+
+def enable_compilation_cache(cache_dir=None, min_compile_time_secs=0.):
+    """Opt-in persistent on-disk cache of compiled XLA executables.
+    Repeated runs of the same problem (same mesh size, element and material maps) then skip compilation.
+    Must be called before the first solve. Older JAX versions only persist GPU/TPU executables.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Defaults to the environment variable JAX_AM_COMPILATION_CACHE_DIR, or ~/.cache/jax_am
+    min_compile_time_secs : float
+        Only executables that take longer than this to compile are saved
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('JAX_AM_COMPILATION_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'jax_am'))
+    os.makedirs(cache_dir, exist_ok=True)
+    jax.config.update('jax_persistent_cache_min_compile_time_secs', min_compile_time_secs)
+    try:
+        jax.config.update('jax_compilation_cache_dir', cache_dir)
+    except AttributeError:
+        # Older JAX versions
+        from jax.experimental.compilation_cache import compilation_cache as cc
+        cc.initialize_cache(cache_dir)
@@ -0,0 +1,4 @@
+import os
+
+# Fake CPU devices for the sharded assembly tests, must be set before jax is imported
+os.environ.setdefault('XLA_FLAGS', '--xla_force_host_platform_device_count=4')
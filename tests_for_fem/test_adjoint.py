@@ -0,0 +1,66 @@
+"""Check that the adjoint solve reuses the tangent of the forward solve, and solves several cotangents at once
+"""
+import numpy.testing as onptest
+import jax
+import jax.numpy as np
+import pytest
+
+from tests_for_fem.elasticity2d_code import Elasticity
+from jax_am.common import rectangle_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.solver import ad_wrapper, implicit_vjp
+
+
+def get_problem():
+    Lx, Ly = 10., 5.
+    meshio_mesh = rectangle_mesh(Nx=10, Ny=5, domain_x=Lx, domain_y=Ly)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['quad'])
+    fixed = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    load = lambda point: np.isclose(point[0], Lx, atol=1e-5)
+    dirichlet_bc_info = [[fixed]*2, [0, 1], [lambda point: 0.]*2]
+    neumann_bc_info = [[load], [lambda point: np.array([0., -100.])]]
+    problem = Elasticity(mesh, vec=2, dim=2, ele_type='QUAD4', dirichlet_bc_info=dirichlet_bc_info,
+                         neumann_bc_info=neumann_bc_info)
+    # Count tangent assemblies
+    problem.num_assemblies = 0
+    newton_update = problem.newton_update
+
+    def counted_newton_update(sol):
+        problem.num_assemblies += 1
+        return newton_update(sol)
+
+    problem.newton_update = counted_newton_update
+    return problem
+
+
+@pytest.mark.parametrize('use_petsc', [False, True])
+def test_adjoint(use_petsc):
+    problem = get_problem()
+    fwd_pred = ad_wrapper(problem, linear=True, use_petsc=use_petsc)
+    params = np.linspace(0.3, 0.9, 50).reshape(50, 1)
+    weights = np.linspace(-1., 1., problem.num_total_dofs).reshape(-1, 2)
+
+    def objectives(params):
+        sol = fwd_pred(params)
+        return np.stack([np.sum(sol**2), np.sum(weights * sol)])
+
+    grads = np.stack([jax.grad(lambda params: objectives(params)[i])(params) for i in range(2)])
+    # Two assemblies per forward solve (linear solve and residual), none for the adjoint
+    assert problem.num_assemblies == 4
+
+    # Several cotangents, in one multi-RHS adjoint solve
+    onptest.assert_allclose(jax.jacrev(objectives)(params), grads, rtol=1e-8, atol=1e-12)
+    sol = fwd_pred(params)
+    vjps = implicit_vjp(problem, sol, params, np.stack([2. * sol, weights]), use_petsc)
+    onptest.assert_allclose(vjps, grads, rtol=1e-8, atol=1e-12)
+
+    # Same gradient with the tangent assembled at the converged solution
+    num_assemblies = problem.num_assemblies
+    problem.forward_tangent = None
+    vjp = implicit_vjp(problem, sol, params, 2. * sol, use_petsc)
+    assert problem.num_assemblies == num_assemblies + 1
+    onptest.assert_allclose(vjp, grads[0], rtol=1e-6)
+    if use_petsc:
+        fwd_pred_jax = ad_wrapper(get_problem(), linear=True)
+        grad_jax = jax.grad(lambda params: np.sum(fwd_pred_jax(params)**2))(params)
+        onptest.assert_allclose(grads[0], grad_jax, rtol=1e-4)
@@ -0,0 +1,47 @@
+"""Check that cells split into batches, with a padded tail batch, give the same residual and Jacobian
+as a single batch, with one compiled kernel
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+
+
+def get_problem(**kwargs):
+    meshio_mesh = box_mesh(5, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    return HyperElasticity(mesh, vec=3, dim=3, **kwargs)
+
+
+def get_batch_size(problem, jac_flag):
+    cells_sol = np.zeros((problem.num_total_nodes, problem.vec))[problem.cells]
+    return problem.get_batch_size(jac_flag, cells_sol, problem.unpack_kernels_vars(**problem.internal_vars))
+
+
+def test_tail_batch():
+    problem_ref = get_problem()
+    num_cells = len(problem_ref.cells)
+    assert get_batch_size(problem_ref, True) == num_cells
+
+    # A budget whose batches do not divide the cells, the tail batch is padded
+    budgets = [2.**k for k in range(10, 31)]
+    batch_sizes = [get_batch_size(get_problem(batch_memory_budget=budget), True) for budget in budgets]
+    assert len(set(batch_sizes)) > 1
+    budget, batch_size = [(budget, batch_size) for budget, batch_size in zip(budgets, batch_sizes)
+                          if batch_size < num_cells and num_cells % batch_size != 0][0]
+    problem = get_problem(batch_memory_budget=budget)
+
+    onp.random.seed(0)
+    sol = 0.01*onp.random.rand(problem.num_total_nodes, problem.vec)
+    onptest.assert_allclose(problem.newton_update(sol), problem_ref.newton_update(sol), atol=1e-10)
+    onptest.assert_allclose(problem.csr_data, problem_ref.csr_data, atol=1e-10)
+    onptest.assert_allclose(problem.compute_residual(sol), problem_ref.compute_residual(sol), atol=1e-10)
+
+    # One Jacobian kernel, traced once for all batches
+    jac_keys = [key for key in problem.kernel_cache if key[:2] == ('cell', True)]
+    assert len(jac_keys) == 1 and jac_keys[0][2] == batch_size
+    problem.newton_update(2.*sol)
+    assert problem.kernel_cache[jac_keys[0]]._cache_size() == 1
@@ -0,0 +1,67 @@
+"""Check the cached body force assembly
+"""
+import numpy.testing as onptest
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearPoisson
+
+
+class ScaledSource(LinearPoisson):
+    """The source is replaced by set_params, as in the inverse problems
+    """
+    def set_params(self, scale):
+        self.source_info = lambda point: scale * np.array([point[0], point[1]**2])
+
+
+class TimeDependentSource(LinearPoisson):
+    """The source reads the time t, an attribute
+    """
+    def custom_init(self):
+        self.t = 1.
+        self.source_info = lambda point: self.t * np.array([point[0], 1.])
+
+
+def get_problem(cls, **kwargs):
+    meshio_mesh = box_mesh(3, 3, 2, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    return cls(mesh, vec=2, dim=3, **kwargs)
+
+
+def compute_body_force_repeat(problem):
+    """The formulation with explicit repeats of the shape function values
+    """
+    physical_quad_points = problem.get_physical_quad_points()
+    body_force = np.stack([np.stack([problem.source_info(x) for x in points]) for points in physical_quad_points])
+    v_vals = np.repeat(problem.shape_vals[None, :, :, None], problem.num_cells, axis=0)
+    v_vals = np.repeat(v_vals, problem.vec, axis=-1)
+    rhs_vals = np.sum(v_vals * body_force[:, :, None, :] * problem.JxW[:, :, None, None], axis=1).reshape(-1, problem.vec)
+    rhs = np.zeros((problem.num_total_nodes, problem.vec))
+    return rhs.at[problem.cells.reshape(-1)].add(rhs_vals)
+
+
+def test_body_force():
+    problem = get_problem(ScaledSource)
+    problem.set_params(1.)
+    body_force = problem.compute_body_force_by_fn()
+    onptest.assert_allclose(body_force, compute_body_force_repeat(problem), atol=1e-12)
+    # Cached as long as the source is the same
+    assert problem.compute_body_force_by_fn() is body_force
+
+    # A new source is assembled again
+    problem.set_params(3.)
+    onptest.assert_allclose(problem.compute_body_force_by_fn(), 3. * body_force, atol=1e-12)
+
+
+def test_time_dependent_source():
+    body_forces = {}
+    for time_dependent_source in [False, True]:
+        problem = get_problem(TimeDependentSource, time_dependent_source=time_dependent_source)
+        problem.compute_body_force_by_fn()
+        problem.t = 2.
+        body_forces[time_dependent_source] = problem.compute_body_force_by_fn()
+        onptest.assert_allclose(body_forces[time_dependent_source], compute_body_force_repeat(problem) /
+                                (1. if time_dependent_source else 2.), atol=1e-12)
+    # Evaluated at each call
+    onptest.assert_allclose(body_forces[True], 2. * body_forces[False], atol=1e-12)
@@ -0,0 +1,49 @@
+"""Check the Dirichlet B.C. node cache and value-only updates
+"""
+import numpy.testing as onptest
+import jax
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearElasticity
+from jax_am.fem.solver import assign_bc
+
+
+def test_dirichlet_update():
+    meshio_mesh = box_mesh(3, 3, 2, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    num_searches = [0]
+
+    def left(point):
+        num_searches[0] += 1
+        return np.isclose(point[0], 0., atol=1e-5)
+
+    def right(point):
+        return np.isclose(point[0], 1., atol=1e-5)
+
+    zero = lambda point: 0.
+    get_pull = lambda disp: lambda point: disp*(1. + point[1])
+    dirichlet_bc_info = [[left]*3 + [right], [0, 1, 2, 0], [zero]*3 + [get_pull(0.1)]]
+    problem = LinearElasticity(mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info)
+    assert num_searches[0] == 1
+
+    dirichlet_bc_info[-1][-1] = get_pull(0.2)
+    problem.update_Dirichlet_boundary_conditions(dirichlet_bc_info)
+    assert num_searches[0] == 1
+    vals_list = problem.vals_list
+
+    problem.update_Dirichlet_values(value_fns=dirichlet_bc_info[-1])
+    for vals, vals_ref in zip(problem.vals_list, vals_list):
+        onptest.assert_allclose(vals, vals_ref)
+
+    # Traced values, e.g., a prescribed displacement inside jit
+    @jax.jit
+    def assign(disp):
+        points = mesh.points[problem.node_inds_list[-1]]
+        problem.update_Dirichlet_values(vals_list=[0., 0., 0., disp*(1. + points[:, 1])])
+        return assign_bc(np.zeros(problem.num_total_dofs), problem)
+
+    sol = assign(0.2)
+    onptest.assert_allclose(sol.reshape(-1, 3)[problem.node_inds_list[-1], 0], vals_list[-1])
+    onptest.assert_allclose(sol.reshape(-1, 3)[problem.node_inds_list[0], 0], 0.)
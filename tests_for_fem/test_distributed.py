@@ -0,0 +1,43 @@
+"""Check the mesh partitioning and the distributed solver (on the ranks of the test run, usually one).
+Run with several ranks: mpirun -n 4 python -m pytest tests_for_fem/test_distributed.py
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax.numpy as np
+from petsc4py import PETSc
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+from jax_am.fem.solver import solver
+from jax_am.fem.distributed import partition_cells_rcb, DistributedMesh, distributed_solver
+
+
+def test_partition_cells_rcb():
+    meshio_mesh = box_mesh(6, 5, 4, 1., 1., 1.)
+    points, cells = meshio_mesh.points, meshio_mesh.cells_dict['hexahedron']
+    parts = partition_cells_rcb(points, cells, 3)
+    onptest.assert_array_equal(onp.bincount(parts), [40, 40, 40])
+    # The first cut is normal to the longest (x) extent
+    centroids = onp.mean(points[cells], axis=1)
+    assert onp.max(centroids[parts == 0, 0]) < onp.min(centroids[parts > 0, 0])
+
+
+def test_distributed_solver():
+    meshio_mesh = box_mesh(6, 5, 4, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3, [0, 1, 2], [zero]*3]
+    neumann_bc_info = [[right], [lambda point: np.array([0., 0., -10.])]]
+    cauchy_bc_info = [[right], [lambda u: 0.1*u]]
+    # Only rank 0 needs the full mesh
+    dmesh = DistributedMesh(mesh if PETSc.COMM_WORLD.getRank() == 0 else None, 'HEX8')
+    problem = HyperElasticity(dmesh.local_mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                              neumann_bc_info=neumann_bc_info, cauchy_bc_info=cauchy_bc_info)
+    sol = dmesh.gather(distributed_solver(problem, dmesh))
+    if dmesh.rank == 0:
+        problem = HyperElasticity(mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                                  neumann_bc_info=neumann_bc_info, cauchy_bc_info=cauchy_bc_info)
+        onptest.assert_allclose(sol, solver(problem, use_petsc=True), atol=1e-8)
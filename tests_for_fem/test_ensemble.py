@@ -0,0 +1,108 @@
+"""Check the batched solves of ensemble_solver against one solve per sample
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax
+import jax.numpy as np
+import pytest
+
+from tests_for_fem.elasticity2d_code import Elasticity
+from jax_am.common import box_mesh, rectangle_mesh
+from jax_am.fem.core import FEM
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+from jax_am.fem.solver import solver, ensemble_solver
+
+
+class SymmetricElasticity(Elasticity):
+    def get_energy_density(self):
+        stress = self.get_tensor_map()
+        return lambda u_grad, theta: 0.25 * np.sum(stress(u_grad, theta) * (u_grad + u_grad.T))
+
+
+class RVE(FEM):
+    """Stiff inclusion in a periodic unit cell under a macroscopic displacement gradient H_bar, set by set_params
+    """
+    H_bar = np.zeros((3, 3))
+
+    def custom_init(self):
+        inclusion = np.max(np.abs(self.get_physical_quad_points() - 0.5), axis=-1) < 0.25
+        self.internal_vars = {'laplace': [np.where(inclusion, 1e3, 1e2)]}
+
+    def get_tensor_map(self):
+        def psi(F, E):
+            mu, kappa = E/(2.*(1. + 0.3)), E/(3.*(1. - 2.*0.3))
+            J = np.linalg.det(F)
+            return (mu/2.)*(J**(-2./3.)*np.trace(F.T @ F) - 3.) + (kappa/2.)*(J - 1.)**2.
+        P_fn = jax.grad(psi)
+        return lambda u_grad, E: P_fn(u_grad + np.eye(self.dim) + self.H_bar, E)
+
+    def set_params(self, H_bar):
+        self.H_bar = H_bar
+
+
+def test_dirichlet_values():
+    meshio_mesh = box_mesh(4, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3 + [right], [0, 1, 2, 0], [zero]*3 + [lambda point: 0.1]]
+    problem = HyperElasticity(mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info)
+    vals = np.array([-0.1, 0.05, 0.15])
+    sols = ensemble_solver(problem, vals_lists=[np.zeros(3)]*3 + [vals])
+    # The Dirichlet values of the problem are unchanged
+    onptest.assert_allclose(problem.vals_list[3], 0.1)
+    for sol, val in zip(sols, vals):
+        problem.update_Dirichlet_values(vals_list=[0., 0., 0., val])
+        onptest.assert_allclose(sol, solver(problem), atol=1e-8)
+
+
+@pytest.mark.parametrize('symmetric', [False, True])
+def test_params(symmetric):
+    Lx, Ly = 10., 5.
+    meshio_mesh = rectangle_mesh(Nx=10, Ny=5, domain_x=Lx, domain_y=Ly)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['quad'])
+    fixed = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    load = lambda point: np.isclose(point[0], Lx, atol=1e-5)
+    dirichlet_bc_info = [[fixed]*2, [0, 1], [lambda point: 0.]*2]
+    neumann_bc_info = [[load], [lambda point: np.array([0., -100.])]]
+    cls = SymmetricElasticity if symmetric else Elasticity
+    problem = cls(mesh, vec=2, dim=2, ele_type='QUAD4', dirichlet_bc_info=dirichlet_bc_info,
+                  neumann_bc_info=neumann_bc_info, symmetric=symmetric)
+    params = np.linspace(0.3, 1., 4)[:, None, None] * np.ones((4, 50, 1))
+    sols = ensemble_solver(problem, params=params, linear=True, precond='amg')
+    for sol, sample_params in zip(sols, params):
+        problem.set_params(sample_params)
+        onptest.assert_allclose(sol, solver(problem, linear=True), rtol=1e-6, atol=1e-9)
+
+
+def test_periodic():
+    meshio_mesh = box_mesh(4, 4, 4, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    corner = lambda point: np.isclose(np.linalg.norm(point), 0., atol=1e-5)
+    dirichlet_bc_info = [[corner]*3, [0, 1, 2], [lambda point: 0.]*3]
+    faces_A, faces_B = [], []
+    for i in range(3):
+        faces_A.append(lambda point, i=i: np.isclose(point[i], 0., atol=1e-5))
+        faces_B.append(lambda point, i=i: np.isclose(point[i], 1., atol=1e-5))
+    mappings = [lambda point_A, i=i: point_A + np.eye(3)[i] for i in range(3)]
+    periodic_bc_info = [[fn for fn in faces_A for _ in range(3)], [fn for fn in faces_B for _ in range(3)],
+                        [fn for fn in mappings for _ in range(3)], [0, 1, 2]*3]
+    problem = RVE(mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info, periodic_bc_info=periodic_bc_info)
+
+    # The 8 corners share the Dirichlet dofs of the origin
+    roots = problem.get_periodic_roots()
+    corners = onp.flatnonzero(onp.all(onp.isclose(mesh.points, 0.) | onp.isclose(mesh.points, 1.), axis=1))
+    assert onp.all(roots.reshape(-1, 3)[corners] == problem.node_inds_list[0][0] * 3 + onp.arange(3))
+
+    H_bars = np.array([[[0.02, 0., 0.], [0., -0.01, 0.], [0., 0., 0.]],
+                       [[0., 0.03, 0.], [0.03, 0., 0.], [0., 0., -0.02]]])
+    sols = ensemble_solver(problem, params=H_bars, precond='amg')
+    for sol, H_bar in zip(sols, H_bars):
+        for node_inds_A, node_inds_B, vec_inds in zip(problem.p_node_inds_list_A, problem.p_node_inds_list_B,
+                                                      problem.p_vec_inds_list):
+            onptest.assert_allclose(sol[node_inds_B, vec_inds], sol[node_inds_A, vec_inds], atol=1e-12)
+        assert np.max(np.abs(sol)) > 1e-4
+        problem.set_params(H_bar)
+        onptest.assert_allclose(sol, solver(problem), atol=1e-6)
@@ -0,0 +1,65 @@
+"""Check that geometric factors reused from the cache on a grown mesh agree with a fresh computation
+"""
+import numpy as onp
+import numpy.testing as onptest
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearPoisson
+from jax_am.fem.cache import geometry_cache
+
+
+def get_active_mesh(points, cells, active_cell_truth_tab):
+    active_cells = cells[active_cell_truth_tab]
+    points_map_active = onp.unique(active_cells)
+    points_map_full = onp.zeros(len(points), dtype=onp.int32)
+    points_map_full[points_map_active] = onp.arange(len(points_map_active))
+    return Mesh(points[points_map_active], points_map_full[active_cells])
+
+
+@pytest.fixture
+def enabled_cache():
+    geometry_cache.clear()
+    geometry_cache.max_bytes = 2**30
+    yield geometry_cache
+    geometry_cache.max_bytes = 0
+    geometry_cache.clear()
+
+
+def test_geometry_cache_extension(enabled_cache):
+    meshio_mesh = box_mesh(6, 5, 4, 1., 1., 1.)
+    points = meshio_mesh.points
+    cells = meshio_mesh.cells_dict['hexahedron']
+
+    active_cell_truth_tab = onp.zeros(len(cells), dtype=bool)
+    active_cell_truth_tab[:50] = True
+    LinearPoisson(get_active_mesh(points, cells, active_cell_truth_tab), vec=1, dim=3)
+    active_cell_truth_tab[50:80] = True
+    active_cell_truth_tab[100:103] = True
+    problem = LinearPoisson(get_active_mesh(points, cells, active_cell_truth_tab), vec=1, dim=3)
+    shape_grads, JxW = problem.get_shape_grads()
+
+    onptest.assert_allclose(problem.shape_grads, shape_grads)
+    onptest.assert_allclose(problem.JxW, JxW)
+
+    problem_same_mesh = LinearPoisson(problem.mesh, vec=1, dim=3)
+    assert problem_same_mesh.shape_grads is problem.shape_grads
+
+
+def test_geometry_cache_memory(enabled_cache):
+    meshio_mesh = box_mesh(6, 5, 4, 1., 1., 1.)
+    cells = meshio_mesh.cells_dict['hexahedron']
+    LinearPoisson(Mesh(meshio_mesh.points, cells), vec=1, dim=3)
+    nbytes = enabled_cache.nbytes
+    assert nbytes > 0
+    # Room for one mesh only, the least recently used one is dropped
+    enabled_cache.max_bytes = int(1.5 * nbytes)
+    problem = LinearPoisson(Mesh(meshio_mesh.points + 1., cells), vec=1, dim=3)
+    assert len(enabled_cache.entries) == 1 and enabled_cache.nbytes == nbytes
+    assert LinearPoisson(problem.mesh, vec=1, dim=3).shape_grads is problem.shape_grads
+
+    # Disabled, nothing is kept
+    enabled_cache.max_bytes = 0
+    assert LinearPoisson(problem.mesh, vec=1, dim=3).shape_grads is not problem.shape_grads
+    assert len(enabled_cache.entries) == 0 and enabled_cache.nbytes == 0
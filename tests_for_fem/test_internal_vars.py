@@ -0,0 +1,57 @@
+"""Check the compact internal variable containers against plain quadrature point arrays
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import Mechanics
+from jax_am.fem.internal_vars import SymmetricTensor, CellConstant, GrainConstant, to_voigt, from_voigt
+
+
+class PrestressedElasticity(Mechanics):
+    def get_tensor_map(self):
+        def stress(u_grad, E, sigma_0):
+            nu = 0.3
+            mu = E/(2.*(1. + nu))
+            lmbda = E*nu/((1+nu)*(1-2*nu))
+            epsilon = 0.5*(u_grad + u_grad.T)
+            return lmbda*np.trace(epsilon)*np.eye(self.dim) + 2*mu*epsilon + sigma_0
+        return stress
+
+
+def test_voigt():
+    onp.random.seed(0)
+    A = onp.random.rand(4, 3, 3)
+    A = A + onp.transpose(A, (0, 2, 1))
+    assert to_voigt(A).shape == (4, 6)
+    onptest.assert_allclose(from_voigt(to_voigt(A)), A)
+    onptest.assert_allclose(from_voigt(to_voigt(A[:, :2, :2])), A[:, :2, :2])
+
+
+def test_internal_vars():
+    meshio_mesh = box_mesh(3, 3, 2, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    problem = PrestressedElasticity(mesh, vec=3, dim=3)
+    num_cells, num_quads = problem.num_cells, problem.num_quads
+
+    onp.random.seed(0)
+    grain_inds = onp.random.randint(0, 3, num_cells)
+    grain_E = onp.array([70e3, 100e3, 200e3])
+    sigma_0 = onp.random.rand(num_cells, num_quads, 3, 3)
+    sigma_0 = sigma_0 + onp.transpose(sigma_0, (0, 1, 3, 2))
+    E_quads = onp.repeat(grain_E[grain_inds][:, None], num_quads, axis=1)
+
+    sol = 0.01*onp.random.rand(len(mesh.points), 3)
+    results = []
+    for internal_vars in [[E_quads, sigma_0],
+                          [CellConstant(grain_E[grain_inds]), SymmetricTensor.from_tensor(sigma_0)],
+                          [GrainConstant(grain_E, grain_inds), SymmetricTensor.from_tensor(sigma_0)]]:
+        problem.internal_vars['laplace'] = internal_vars
+        res = problem.newton_update(sol)
+        results.append((onp.array(res), problem.csr_data))
+
+    for res, csr_data in results[1:]:
+        onptest.assert_allclose(res, results[0][0], atol=1e-8)
+        onptest.assert_allclose(csr_data, results[0][1], atol=1e-8)
@@ -0,0 +1,78 @@
+"""Check that attributes read by material maps are not frozen in the compiled kernels
+"""
+import numpy.testing as onptest
+import jax
+import jax.numpy as np
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.core import FEM
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.solver import solver, ad_wrapper
+
+
+class Conduction(FEM):
+    """Conductivity k is an attribute, the Jacobian depends on it
+    """
+    def custom_init(self, k):
+        self.k = k
+
+    def get_tensor_map(self):
+        return lambda u_grad: self.k * u_grad
+
+
+class KernelParamConduction(Conduction):
+    def get_kernel_params(self):
+        return ('k',)
+
+
+class InverseConduction(Conduction):
+    """k is assigned by set_params, with no get_kernel_params
+    """
+    def set_params(self, params):
+        self.k = params
+
+
+def get_problem(cls, k, **kwargs):
+    meshio_mesh = box_mesh(4, 4, 4, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    dirichlet_bc_info = [[left], [0], [lambda point: 0.]]
+    neumann_bc_info = [[right], [lambda point: np.array([1.])]]
+    return cls(mesh, vec=1, dim=3, dirichlet_bc_info=dirichlet_bc_info, neumann_bc_info=neumann_bc_info,
+               additional_info=(k,), **kwargs)
+
+
+@pytest.mark.parametrize('linear_operator', [False, True])
+def test_kernel_params(linear_operator):
+    sol_ref = solver(get_problem(Conduction, 10.), linear=True)
+    problem = get_problem(KernelParamConduction, 1., linear_operator=linear_operator)
+    sol = solver(problem, linear=True)
+    onptest.assert_allclose(sol, 10. * sol_ref, rtol=1e-6)
+    kernels = dict(problem.kernel_cache)
+    problem.k = 10.
+    onptest.assert_allclose(solver(problem, linear=True), sol_ref, rtol=1e-6)
+    # Same compiled kernels
+    assert problem.kernel_cache == kernels
+
+
+def test_invalidate_kernels():
+    sol_ref = solver(get_problem(Conduction, 10.), linear=True)
+    problem = get_problem(Conduction, 1.)
+    solver(problem, linear=True)
+    problem.k = 10.
+    problem.invalidate_kernels()
+    onptest.assert_allclose(solver(problem, linear=True), sol_ref, rtol=1e-6)
+
+
+def test_set_params():
+    sol_ref = solver(get_problem(Conduction, 10.), linear=True)
+    problem = get_problem(InverseConduction, 1.)
+    fwd_pred = ad_wrapper(problem, linear=True)
+    onptest.assert_allclose(fwd_pred(1.), 10. * sol_ref, rtol=1e-6)
+    onptest.assert_allclose(fwd_pred(10.), sol_ref, rtol=1e-6)
+    assert problem.get_kernel_params() == ('k',)
+    # sol is proportional to 1/k
+    grad = jax.grad(lambda k: np.sum(fwd_pred(k)))(10.)
+    onptest.assert_allclose(grad, -np.sum(sol_ref) / 10., rtol=1e-5)
@@ -0,0 +1,119 @@
+"""Check that constant Jacobians are assembled once and give the same solutions as reassembled ones
+"""
+import numpy.testing as onptest
+import jax.numpy as np
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.core import FEM
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearElasticity, HyperElasticity
+from jax_am.fem.solver import solver
+
+
+class Heat(FEM):
+    """Backward Euler step of the heat equation, the old solution enters the body force only
+    """
+    def custom_init(self, dt):
+        self.dt = dt
+
+    def get_tensor_map(self):
+        return lambda u_grad: 10. * u_grad
+
+    def get_mass_map(self):
+        return lambda u: u / self.dt
+
+    def get_body_map(self):
+        return self.get_mass_map()
+
+
+def get_mesh():
+    meshio_mesh = box_mesh(4, 4, 4, 1., 1., 1.)
+    return Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+
+
+def count_assemblies(problem):
+    problem.num_assemblies = 0
+    compute_newton_vars = problem.compute_newton_vars
+
+    def counted_compute_newton_vars(*args, **kwargs):
+        problem.num_assemblies += 1
+        return compute_newton_vars(*args, **kwargs)
+
+    problem.compute_newton_vars = counted_compute_newton_vars
+    return problem
+
+
+@pytest.mark.parametrize('use_petsc', [False, True])
+def test_time_steps(use_petsc):
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    dirichlet_bc_info = [[left], [0], [lambda point: 1.]]
+    neumann_bc_info = [[right], [lambda point: np.array([1.])]]
+    sols = {}
+    for linear_operator in [False, True]:
+        problem = count_assemblies(Heat(get_mesh(), vec=1, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                                        neumann_bc_info=neumann_bc_info, additional_info=(0.1,),
+                                        linear_operator=linear_operator))
+        sol = np.zeros((problem.num_total_nodes, problem.vec))
+        for step in range(3):
+            problem.internal_vars['body'] = sol
+            sol = solver(problem, linear=True, use_petsc=use_petsc)
+        sols[linear_operator] = sol
+        assert problem.num_assemblies == (1 if linear_operator else 6)
+    onptest.assert_allclose(sols[True], sols[False], atol=1e-8)
+
+
+def test_detect_linear_operator():
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3, [0, 1, 2], [zero]*3]
+
+    def get_problem(cls, load, **kwargs):
+        neumann_bc_info = [[right], [lambda point: np.array([0., 0., -load])]]
+        return count_assemblies(cls(get_mesh(), vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                                    neumann_bc_info=neumann_bc_info, **kwargs))
+
+    problem = get_problem(LinearElasticity, 1.)
+    assert problem.is_linear_operator()
+    assert not get_problem(LinearElasticity, 1., linear_operator=False).is_linear_operator()
+    assert not get_problem(HyperElasticity, 1.).is_linear_operator()
+
+    # A new load only changes the right-hand side
+    solver(problem)
+    problem.neumann_value_fns = [lambda point: np.array([0., 0., -2.])]
+    sol = solver(problem)
+    assert problem.num_assemblies == 1
+    sol_ref = solver(get_problem(LinearElasticity, 2., linear_operator=False))
+    onptest.assert_allclose(sol, sol_ref, atol=1e-8)
+
+    # E is a kernel parameter, a new value on the instance reassembles without recompiling
+    kernels = dict(problem.kernel_cache)
+    problem.E = 2. * LinearElasticity.E
+    onptest.assert_allclose(solver(problem), 0.5 * sol_ref, atol=1e-8)
+    assert problem.num_assemblies == 2
+    assert problem.kernel_cache == kernels
+
+
+class Poisson(FEM):
+    def get_tensor_map(self):
+        return lambda u_grad: u_grad
+
+
+@pytest.mark.parametrize('use_petsc', [False, True])
+def test_affine_cauchy(use_petsc):
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    dirichlet_bc_info = [[left], [0], [lambda point: 0.]]
+    # Robin condition, the residual at a zero solution is not zero
+    cauchy_bc_info = [[right], [lambda u: 2. * (u - 1.)]]
+    sols = {}
+    for linear_operator in [False, True]:
+        problem = count_assemblies(Poisson(get_mesh(), vec=1, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                                           cauchy_bc_info=cauchy_bc_info, linear_operator=linear_operator))
+        sols[linear_operator] = [solver(problem, linear=True, use_petsc=use_petsc) for _ in range(2)]
+        assert problem.num_assemblies == (1 if linear_operator else 4)
+    onptest.assert_allclose(np.max(sols[False][0]), 2. / 3., rtol=1e-6)
+    for sol in sols[False] + sols[True]:
+        onptest.assert_allclose(sol, sols[False][0], atol=1e-8)
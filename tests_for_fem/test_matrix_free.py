@@ -0,0 +1,53 @@
+"""Check the matrix-free Newton-Krylov solver against the assembled solver
+"""
+import numpy.testing as onptest
+import jax
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+from jax_am.fem.solver import solver, NewtonOptions
+
+
+def get_problem():
+    meshio_mesh = box_mesh(4, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3, [0, 1, 2], [zero]*3]
+    neumann_bc_info = [[right], [lambda point: np.array([0., 0., -10.])]]
+    cauchy_bc_info = [[right], [lambda u: 0.1*u]]
+    problem = HyperElasticity(mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                              neumann_bc_info=neumann_bc_info, cauchy_bc_info=cauchy_bc_info)
+    return problem
+
+
+def test_matrix_free_solve():
+    problem = get_problem()
+    sol = solver(problem)
+    sol_matrix_free = solver(problem, matrix_free=True)
+    onptest.assert_allclose(sol_matrix_free, sol, atol=1e-10)
+
+
+def test_jacobian_diagonal():
+    """The Jacobi preconditioner from per-node JVPs is the diagonal of the assembled tangent,
+    and evaluating the residual under jit leaves no traced values on the problem
+    """
+    problem = get_problem()
+    sol = 0.01 * jax.random.normal(jax.random.PRNGKey(0), (problem.num_total_nodes, problem.vec))
+    problem.newton_update(sol)
+    diag = problem.compute_jacobian_diagonal(sol, **problem.internal_vars)
+    onptest.assert_allclose(diag.reshape(-1), problem.get_sparsity_pattern().diagonal(problem.csr_data),
+                            rtol=1e-10, atol=1e-10)
+
+    jax.jit(problem.compute_residual)(sol)
+    assert not any(isinstance(x, jax.core.Tracer) for x in vars(problem).values())
+
+
+def test_lagged_jacobi():
+    problem = get_problem()
+    sol = solver(problem)
+    options = NewtonOptions(pc_lag=100)
+    onptest.assert_allclose(solver(problem, matrix_free=True, newton_options=options), sol, atol=1e-10)
@@ -0,0 +1,48 @@
+"""Check the Neumann integral from the cached boundary-face data, also when a child class selects the faces itself
+"""
+import numpy.testing as onptest
+import jax
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearPoisson
+
+
+left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+top = lambda point: np.isclose(point[2], 1., atol=1e-5)
+value_fns = [lambda point: np.array([1. + point[1]]), lambda point: np.array([-2. * point[0]])]
+
+
+class FaceSelection(LinearPoisson):
+    """Boundary faces selected in custom_init, as the thermal model does, without location functions
+    """
+    def custom_init(self):
+        self.neumann_boundary_inds_list = self.get_boundary_conditions_inds([right, top])
+
+
+def get_mesh():
+    meshio_mesh = box_mesh(4, 3, 2, 1., 1., 1.)
+    return Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+
+
+def test_child_face_selection():
+    dirichlet_bc_info = [[left], [0], [lambda point: 0.]]
+    problem = LinearPoisson(get_mesh(), vec=1, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                            neumann_bc_info=[[right, top], value_fns])
+    child = FaceSelection(get_mesh(), vec=1, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                          neumann_bc_info=[None, value_fns])
+    integral = problem.compute_Neumann_integral_vars()
+    onptest.assert_allclose(child.compute_Neumann_integral_vars(), integral, atol=1e-12)
+    # Total fluxes: int_right (1 + y) dA = 1.5, int_top -2x dA = -1
+    onptest.assert_allclose(np.sum(integral), 0.5, rtol=1e-10)
+
+    # Replacing the list rebuilds the face data
+    child.neumann_boundary_inds_list = child.get_boundary_conditions_inds([top, right])
+    child.neumann_value_fns = value_fns[::-1]
+    onptest.assert_allclose(child.compute_Neumann_integral_vars(), integral, atol=1e-12)
+
+    # One scatter for all boundary subsets
+    jaxpr = jax.make_jaxpr(lambda: child.compute_Neumann_integral_vars())()
+    assert sum(eqn.primitive.name == 'scatter-add' for eqn in jaxpr.jaxpr.eqns) == 1
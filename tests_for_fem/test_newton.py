@@ -0,0 +1,95 @@
+"""Check the modified and quasi-Newton tangent updates and the line searches against full Newton
+"""
+import numpy.testing as onptest
+import jax.numpy as np
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+from jax_am.fem.solver import solver, NewtonOptions, get_newton_options
+
+
+def get_problem(load):
+    meshio_mesh = box_mesh(4, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3, [0, 1, 2], [zero]*3]
+    neumann_bc_info = [[right], [lambda point: np.array([0., 0., -load])]]
+    problem = HyperElasticity(mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                              neumann_bc_info=neumann_bc_info)
+    # Count tangent assemblies
+    problem.num_assemblies = 0
+    newton_update = problem.newton_update
+
+    def counted_newton_update(sol):
+        problem.num_assemblies += 1
+        return newton_update(sol)
+
+    problem.newton_update = counted_newton_update
+    return problem
+
+
+def test_get_newton_options():
+    assert get_newton_options().tangent_update == 'newton'
+    assert get_newton_options('bfgs').tangent_update == 'bfgs'
+    options = NewtonOptions('modified', rtol=1e-8)
+    assert get_newton_options(options) is options
+    with pytest.raises(AssertionError):
+        NewtonOptions('secant')
+
+
+@pytest.mark.parametrize('tangent_update', ['modified', 'broyden', 'bfgs'])
+def test_tangent_update(tangent_update):
+    problem = get_problem(10.)
+    sol_ref = solver(problem, newton_options=NewtonOptions(atol=1e-8))
+    num_assemblies_ref = problem.num_assemblies
+
+    problem = get_problem(10.)
+    sol = solver(problem, newton_options=NewtonOptions(tangent_update, atol=1e-8))
+    assert problem.num_assemblies < num_assemblies_ref
+    onptest.assert_allclose(sol, sol_ref, atol=1e-8)
+
+
+def test_reuse_tangent():
+    """Load increments starting from the previous solution and tangent
+    """
+    problem = get_problem(5.)
+    options = NewtonOptions('bfgs', atol=1e-8, contraction_tol=0.9, reuse_tangent=True)
+    sol = solver(problem, newton_options=options)
+    num_assemblies = problem.num_assemblies
+    problem.neumann_value_fns = [lambda point: np.array([0., 0., -6.])]
+    sol = solver(problem, initial_guess=sol, newton_options=options)
+    assert problem.num_assemblies == num_assemblies
+
+    sol_ref = solver(get_problem(6.), newton_options=NewtonOptions(atol=1e-8))
+    onptest.assert_allclose(sol, sol_ref, atol=1e-8)
+
+
+@pytest.mark.parametrize('line_search', ['backtracking', 'cp', 'trust_region'])
+def test_line_search(line_search):
+    sol_ref = solver(get_problem(10.), newton_options=NewtonOptions(atol=1e-8))
+    sol = solver(get_problem(10.), newton_options=NewtonOptions(atol=1e-8, line_search=line_search))
+    onptest.assert_allclose(sol, sol_ref, atol=1e-8)
+
+
+def test_pc_lag():
+    """PETSc objects persist across solves, the preconditioner is rebuilt every pc_lag assemblies
+    """
+    sol_ref = solver(get_problem(10.), use_petsc=True, newton_options=NewtonOptions(atol=1e-8))
+    problem = get_problem(10.)
+    options = NewtonOptions(atol=1e-8, pc_lag=3)
+    sol = solver(problem, use_petsc=True, newton_options=options)
+    onptest.assert_allclose(sol, sol_ref, atol=1e-8)
+    petsc_linear_solver = problem.petsc_linear_solver
+    ksp, A = petsc_linear_solver.ksp, petsc_linear_solver.A
+    assert petsc_linear_solver.num_updates == problem.num_assemblies - 1
+    assert petsc_linear_solver.pc_update == 3 * (petsc_linear_solver.num_updates // 3)
+    # Neither a scipy nor a device copy of the matrix
+    assert 'A_sp_scipy_cache' not in vars(problem) and getattr(problem, 'A_fn_solve', None) is None
+
+    solver(problem, initial_guess=sol, use_petsc=True, newton_options=options)
+    assert problem.petsc_linear_solver is petsc_linear_solver
+    assert petsc_linear_solver.ksp is ksp and petsc_linear_solver.A is A
@@ -0,0 +1,28 @@
+"""Check the periodic node pairing
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax.numpy as np
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearElasticity
+
+
+def test_periodic_pairing():
+    meshio_mesh = box_mesh(3, 4, 2, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    mapping_x = lambda point_A: point_A + np.array([1., 0., 0.])
+    periodic_bc_info = [[left]*3, [right]*3, [mapping_x]*3, [0, 1, 2]]
+    problem = LinearElasticity(mesh, vec=3, dim=3, periodic_bc_info=periodic_bc_info)
+
+    assert len(problem.periodic_pairs_cache) == 1
+    for node_inds_A, node_inds_B in zip(problem.p_node_inds_list_A, problem.p_node_inds_list_B):
+        assert len(node_inds_A) == 5*3
+        onptest.assert_allclose(mesh.points[node_inds_B], mesh.points[node_inds_A] + onp.array([1., 0., 0.]))
+
+    with pytest.raises(ValueError):
+        problem.match_periodic_nodes(left, right, lambda point_A: point_A + np.array([0.5, 0., 0.]))
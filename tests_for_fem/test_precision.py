@@ -0,0 +1,42 @@
+"""Check the mixed precision policies against float64
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax.numpy as np
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+from jax_am.fem.precision import PrecisionPolicy, get_precision_policy
+from jax_am.fem.solver import solver
+
+
+def test_get_precision_policy():
+    assert get_precision_policy().kernel_dtype == onp.float64
+    assert get_precision_policy('mixed').kernel_dtype == onp.float32
+    assert get_precision_policy('mixed_solve').refine
+    policy = PrecisionPolicy(kernel_dtype='float32', solve_dtype='float32')
+    assert get_precision_policy(policy) is policy
+    with pytest.raises(ValueError):
+        get_precision_policy('float16')
+
+
+@pytest.mark.parametrize('precision', ['mixed', 'mixed_solve'])
+def test_mixed_precision_solve(precision):
+    meshio_mesh = box_mesh(4, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3, [0, 1, 2], [zero]*3]
+    neumann_bc_info = [[right], [lambda point: np.array([0., 0., -10.])]]
+    sols = []
+    for p in [None, precision]:
+        problem = HyperElasticity(mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                                  neumann_bc_info=neumann_bc_info, precision=p)
+        sol = solver(problem)
+        # Global quantities stay in float64
+        assert sol.dtype == np.float64 and problem.csr_data.dtype == onp.float64
+        sols.append(sol)
+    onptest.assert_allclose(sols[1], sols[0], atol=1e-5*onp.abs(sols[0]).max())
@@ -0,0 +1,104 @@
+"""Check the preconditioners of the registry on linear elasticity
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax
+import jax.numpy as np
+import pytest
+import scipy
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearElasticity
+from jax_am.fem.solver import solver, get_A_fn
+from jax_am.fem.preconditioners import (get_preconditioner, get_eliminated_matrix, get_rigid_body_modes,
+                                        get_strength_graph, get_aggregates, AMGPreconditioner)
+
+
+def get_problem(n):
+    meshio_mesh = box_mesh(n, n, n, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3, [0, 1, 2], [zero]*3]
+    neumann_bc_info = [[right], [lambda point: np.array([0., 0., -1.])]]
+    return LinearElasticity(mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info,
+                            neumann_bc_info=neumann_bc_info)
+
+
+def pcg_iterations(A, b, pc_fn, tol=1e-8):
+    x, r = onp.zeros_like(b), b.copy()
+    z = pc_fn(r)
+    p, rz = z.copy(), r @ z
+    for i in range(1000):
+        Ap = A @ p
+        alpha = rz / (p @ Ap)
+        x, r = x + alpha * p, r - alpha * Ap
+        if onp.linalg.norm(r) < tol * onp.linalg.norm(b):
+            return i + 1
+        z = pc_fn(r)
+        p, rz = z + (r @ z) / rz * p, r @ z
+    return i + 1
+
+
+def test_rigid_body_modes():
+    problem = get_problem(3)
+    problem.newton_update(np.zeros((problem.num_total_nodes, problem.vec)))
+    get_A_fn(problem, False)
+    A = problem.A_sp_scipy
+    modes = get_rigid_body_modes(problem.points, problem.vec)
+    assert modes.shape == (problem.num_total_dofs, 6)
+    onptest.assert_allclose(A @ modes, 0., atol=1e-8 * abs(A).max())
+
+
+@pytest.mark.parametrize('precond', ['jacobi', 'block_jacobi', 'ilu0', 'amg'])
+@pytest.mark.parametrize('use_petsc', [False, True])
+def test_preconditioner(precond, use_petsc):
+    sol_ref = solver(get_problem(4), linear=True, precond=False)
+    sol = solver(get_problem(4), linear=True, precond=precond, use_petsc=use_petsc)
+    onptest.assert_allclose(sol, sol_ref, atol=1e-7)
+
+
+def test_amg_iterations():
+    """Iterations of AMG-preconditioned CG barely grow with the mesh size, unlike those of Jacobi
+    """
+    iterations = {}
+    for n in [4, 8]:
+        problem = get_problem(n)
+        problem.newton_update(np.zeros((problem.num_total_nodes, problem.vec)))
+        get_A_fn(problem, False)
+        A = get_eliminated_matrix(problem)
+        b = onp.random.default_rng(0).random(A.shape[0])
+        # Small coarsest level, so that both meshes have several levels
+        for name, precond in [('jacobi', 'jacobi'), ('amg', AMGPreconditioner(max_coarse=50))]:
+            apply = jax.jit(get_preconditioner(precond).setup(problem, onp.float64).apply)
+            iterations[name, n] = pcg_iterations(A, b, lambda x: onp.asarray(apply(x)))
+    assert iterations['amg', 8] < iterations['jacobi', 8] / 3
+    assert iterations['amg', 8] < 1.5 * iterations['amg', 4]
+
+
+def test_aggregates():
+    problem = get_problem(8)
+    problem.newton_update(np.zeros((problem.num_total_nodes, problem.vec)))
+    get_A_fn(problem, False)
+    C = get_strength_graph(get_eliminated_matrix(problem), onp.arange(problem.num_total_dofs) // problem.vec, 0.)
+    aggregates = get_aggregates(C)
+    # Nodes without strong connections (the Dirichlet nodes) only are left out
+    onptest.assert_array_equal(aggregates >= 0, onp.diff(C.indptr) > 0)
+    # Each aggregate is connected
+    C = scipy.sparse.coo_array(C)
+    inside = (aggregates[C.row] == aggregates[C.col]) & (aggregates[C.row] >= 0)
+    C_inside = scipy.sparse.coo_array((C.data[inside], (C.row[inside], C.col[inside])), shape=C.shape)
+    num_components = scipy.sparse.csgraph.connected_components(C_inside)[0]
+    assert num_components == aggregates.max() + 1 + onp.sum(aggregates < 0)
+
+
+def test_amg_coarse_smoother():
+    """The coarsest level is smoothed instead of solved if coarsening stops above max_coarse
+    """
+    precond = AMGPreconditioner(max_coarse=10, max_levels=2)
+    sol_ref = solver(get_problem(4), linear=True, precond=False)
+    sol = solver(get_problem(4), linear=True, precond=precond)
+    assert len(precond.levels) == 1 and precond.coarse_inv is None
+    onptest.assert_allclose(sol, sol_ref, atol=1e-7)
@@ -0,0 +1,69 @@
+"""Check the selectable quadrature rules
+"""
+import numpy as onp
+import numpy.testing as onptest
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.basis import get_gauss_order
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearElasticity
+
+
+def get_mesh():
+    meshio_mesh = box_mesh(3, 3, 2, 1., 1., 1.)
+    return Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+
+
+def test_gauss_order():
+    assert get_gauss_order('HEX8') == get_gauss_order('HEX8', 'full') == 2
+    assert get_gauss_order('HEX8', 'reduced') == 0
+    assert get_gauss_order('HEX27', 'full') == 4
+    assert get_gauss_order('TET10', 'full') == 2
+    assert get_gauss_order('HEX8', 3) == 3
+    with pytest.raises(ValueError):
+        get_gauss_order('HEX8', 'exact')
+
+
+def test_quadrature_order():
+    """On affine cells, any rule at least as accurate as the full rule gives the same residual and Jacobian
+    """
+    mesh = get_mesh()
+    onp.random.seed(0)
+    sol = onp.random.rand(len(mesh.points), 3)
+    results = []
+    for quadrature in ['full', 5]:
+        problem = LinearElasticity(mesh, vec=3, dim=3, quadrature=quadrature)
+        res = problem.newton_update(sol)
+        results.append((onp.array(res), problem.csr_data))
+    assert problem.num_quads == 27
+    onptest.assert_allclose(results[1][0], results[0][0], atol=1e-8*onp.abs(results[0][0]).max())
+    onptest.assert_allclose(results[1][1], results[0][1], atol=1e-8*onp.abs(results[0][1]).max())
+
+
+class NearlyIncompressibleElasticity(LinearElasticity):
+    E = 10e3
+    nu = 0.45
+
+
+@pytest.mark.parametrize('cls', [LinearElasticity, NearlyIncompressibleElasticity])
+@pytest.mark.parametrize('sum_factorization', [False, True])
+def test_selective_integration(sum_factorization, cls):
+    mesh = get_mesh()
+    full = cls(mesh, vec=3, dim=3, sum_factorization=sum_factorization)
+    selective = cls(mesh, vec=3, dim=3, quadrature='selective', sum_factorization=sum_factorization)
+    assert selective.vol_shape_grads.shape == (full.num_cells, 1, full.num_nodes, 3)
+
+    # Linear displacements have constant strains, integrated exactly by both rules
+    sol = mesh.points @ onp.array([[0.1, 0.02, 0.], [0., -0.05, 0.03], [0.01, 0., 0.2]])
+    onptest.assert_allclose(selective.compute_residual(sol), full.compute_residual(sol), atol=1e-8)
+
+    # The volumetric part of the tangent has rank one per cell with a single point
+    onp.random.seed(0)
+    sol = onp.random.rand(len(mesh.points), 3)
+    full.newton_update(sol)
+    selective.newton_update(sol)
+    A = full.sparsity.to_scipy(full.csr_data).toarray()
+    A_selective = selective.sparsity.to_scipy(selective.csr_data).toarray()
+    onptest.assert_allclose(A_selective, A_selective.T, atol=1e-8*onp.abs(A).max())
+    assert onp.linalg.eigvalsh(A_selective).sum() < onp.linalg.eigvalsh(A).sum()
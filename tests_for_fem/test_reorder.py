@@ -0,0 +1,40 @@
+"""Check that a solve on a reordered mesh, mapped back, agrees with the solve on the original mesh
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearElasticity
+from jax_am.fem.solver import solver
+
+
+def get_bandwidth(cells):
+    return max([onp.max(cell) - onp.min(cell) for cell in cells])
+
+
+def test_reorder():
+    meshio_mesh = box_mesh(5, 4, 3, 1., 1., 1.)
+    points, cells = meshio_mesh.points, meshio_mesh.cells_dict['hexahedron']
+    # Shuffled node numbering, as produced by some mesh generators
+    onp.random.seed(0)
+    shuffle = onp.random.permutation(len(points))
+    mesh = Mesh(points[shuffle], onp.argsort(shuffle)[cells])
+    reordered_mesh = mesh.reorder()
+
+    assert get_bandwidth(reordered_mesh.cells) < get_bandwidth(mesh.cells)
+    original_points, original_cells = reordered_mesh.get_original_mesh()
+    onptest.assert_array_equal(original_points, mesh.points)
+    onptest.assert_array_equal(original_cells, mesh.cells)
+
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3, [0, 1, 2], [zero]*3]
+    neumann_bc_info = [[right], [lambda point: np.array([0., 0., -10.])]]
+    sols = []
+    for m in [mesh, reordered_mesh]:
+        problem = LinearElasticity(m, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info, neumann_bc_info=neumann_bc_info)
+        sols.append(m.to_original_nodes(onp.asarray(solver(problem))))
+    onptest.assert_allclose(sols[1], sols[0], atol=1e-10)
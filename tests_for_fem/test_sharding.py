@@ -0,0 +1,32 @@
+"""Check the assembly sharded over several (fake CPU) devices against the single device assembly
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax
+import jax.numpy as np
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+
+
+@pytest.mark.skipif(len(jax.local_devices()) < 3, reason="needs several local devices, see conftest.py")
+@pytest.mark.parametrize('symmetric', [False, True])
+def test_sharded_assembly(symmetric):
+    meshio_mesh = box_mesh(4, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    cauchy_bc_info = None if symmetric else [[right], [lambda u: 0.1*u]]
+    onp.random.seed(0)
+    sol = 0.05*onp.random.rand(len(mesh.points), 3)
+    results = []
+    # A small memory budget, so that each device computes several batches
+    for num_devices in [None, 3]:
+        problem = HyperElasticity(mesh, vec=3, dim=3, cauchy_bc_info=cauchy_bc_info, symmetric=symmetric,
+                                  num_devices=num_devices, batch_memory_budget=2.**20)
+        res = problem.newton_update(sol)
+        results.append((onp.array(res), problem.csr_data, onp.array(problem.compute_residual(sol))))
+
+    for i in range(3):
+        onptest.assert_allclose(results[1][i], results[0][i], atol=1e-12*onp.abs(results[0][i]).max())
@@ -0,0 +1,43 @@
+"""Check the cached sparsity pattern against scipy COO to CSR conversion
+"""
+import numpy as onp
+import numpy.testing as onptest
+import scipy
+
+from jax_am.common import rectangle_mesh
+from jax_am.fem.sparsity import SparsityPattern
+
+
+def test_sparsity_pattern():
+    meshio_mesh = rectangle_mesh(Nx=7, Ny=5, domain_x=1., domain_y=1.)
+    cells = meshio_mesh.cells_dict['quad']
+    num_total_nodes = len(meshio_mesh.points)
+    vec = 2
+    num_total_dofs = num_total_nodes*vec
+    num_nodes = cells.shape[1]
+
+    onp.random.seed(0)
+    cells_jac = onp.random.rand(len(cells), num_nodes, vec, num_nodes, vec)
+
+    inds = (vec*cells[:, :, None] + onp.arange(vec)[None, None, :]).reshape(len(cells), -1)
+    I = onp.repeat(inds[:, :, None], num_nodes*vec, axis=2).reshape(-1)
+    J = onp.repeat(inds[:, None, :], num_nodes*vec, axis=1).reshape(-1)
+    A_ref = scipy.sparse.csr_array((cells_jac.reshape(-1), (I, J)), shape=(num_total_dofs, num_total_dofs))
+    A_ref.sum_duplicates()
+
+    sparsity = SparsityPattern(cells, vec, num_total_dofs)
+    A = sparsity.to_scipy(sparsity.assemble(cells_jac))
+
+    onptest.assert_array_equal(A.indptr, A_ref.indptr)
+    onptest.assert_array_equal(A.indices, A_ref.indices)
+    onptest.assert_allclose(A.data, A_ref.data)
+    onptest.assert_allclose(sparsity.diagonal(A.data), A_ref.diagonal())
+
+    # Subset of cells, e.g., cells with Cauchy boundary faces
+    selected = onp.array([0, 3, 11])
+    face_scatter_inds = sparsity.locate(cells[selected])
+    data = sparsity.assemble(cells_jac[selected], face_scatter_inds)
+    A_sub_ref = scipy.sparse.csr_array((cells_jac[selected].reshape(-1),
+        (I.reshape(len(cells), -1)[selected].reshape(-1), J.reshape(len(cells), -1)[selected].reshape(-1))),
+        shape=(num_total_dofs, num_total_dofs))
+    onptest.assert_allclose((sparsity.to_scipy(data) - A_sub_ref).toarray(), 0., atol=1e-12)
@@ -0,0 +1,45 @@
+"""Check the sum-factorized cell kernels against the dense cell kernels
+"""
+import basix
+import numpy as onp
+import numpy.testing as onptest
+import pytest
+
+from jax_am.common import box_mesh
+from jax_am.fem.basis import get_elements
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+
+
+def hex27_box_mesh(N):
+    """Structured HEX27 mesh of the unit cube, nodes of each cell in meshio ordering
+    """
+    _, _, _, _, _, re_order = get_elements('HEX27')
+    ref_points = basix.create_element(basix.ElementFamily.P, basix.CellType.hexahedron, 2).points[re_order]
+    cell_points = onp.stack([(ref_points + onp.array([i, j, k]))/N
+                             for i in range(N) for j in range(N) for k in range(N)])
+    keys = onp.round(cell_points.reshape(-1, 3)*1e6).astype(onp.int64)
+    unique_keys, cells = onp.unique(keys, axis=0, return_inverse=True)
+    return unique_keys/1e6, cells.reshape(-1, 27)
+
+
+@pytest.mark.parametrize('ele_type', ['HEX8', 'HEX27'])
+def test_sum_factorization(ele_type):
+    if ele_type == 'HEX8':
+        meshio_mesh = box_mesh(3, 3, 2, 1., 1., 1.)
+        points, cells = meshio_mesh.points, meshio_mesh.cells_dict['hexahedron']
+    else:
+        points, cells = hex27_box_mesh(2)
+    # Distorted cells so that inverse Jacobians vary between quadrature points
+    mesh = Mesh(points + 0.05*onp.sin(3.*points), cells)
+
+    onp.random.seed(0)
+    sol = 0.05*onp.random.rand(len(points), 3)
+    results = []
+    for sum_factorization in [False, True]:
+        problem = HyperElasticity(mesh, vec=3, dim=3, ele_type=ele_type, sum_factorization=sum_factorization)
+        res = problem.newton_update(sol)
+        results.append((onp.array(res), problem.csr_data))
+
+    onptest.assert_allclose(results[1][0], results[0][0], atol=1e-10)
+    onptest.assert_allclose(results[1][1], results[0][1], atol=1e-10*onp.abs(results[0][1]).max())
@@ -0,0 +1,64 @@
+"""Check the symmetric (energy-based) assembly against the default assembly
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity, LinearElasticity
+from jax_am.fem.solver import solver, symmetric_bc_rhs, copy_bc
+
+
+def get_problems(problem_class, **kwargs):
+    meshio_mesh = box_mesh(3, 3, 2, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    return [problem_class(mesh, vec=3, dim=3, symmetric=symmetric, **kwargs) for symmetric in [False, True]]
+
+
+def test_symmetric_hessian():
+    problem, problem_sym = get_problems(HyperElasticity)
+    onp.random.seed(0)
+    sol = 0.01*onp.random.rand(problem.num_total_nodes, problem.vec)
+    res = problem.newton_update(sol)
+    res_sym = problem_sym.newton_update(sol)
+    onptest.assert_allclose(res_sym, res, atol=1e-10)
+
+    # Only the upper triangle is stored
+    assert len(problem_sym.csr_data) == (len(problem.csr_data) + problem.num_total_dofs)//2
+
+    A = problem.sparsity.to_scipy(problem.csr_data)
+    A_sym = problem_sym.sparsity.to_scipy(problem_sym.csr_data)
+    onptest.assert_allclose(A_sym.toarray(), A.toarray(), atol=1e-8)
+
+
+def test_symmetric_solve():
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3 + [right], [0, 1, 2, 0], [zero]*3 + [lambda point: 0.01]]
+    problem, problem_sym = get_problems(LinearElasticity, dirichlet_bc_info=dirichlet_bc_info)
+    sol = solver(problem, linear=True)
+    sol_sym = solver(problem_sym, linear=True)
+    onptest.assert_allclose(sol_sym, sol, atol=1e-8)
+
+
+def test_symmetric_bc_rhs():
+    """The eliminated columns are applied from the stored upper triangle, the full scipy matrix
+    is only built for a preconditioner setup
+    """
+    left = lambda point: np.isclose(point[0], 0., atol=1e-5)
+    right = lambda point: np.isclose(point[0], 1., atol=1e-5)
+    zero = lambda point: 0.
+    dirichlet_bc_info = [[left]*3 + [right], [0, 1, 2, 0], [zero]*3 + [lambda point: 0.01]]
+    problem, problem_sym = get_problems(LinearElasticity, dirichlet_bc_info=dirichlet_bc_info)
+    sol = solver(problem, linear=True)
+    sol_sym = solver(problem_sym, linear=True, precond=False)
+    onptest.assert_allclose(sol_sym, sol, atol=1e-8)
+    assert 'A_sp_scipy_cache' not in vars(problem_sym)
+
+    b = onp.random.rand(problem_sym.num_total_dofs)
+    bc_part = onp.array(copy_bc(b, problem_sym))
+    b_ref = b - problem_sym.A_sp_scipy @ bc_part
+    b_ref = b_ref - onp.array(copy_bc(b_ref, problem_sym)) + bc_part
+    onptest.assert_allclose(symmetric_bc_rhs(problem_sym, b), b_ref, atol=1e-10)
@@ -0,0 +1,37 @@
+"""Check the mesh topology (face adjacency, external faces, node-to-cell map)
+"""
+import numpy as onp
+import numpy.testing as onptest
+import jax.numpy as np
+
+from jax_am.common import box_mesh
+from jax_am.fem.generate_mesh import Mesh
+
+
+def test_topology():
+    meshio_mesh = box_mesh(3, 3, 2, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'], ele_type='HEX8')
+    topology = mesh.get_topology()
+
+    num_interior_faces = 2*3*2 + 3*2*2 + 3*3*1
+    assert len(topology.face_counts) == 2*(3*3 + 3*2 + 3*2) + num_interior_faces
+    assert onp.sum(topology.face_cells[:, 1] >= 0) == num_interior_faces
+    external_faces = topology.get_external_faces()
+    assert len(external_faces) == 2*(3*3 + 3*2 + 3*2)
+
+    # Node-to-cell map
+    for node in [0, 5, len(mesh.points) - 1]:
+        node_cells = topology.node_cells[topology.node_cells_indptr[node]:topology.node_cells_indptr[node + 1]]
+        onptest.assert_array_equal(node_cells, onp.argwhere(onp.any(mesh.cells == node, axis=1)).reshape(-1))
+
+    # Activating cells incrementally gives the same external faces
+    centroids = onp.mean(mesh.points[mesh.cells], axis=1)
+    active_old = centroids[:, 2] < 0.5
+    active_new = centroids[:, 2] < 1.
+    face_counts = topology.count_faces(onp.argwhere(active_old).reshape(-1))
+    face_counts = topology.count_faces(onp.argwhere(active_new & ~active_old).reshape(-1), face_counts)
+    onptest.assert_array_equal(topology.get_external_faces(active_new, face_counts), external_faces)
+    assert len(topology.get_external_faces(active_old)) == 2*3*3 + 4*3
+
+    bottom = lambda point: np.isclose(point[2], 0., atol=1e-5)
+    assert mesh.count_selected_faces(bottom) == 3*3